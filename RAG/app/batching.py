@@ -0,0 +1,152 @@
+# app/batching.py
+
+import time
+import queue
+import asyncio
+import logging
+import threading
+from collections import Counter
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """
+    Dynamic micro-batching in front of a batch function (e.g. a transformer forward pass).
+
+    Concurrent callers submit small lists of items. A single worker thread collects
+    submissions for up to max_wait_ms, or until max_batch_size items are waiting, runs
+    batch_fn once on all of them and fans the results back to the callers.
+    """
+
+    def __init__(self, name, batch_fn, max_batch_size=32, max_wait_ms=5.0):
+        """
+        Parameters:
+        name (str): Name used in logs and metrics.
+        batch_fn (callable): Maps a list of items to a sequence of results of the same length.
+        max_batch_size (int): Maximum number of items per batch (a single larger submission still runs whole).
+        max_wait_ms (float): Maximum time the first submission of a batch waits for company.
+        """
+        self.name = name
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._worker = None
+        self._lock = threading.Lock()
+
+        # Metrics
+        self._batches = 0
+        self._items = 0
+        self._submissions = 0
+        self._batch_sizes = Counter()
+        self._queue_delay_total = 0.0
+        self._queue_delay_max = 0.0
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name=f"batcher-{self.name}", daemon=True)
+                self._worker.start()
+
+    def _enqueue(self, items):
+        future = Future()
+        if not items:
+            future.set_result([])
+            return future
+        self._ensure_worker()
+        self._queue.put((list(items), future, time.perf_counter()))
+        return future
+
+    def submit(self, items):
+        """Submit items and block until their results are ready."""
+        return self._enqueue(items).result()
+
+    async def asubmit(self, items):
+        """Submit items and await their results without blocking the event loop."""
+        return await asyncio.wrap_future(self._enqueue(items))
+
+    def _take(self, timeout=None):
+        """
+        Take the next submission that was not cancelled, or None when the wait expires.
+        Taken futures are marked running, so they can no longer be cancelled.
+        """
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        while True:
+            remaining = None if deadline is None else deadline - time.perf_counter()
+            if remaining is not None and remaining <= 0:
+                return None
+            try:
+                submission = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                return None
+            # Callers awaiting through asubmit cancel their future when they are cancelled
+            if submission[1].set_running_or_notify_cancel():
+                return submission
+
+    def _collect(self):
+        """Block for the first submission, then gather more until the batch is full or the wait expires."""
+        batch = [self._take()]
+        size = len(batch[0][0])
+        deadline = time.perf_counter() + self.max_wait
+        while size < self.max_batch_size:
+            submission = self._take(deadline - time.perf_counter())
+            if submission is None:
+                break
+            batch.append(submission)
+            size += len(submission[0])
+        return batch, size
+
+    def _run(self):
+        while True:
+            try:
+                self._run_batch()
+            except Exception as e:
+                # Keep serving the other submissions whatever happens to one batch
+                logger.exception(f"Unexpected error in {self.name} batcher: {e}")
+
+    def _run_batch(self):
+        batch, size = self._collect()
+        started = time.perf_counter()
+        flat_items = [item for items, _, _ in batch for item in items]
+        try:
+            results = self.batch_fn(flat_items)
+            offset = 0
+            for items, future, _ in batch:
+                if not future.done():
+                    future.set_result(results[offset:offset + len(items)])
+                offset += len(items)
+        except Exception as e:
+            logger.error(f"Batch of {size} items failed in {self.name} batcher: {e}")
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self._record(batch, size, started)
+
+    def _record(self, batch, size, started):
+        with self._lock:
+            self._batches += 1
+            self._items += size
+            self._batch_sizes[size] += 1
+            self._submissions += len(batch)
+            for _, _, enqueued in batch:
+                delay = started - enqueued
+                self._queue_delay_total += delay
+                self._queue_delay_max = max(self._queue_delay_max, delay)
+
+    def metrics(self):
+        """Batch-size and queue-delay statistics since startup."""
+        with self._lock:
+            return {
+                "batches": self._batches,
+                "items": self._items,
+                "mean_batch_size": self._items / self._batches if self._batches else 0.0,
+                "batch_size_histogram": dict(sorted(self._batch_sizes.items())),
+                "mean_queue_delay_ms": 1000.0 * self._queue_delay_total / self._submissions if self._submissions else 0.0,
+                "max_queue_delay_ms": 1000.0 * self._queue_delay_max,
+                "queue_depth": self._queue.qsize(),
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": 1000.0 * self.max_wait,
+            }
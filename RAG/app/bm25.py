@@ -0,0 +1,253 @@
+# app/bm25.py
+
+import os
+import json
+import math
+import logging
+from collections import Counter
+import numpy as np
+from scipy import sparse
+
+logger = logging.getLogger(__name__)
+
+# Same defaults as rank_bm25.BM25Okapi
+K1 = 1.5
+B = 0.75
+EPSILON = 0.25
+
+VOCAB_FILE = "vocab.json"
+
+
+def top_k_indices(scores, k):
+    """
+    Return the positions of the k highest scores, best first, using argpartition
+    instead of a full sort.
+    """
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < len(scores):
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+
+class SparseBM25:
+    """
+    Okapi BM25 over a CSR term-document matrix.
+
+    Every (term, document) weight idf * tf * (k1 + 1) / (tf + k1 * norm) is precomputed,
+    so scoring a query is a single sparse mat-vec over the postings of its terms.
+    Scores are identical to rank_bm25.BM25Okapi for the same tokenized corpus.
+    """
+
+    def __init__(self, vocab, term_freqs, doc_len, k1=K1, b=B, epsilon=EPSILON, weights=None):
+        """
+        Parameters:
+        vocab (list): Term strings; the position of a term is its row in term_freqs.
+        term_freqs (scipy.sparse.csr_matrix): Term frequencies, shape (n_terms, n_docs).
+        doc_len (np.ndarray): Number of tokens in each document.
+        weights (scipy.sparse.csr_matrix): Precomputed BM25 weights, computed when None.
+        """
+        self.vocab = list(vocab)
+        self.term_ids = {term: i for i, term in enumerate(self.vocab)}
+        self.term_freqs = term_freqs
+        self.doc_len = doc_len
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+        self.corpus_size = term_freqs.shape[1]
+        self.avgdl = float(np.sum(doc_len)) / self.corpus_size if self.corpus_size else 0.0
+        self.doc_freqs = np.diff(term_freqs.indptr)
+        self.idf = self._calc_idf(self.doc_freqs)
+        self.weights = weights if weights is not None else self._calc_weights()
+
+    @classmethod
+    def from_corpus(cls, tokenized_corpus, **params):
+        """Build the engine from a list of tokenized documents."""
+        vocab = {}
+        rows, cols, counts = [], [], []
+        doc_len = np.zeros(len(tokenized_corpus), dtype=np.int64)
+        for doc_id, tokens in enumerate(tokenized_corpus):
+            doc_len[doc_id] = len(tokens)
+            for term, count in Counter(tokens).items():
+                rows.append(vocab.setdefault(term, len(vocab)))
+                cols.append(doc_id)
+                counts.append(count)
+        term_freqs = sparse.csr_matrix(
+            (np.asarray(counts, dtype=np.float64), (np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64))),
+            shape=(len(vocab), len(tokenized_corpus)),
+        )
+        term_freqs.sort_indices()
+        return cls(list(vocab), term_freqs, doc_len, **params)
+
+    def update(self, keep_ids, new_tokenized_corpus):
+        """
+        Build the engine for an edited corpus: the kept documents, in order, followed by
+        new ones. Term frequencies of kept documents are reused, only the new documents
+        are counted, and IDF and weights are recomputed from the merged matrix.
+
+        Parameters:
+        keep_ids (array-like): Ids of the documents to keep, in increasing order.
+        new_tokenized_corpus (list): Tokenized documents appended after the kept ones.
+
+        Returns:
+        SparseBM25: A new engine; this one is left unchanged.
+        """
+        keep_ids = np.asarray(keep_ids, dtype=np.int64)
+        vocab = list(self.vocab)
+        term_ids = dict(self.term_ids)
+        rows, cols, counts = [], [], []
+        for doc_id, tokens in enumerate(new_tokenized_corpus):
+            for term, count in Counter(tokens).items():
+                if term not in term_ids:
+                    term_ids[term] = len(vocab)
+                    vocab.append(term)
+                rows.append(term_ids[term])
+                cols.append(doc_id)
+                counts.append(count)
+
+        kept = sparse.csr_matrix(self.term_freqs[:, keep_ids])
+        kept.resize((len(vocab), len(keep_ids)))
+        added = sparse.csr_matrix(
+            (np.asarray(counts, dtype=np.float64), (np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64))),
+            shape=(len(vocab), len(new_tokenized_corpus)),
+        )
+        term_freqs = sparse.hstack([kept, added], format="csr")
+
+        # Drop terms that no longer occur, as a rebuild from scratch would
+        present = np.diff(term_freqs.indptr) > 0
+        if not present.all():
+            term_freqs = term_freqs[present]
+            vocab = [term for term, keep in zip(vocab, present.tolist()) if keep]
+        term_freqs.sort_indices()
+
+        doc_len = np.concatenate([
+            np.asarray(self.doc_len)[keep_ids],
+            np.array([len(tokens) for tokens in new_tokenized_corpus], dtype=np.int64),
+        ])
+        return type(self)(vocab, term_freqs, doc_len, k1=self.k1, b=self.b, epsilon=self.epsilon)
+
+    def _calc_idf(self, doc_freqs):
+        """IDF with the same negative-IDF flooring as rank_bm25.BM25Okapi."""
+        if len(doc_freqs) == 0:
+            return np.zeros(0)
+        idf = np.log(self.corpus_size - doc_freqs + 0.5) - np.log(doc_freqs + 0.5)
+        average_idf = math.fsum(idf.tolist()) / len(idf)
+        idf[idf < 0] = self.epsilon * average_idf
+        return idf
+
+    def _calc_weights(self):
+        """Precompute the BM25 contribution of every posting."""
+        tf = self.term_freqs.data
+        term_of_posting = np.repeat(np.arange(len(self.vocab)), self.doc_freqs)
+        length_norm = self.k1 * (1 - self.b + self.b * self.doc_len[self.term_freqs.indices] / self.avgdl)
+        data = self.idf[term_of_posting] * (tf * (self.k1 + 1) / (tf + length_norm))
+        return sparse.csr_matrix((data, self.term_freqs.indices, self.term_freqs.indptr), shape=self.term_freqs.shape)
+
+    def _query_vector(self, query_tokens):
+        """Map query tokens to (term ids, counts); repeated tokens count once per occurrence."""
+        counts = Counter(token for token in query_tokens if token in self.term_ids)
+        term_ids = np.fromiter((self.term_ids[token] for token in counts), dtype=np.int64, count=len(counts))
+        return term_ids, np.fromiter(counts.values(), dtype=np.float64, count=len(counts))
+
+    def get_scores(self, query_tokens, doc_ids=None):
+        """
+        Score a tokenized query.
+
+        Parameters:
+        query_tokens (list): The tokenized query.
+        doc_ids (array-like): Restrict the result to these documents. All documents when None.
+
+        Returns:
+        np.ndarray: One score per document (or per entry of doc_ids).
+        """
+        term_ids, counts = self._query_vector(query_tokens)
+        if len(term_ids) == 0:
+            scores = np.zeros(self.corpus_size)
+        else:
+            scores = self.weights[term_ids].T @ counts
+        return scores if doc_ids is None else scores[np.asarray(doc_ids, dtype=np.int64)]
+
+    def top_k(self, query_tokens, k, doc_ids=None):
+        """
+        Return the k best documents for a tokenized query.
+
+        Parameters:
+        query_tokens (list): The tokenized query.
+        k (int): Number of documents to return.
+        doc_ids (array-like): Only rank these documents (e.g. the routed codes). All documents when None.
+
+        Returns:
+        tuple: (document ids, scores), best first.
+        """
+        scores = self.get_scores(query_tokens, doc_ids)
+        best = top_k_indices(scores, k)
+        ids = best if doc_ids is None else np.asarray(doc_ids, dtype=np.int64)[best]
+        return ids, scores[best]
+
+    def to_okapi(self):
+        """Rebuild an equivalent rank_bm25.BM25Okapi, e.g. to A/B the two engines."""
+        from rank_bm25 import BM25Okapi
+
+        csc = self.term_freqs.tocsc()
+        corpus = []
+        for doc_id in range(self.corpus_size):
+            start, end = csc.indptr[doc_id], csc.indptr[doc_id + 1]
+            corpus.append([
+                self.vocab[term_id]
+                for term_id, tf in zip(csc.indices[start:end], csc.data[start:end])
+                for _ in range(int(tf))
+            ])
+        return BM25Okapi(corpus, k1=self.k1, b=self.b, epsilon=self.epsilon)
+
+    def save(self, directory):
+        """Write the engine as plain arrays that load() can memory-map."""
+        os.makedirs(directory, exist_ok=True)
+        for name, matrix in (("tf", self.term_freqs), ("weights", self.weights)):
+            np.save(os.path.join(directory, f"{name}_data.npy"), matrix.data)
+        np.save(os.path.join(directory, "indices.npy"), self.term_freqs.indices)
+        np.save(os.path.join(directory, "indptr.npy"), self.term_freqs.indptr)
+        np.save(os.path.join(directory, "doc_len.npy"), self.doc_len)
+        with open(os.path.join(directory, VOCAB_FILE), "w", encoding="utf-8") as f:
+            json.dump({"k1": self.k1, "b": self.b, "epsilon": self.epsilon, "vocab": self.vocab}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        """Load an engine written by save(), memory-mapping the posting arrays."""
+        def array(name):
+            return np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode)
+
+        with open(os.path.join(directory, VOCAB_FILE), "r", encoding="utf-8") as f:
+            config = json.load(f)
+        indices, indptr = array("indices"), array("indptr")
+        shape = (len(config["vocab"]), len(array("doc_len")))
+        term_freqs = sparse.csr_matrix((array("tf_data"), indices, indptr), shape=shape, copy=False)
+        weights = sparse.csr_matrix((array("weights_data"), indices, indptr), shape=shape, copy=False)
+        return cls(
+            config["vocab"], term_freqs, array("doc_len"),
+            k1=config["k1"], b=config["b"], epsilon=config["epsilon"], weights=weights,
+        )
+
+
+def verify_against_okapi(engine, okapi, queries, atol=1e-6):
+    """
+    Compare SparseBM25 scores with a rank_bm25.BM25Okapi built on the same corpus.
+
+    Parameters:
+    engine (SparseBM25): The sparse engine.
+    okapi (rank_bm25.BM25Okapi): The reference engine.
+    queries (list): Tokenized queries.
+    atol (float): Maximum tolerated absolute difference.
+
+    Returns:
+    float: The largest absolute score difference observed.
+    """
+    max_diff = 0.0
+    for query_tokens in queries:
+        diff = np.max(np.abs(engine.get_scores(query_tokens) - okapi.get_scores(query_tokens)), initial=0.0)
+        max_diff = max(max_diff, float(diff))
+    if max_diff > atol:
+        logger.warning(f"SparseBM25 deviates from BM25Okapi by up to {max_diff:.3g}")
+    return max_diff
@@ -0,0 +1,256 @@
+# app/cache.py
+
+import os
+import re
+import time
+import pickle
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+import faiss
+
+logger = logging.getLogger(__name__)
+
+
+class TTLCache:
+    """
+    Size-bounded LRU mapping whose entries expire after a time-to-live.
+    Expiry times are wall-clock timestamps so entries can be persisted across restarts.
+    """
+
+    def __init__(self, maxsize, ttl, on_evict=None):
+        """
+        Parameters:
+        maxsize (int): Maximum number of entries; the least recently used entry is evicted first.
+        ttl (float): Default time-to-live in seconds.
+        on_evict (callable): Called with (key, value) whenever an entry is evicted or expires.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()  # key -> (value, expires_at)
+        self._lock = threading.RLock()
+
+    def _drop(self, key):
+        value, _ = self._data.pop(key)
+        if self.on_evict:
+            self.on_evict(key, value)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires_at = entry
+            if expires_at < time.time():
+                self._drop(key)
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None, expires_at=None):
+        with self._lock:
+            if key in self._data:
+                self._drop(key)
+            if expires_at is None:
+                expires_at = time.time() + (self.ttl if ttl is None else ttl)
+            self._data[key] = (value, expires_at)
+            while len(self._data) > self.maxsize:
+                self._drop(next(iter(self._data)))
+
+    def expire(self):
+        """Drop every expired entry."""
+        with self._lock:
+            now = time.time()
+            for key in [key for key, (_, expires_at) in self._data.items() if expires_at < now]:
+                self._drop(key)
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._data):
+                self._drop(key)
+
+    def entries(self):
+        """Return (key, value, expires_at) for every live entry, oldest first."""
+        with self._lock:
+            self.expire()
+            return [(key, value, expires_at) for key, (value, expires_at) in self._data.items()]
+
+    def __contains__(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            return entry is not None and entry[1] >= time.time()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+def normalize_query(query):
+    """Lowercase, drop punctuation and collapse whitespace."""
+    return " ".join(re.sub(r"[^\w\s]", " ", query.lower()).split())
+
+
+class AnswerCache:
+    """
+    Two-level response cache.
+
+    The exact tier is keyed on (normalized query, language, top_k, search settings).
+    The semantic tier keeps the embeddings of past queries in a small FAISS index and
+    serves an answer when a new query is at least similarity_threshold close to a
+    cached one with the same language, top_k and search settings. Both tiers share the TTL and size bound and are cleared
+    when the version (the articles snapshot fingerprint) changes.
+    """
+
+    def __init__(self, maxsize=1024, ttl=86400, similarity_threshold=0.95, path=None):
+        """
+        Parameters:
+        maxsize (int): Maximum number of cached answers per tier.
+        ttl (float): Time-to-live of an answer in seconds.
+        similarity_threshold (float): Minimum inner product between normalized query embeddings for a semantic hit.
+        path (str): Optional file used to persist the cache across restarts.
+        """
+        self.similarity_threshold = similarity_threshold
+        self.path = path
+        self.version = None
+        self.exact = TTLCache(maxsize, ttl)
+        self.semantic = TTLCache(maxsize, ttl, on_evict=self._remove_vector)
+        self.semantic_hits = 0
+        self.semantic_misses = 0
+        self._index = None
+        self._next_id = 0
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def key(query, language, top_k, search_params=None):
+        """Cache key; only the search settings a request overrides (not None) are part of it."""
+        overrides = tuple(sorted((name, value) for name, value in (search_params or {}).items() if value is not None))
+        return (normalize_query(query), language.upper(), int(top_k), overrides)
+
+    def _remove_vector(self, vector_id, entry):
+        if self._index is not None:
+            self._index.remove_ids(np.array([vector_id], dtype=np.int64))
+
+    def set_version(self, version):
+        """Invalidate both tiers when the underlying articles snapshot changes."""
+        with self._lock:
+            if version != self.version:
+                if self.version is not None or len(self.exact) or len(self.semantic):
+                    logger.info("Articles snapshot changed, clearing the answer cache.")
+                self.exact.clear()
+                self.semantic.clear()
+                self.version = version
+
+    def get(self, query, language, top_k, embedding=None, search_params=None):
+        """
+        Look up an answer, first by exact key, then by embedding similarity.
+
+        Returns:
+        object: The cached value, or None on a miss.
+        """
+        key = self.key(query, language, top_k, search_params)
+        with self._lock:
+            value = self.exact.get(key)
+            if value is not None or embedding is None or self._index is None or self._index.ntotal == 0:
+                return value
+
+            query_vector = np.asarray(embedding, dtype=np.float32).reshape(1, -1)
+            scores, ids = self._index.search(query_vector, min(8, self._index.ntotal))
+            for score, vector_id in zip(scores[0], ids[0]):
+                if vector_id < 0 or score < self.similarity_threshold:
+                    break
+                entry = self.semantic.get(int(vector_id))
+                if entry is not None and entry["key"][1:] == key[1:]:
+                    self.semantic_hits += 1
+                    return entry["value"]
+            self.semantic_misses += 1
+            return None
+
+    def set(self, query, language, top_k, value, embedding=None, version=None, search_params=None):
+        """
+        Cache an answer in the exact tier and, when an embedding is given, the semantic tier.
+        Answers computed on another snapshot version than the current one are not cached.
+        """
+        key = self.key(query, language, top_k, search_params)
+        with self._lock:
+            if version is not None and version != self.version:
+                return
+            self.exact.set(key, value)
+            if embedding is not None:
+                self._add_vector(key, value, np.asarray(embedding, dtype=np.float32))
+
+    def _add_vector(self, key, value, embedding, expires_at=None):
+        if self._index is None:
+            self._index = faiss.IndexIDMap2(faiss.IndexFlatIP(embedding.shape[-1]))
+        vector_id = self._next_id
+        self._next_id += 1
+        self._index.add_with_ids(embedding.reshape(1, -1), np.array([vector_id], dtype=np.int64))
+        self.semantic.set(vector_id, {"key": key, "value": value, "embedding": embedding}, expires_at=expires_at)
+
+    def save(self):
+        """Persist live entries to self.path, if configured."""
+        if not self.path:
+            return
+        with self._lock:
+            state = {
+                "version": self.version,
+                "exact": self.exact.entries(),
+                "semantic": [
+                    (entry["key"], entry["value"], entry["embedding"], expires_at)
+                    for _, entry, expires_at in self.semantic.entries()
+                ],
+            }
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.path)
+        logger.info(f"Saved {len(state['exact'])} cached answers to {self.path}")
+
+    def load(self):
+        """Restore entries persisted by save(); expired entries are skipped."""
+        if not self.path or not os.path.isfile(self.path):
+            return
+        try:
+            with open(self.path, "rb") as f:
+                state = pickle.load(f)
+        except Exception as e:
+            logger.warning(f"Could not load the answer cache from {self.path}: {e}")
+            return
+        now = time.time()
+        with self._lock:
+            self.version = state["version"]
+            for key, value, expires_at in state["exact"]:
+                if expires_at >= now:
+                    self.exact.set(key, value, expires_at=expires_at)
+            for key, value, embedding, expires_at in state["semantic"]:
+                if expires_at >= now:
+                    self._add_vector(key, value, embedding, expires_at=expires_at)
+        logger.info(f"Loaded {len(self.exact)} cached answers from {self.path}")
+
+    def stats(self):
+        semantic_lookups = self.semantic_hits + self.semantic_misses
+        return {
+            "exact": self.exact.stats(),
+            "semantic": {
+                "size": len(self.semantic),
+                "hits": self.semantic_hits,
+                "misses": self.semantic_misses,
+                "hit_rate": self.semantic_hits / semantic_lookups if semantic_lookups else 0.0,
+                "similarity_threshold": self.similarity_threshold,
+            },
+        }
@@ -0,0 +1,60 @@
+# app/codec.py
+
+import struct
+import numpy as np
+from bson.binary import Binary
+
+# Stored embeddings are BSON Binary values: an 8-byte header followed by the raw
+# little-endian vector. Header: magic b"EV", format version, dtype code, dimension.
+MAGIC = b"EV"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<2sBBI")
+
+DTYPES = {
+    "float32": (0, np.dtype("<f4")),
+    "float16": (1, np.dtype("<f2")),
+}
+DTYPE_CODES = {code: dtype for code, dtype in DTYPES.values()}
+
+
+def encode_embedding(vector, dtype="float32"):
+    """
+    Encode an embedding as a compact BSON Binary value.
+
+    Parameters:
+    vector (array-like): The embedding.
+    dtype (str): Storage precision, 'float32' or 'float16'.
+
+    Returns:
+    bson.binary.Binary: Header plus raw little-endian values.
+    """
+    if dtype not in DTYPES:
+        raise ValueError(f"Unknown embedding dtype '{dtype}'. Expected one of {list(DTYPES)}.")
+    code, np_dtype = DTYPES[dtype]
+    values = np.ascontiguousarray(vector, dtype=np_dtype).ravel()
+    return Binary(HEADER.pack(MAGIC, FORMAT_VERSION, code, values.shape[0]) + values.tobytes())
+
+
+def decode_embedding(value):
+    """
+    Decode a stored embedding into a float32 vector, without per-element Python objects.
+    Legacy BSON arrays of doubles are still accepted.
+
+    Parameters:
+    value (bytes or list): The stored embedding.
+
+    Returns:
+    np.ndarray: The float32 embedding.
+    """
+    if not isinstance(value, (bytes, bytearray, memoryview)):
+        return np.asarray(value, dtype=np.float32)
+    magic, version, code, dimension = HEADER.unpack_from(value)
+    if magic != MAGIC or version != FORMAT_VERSION or code not in DTYPE_CODES:
+        raise ValueError("Unrecognized embedding encoding.")
+    vector = np.frombuffer(value, dtype=DTYPE_CODES[code], count=dimension, offset=HEADER.size)
+    return vector.astype(np.float32)
+
+
+def is_encoded(value):
+    """Whether a stored embedding already uses the binary encoding."""
+    return isinstance(value, (bytes, bytearray, memoryview))
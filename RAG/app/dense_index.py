@@ -0,0 +1,212 @@
+# app/dense_index.py
+
+import math
+import logging
+import numpy as np
+import faiss
+
+logger = logging.getLogger(__name__)
+
+# Supported dense index types and their faiss.index_factory descriptions
+INDEX_TYPES = {
+    "flat": "Flat",
+    "ivf_flat": "IVF{nlist},Flat",
+    "ivf_pq": "IVF{nlist},PQ{pq_m}x{pq_bits}",
+    "hnsw": "HNSW{hnsw_m}",
+    "sq8": "SQ8",
+}
+
+# faiss k-means wants at least this many training points per centroid
+MIN_POINTS_PER_CENTROID = 39
+
+# Upper bound on the training sample, per IVF list
+MAX_POINTS_PER_CENTROID = 256
+
+
+def index_key(index_type, nlist=0, pq_m=64, hnsw_m=32):
+    """Short name of an index configuration, used in snapshot file names."""
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown dense index type '{index_type}'. Expected one of {list(INDEX_TYPES)}.")
+    if index_type == "ivf_flat":
+        return f"ivf{nlist or 'auto'}"
+    if index_type == "ivf_pq":
+        return f"ivf{nlist or 'auto'}-pq{pq_m}"
+    if index_type == "hnsw":
+        return f"hnsw{hnsw_m}"
+    return index_type
+
+def factory_string(index_type, n_vectors, dimension, nlist=0, pq_m=64, hnsw_m=32):
+    """
+    Resolve the faiss.index_factory description of an index type for a corpus size.
+    IVF list counts and PQ code sizes are reduced, down to a flat index, when the
+    corpus is too small to train them.
+    """
+    description = INDEX_TYPES[index_type]
+    if index_type in ("ivf_flat", "ivf_pq"):
+        nlist = nlist or int(4 * math.sqrt(n_vectors))
+        nlist = min(nlist, n_vectors // MIN_POINTS_PER_CENTROID)
+        if nlist < 1:
+            logger.warning(f"{n_vectors} vectors are too few to train {index_type}, using a flat index.")
+            return INDEX_TYPES["flat"]
+    pq_bits = 8
+    if index_type == "ivf_pq":
+        if dimension % pq_m:
+            raise ValueError(f"PQ sub-quantizers ({pq_m}) must divide the embedding dimension ({dimension}).")
+        if n_vectors < MIN_POINTS_PER_CENTROID * 2 ** pq_bits:
+            pq_bits = 4
+        if n_vectors < MIN_POINTS_PER_CENTROID * 2 ** pq_bits:
+            logger.warning(f"{n_vectors} vectors are too few to train {index_type}, using a flat index.")
+            return INDEX_TYPES["flat"]
+    return description.format(nlist=nlist, pq_m=pq_m, pq_bits=pq_bits, hnsw_m=hnsw_m)
+
+def build_dense_index(embeddings, index_type="flat", nlist=0, pq_m=64, hnsw_m=32, seed=1234):
+    """
+    Build (and train, when needed) an inner-product index over normalized embeddings.
+
+    Parameters:
+    embeddings (np.ndarray): float32 matrix, shape (n, dim).
+    index_type (str): One of INDEX_TYPES.
+    nlist (int): Number of IVF lists; 4 * sqrt(n) when 0.
+    pq_m (int): Number of PQ sub-quantizers (must divide dim).
+    hnsw_m (int): Number of HNSW neighbors per node.
+    seed (int): Seed of the training sample.
+
+    Returns:
+    faiss.Index: The populated index.
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    n_vectors, dimension = embeddings.shape
+    description = factory_string(index_type, n_vectors, dimension, nlist, pq_m, hnsw_m)
+    index = faiss.index_factory(dimension, description, faiss.METRIC_INNER_PRODUCT)
+
+    if not index.is_trained:
+        ivf = faiss.try_extract_index_ivf(index)
+        sample_size = min(n_vectors, MAX_POINTS_PER_CENTROID * max(ivf.nlist if ivf else 1, 256))
+        sample = embeddings
+        if sample_size < n_vectors:
+            sample = embeddings[np.random.default_rng(seed).choice(n_vectors, sample_size, replace=False)]
+        logger.info(f"Training {description} index on {len(sample)} vectors...")
+        index.train(sample)
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efConstruction = max(index.hnsw.efConstruction, 200)
+
+    index.add(embeddings)
+    logger.info(f"Built {description} dense index over {n_vectors} vectors.")
+    return index
+
+def build_code_indices(doc_embeddings, code_mapping, with_sub_indices=True):
+    """
+    Build one FAISS sub-index per legal code so that routed queries only score
+    the vectors of the routed codes. Used for articles and for passages.
+
+    Parameters:
+    doc_embeddings (np.ndarray): Normalized document embeddings (float32).
+    code_mapping (list): The code name of each document, aligned with doc_embeddings.
+    with_sub_indices (bool): When False only the document ids are listed; routed
+    queries then search the main index restricted to those ids.
+
+    Returns:
+    dict: code_name -> (faiss.IndexFlatIP or None, np.ndarray of global document ids).
+    """
+    codes = np.asarray(code_mapping)
+    sub_indices = {}
+    for code_name in np.unique(codes):
+        doc_ids = np.flatnonzero(codes == code_name)
+        sub_index = None
+        if with_sub_indices:
+            sub_index = faiss.IndexFlatIP(doc_embeddings.shape[1])
+            sub_index.add(np.ascontiguousarray(doc_embeddings[doc_ids], dtype=np.float32))
+        sub_indices[str(code_name)] = (sub_index, doc_ids)
+    return sub_indices
+
+def update_code_indices(code_indices, doc_embeddings, code_mapping, affected, with_sub_indices=True):
+    """
+    Per-code sub-indices of an edited corpus. Codes without removed or added documents
+    hold the same vectors in the same order, so their sub-indices are reused and only
+    their document ids shift.
+
+    Parameters:
+    code_indices (dict): The sub-indices of the previous corpus, as built by build_code_indices.
+    doc_embeddings (np.ndarray): The new embedding matrix.
+    code_mapping (list): The code name of each document of the new corpus.
+    affected (set): Codes with removed or added documents.
+    with_sub_indices (bool): See build_code_indices.
+
+    Returns:
+    dict: code_name -> (faiss.IndexFlatIP or None, np.ndarray of global document ids).
+    """
+    codes = np.asarray(code_mapping)
+    sub_indices = {}
+    for code_name in np.unique(codes).tolist():
+        doc_ids = np.flatnonzero(codes == code_name)
+        if not with_sub_indices:
+            sub_index = None
+        elif code_name in affected or code_indices.get(code_name, (None,))[0] is None:
+            sub_index = faiss.IndexFlatIP(doc_embeddings.shape[1])
+            sub_index.add(np.ascontiguousarray(doc_embeddings[doc_ids], dtype=np.float32))
+        else:
+            sub_index = code_indices[code_name][0]
+        sub_indices[code_name] = (sub_index, doc_ids)
+    return sub_indices
+
+def supports_in_place_removal(index):
+    """Whether remove_ids keeps the remaining vectors numbered 0..n-1 (flat code storage)."""
+    return isinstance(index, faiss.IndexFlatCodes)
+
+def update_dense_index(index, drop, embeddings):
+    """
+    Return a copy of index reflecting an edited corpus, leaving the original intact.
+
+    Flat storage removes the dropped rows and appends the new vectors. Other index
+    types keep their training (IVF centroids, PQ codebooks, HNSW parameters) and are
+    refilled from the new embedding matrix, so ids stay aligned with the rows.
+
+    Parameters:
+    index (faiss.Index): The current index.
+    drop (list): Row ids removed from the corpus.
+    embeddings (np.ndarray): The new embedding matrix (kept rows followed by new ones).
+
+    Returns:
+    faiss.Index: The updated index.
+    """
+    # A serialization round trip also owns its storage when the old index is memory-mapped
+    updated = faiss.deserialize_index(faiss.serialize_index(index))
+    if supports_in_place_removal(updated):
+        if drop:
+            updated.remove_ids(np.asarray(drop, dtype=np.int64))
+        updated.add(np.ascontiguousarray(embeddings[updated.ntotal:], dtype=np.float32))
+    else:
+        updated.reset()
+        updated.add(np.ascontiguousarray(embeddings, dtype=np.float32))
+    return updated
+
+def search_parameters(index, nprobe=None, ef_search=None, doc_ids=None):
+    """
+    Per-query search parameters: IVF nprobe, HNSW efSearch, and an optional id
+    restriction (e.g. the documents of the routed codes).
+
+    Returns:
+    faiss.SearchParameters: The parameters, or None when nothing is set.
+    """
+    kwargs = {}
+    if doc_ids is not None:
+        kwargs["sel"] = faiss.IDSelectorBatch(np.asarray(doc_ids, dtype=np.int64))
+    if faiss.try_extract_index_ivf(index) is not None:
+        if nprobe:
+            kwargs["nprobe"] = int(nprobe)
+        return faiss.SearchParametersIVF(**kwargs) if kwargs else None
+    if isinstance(index, faiss.IndexHNSW):
+        if ef_search:
+            kwargs["efSearch"] = int(ef_search)
+        return faiss.SearchParametersHNSW(**kwargs) if kwargs else None
+    return faiss.SearchParameters(**kwargs) if kwargs else None
+
+def describe_index(index):
+    """Type and size of a dense index, for logs and metrics."""
+    ivf = faiss.try_extract_index_ivf(index)
+    return {
+        "type": type(index).__name__,
+        "ntotal": int(index.ntotal),
+        "nlist": int(ivf.nlist) if ivf is not None else None,
+        "bytes": int(faiss.serialize_index(index).nbytes),
+    }
@@ -0,0 +1,87 @@
+# app/fusion.py
+
+import numpy as np
+
+# Fusion methods accepted per request
+FUSION_METHODS = ("rrf", "weighted")
+
+
+def _accumulate(ids_list, contributions):
+    """
+    Sum the contributions of every id across the rankings and sort the ids by total,
+    best first. Ties keep the order in which the ids first appear.
+    """
+    ids = np.concatenate([np.asarray(ids, dtype=np.int64) for ids in ids_list])
+    contributions = np.concatenate(contributions).astype(np.float64)
+    if not len(ids):
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+    unique, first, inverse = np.unique(ids, return_index=True, return_inverse=True)
+    scores = np.bincount(inverse, weights=contributions, minlength=len(unique))
+    order = np.lexsort((first, -scores))
+    return unique[order], scores[order]
+
+
+def reciprocal_rank_fusion(rankings, weights=None, k=60):
+    """
+    Reciprocal Rank Fusion: an id at rank r (1-based) of ranking j scores
+    weights[j] / (k + r), summed over the rankings. Only ranks are used, so the
+    rankings need not have comparable scores.
+
+    Parameters:
+    rankings (list): Arrays of ids, best first.
+    weights (list): Weight of each ranking (1 for all when None).
+    k (int): Rank offset; larger values flatten the contribution of the top ranks.
+
+    Returns:
+    tuple: (ids, fused scores), best first.
+    """
+    weights = weights if weights is not None else [1.0] * len(rankings)
+    contributions = [
+        weight / (k + np.arange(1, len(ids) + 1, dtype=np.float64))
+        for ids, weight in zip(rankings, weights)
+    ]
+    return _accumulate(rankings, contributions)
+
+
+def weighted_score_fusion(results, weights=None):
+    """
+    Weighted sum of min-max normalized scores. Each result list is scaled to [0, 1]
+    (all ones when its scores are equal); an id missing from a list gets 0 from it.
+
+    Parameters:
+    results (list): (ids, scores) pairs, higher scores being better.
+    weights (list): Weight of each result list (1 for all when None).
+
+    Returns:
+    tuple: (ids, fused scores), best first.
+    """
+    weights = weights if weights is not None else [1.0] * len(results)
+    contributions = []
+    for (_, scores), weight in zip(results, weights):
+        scores = np.asarray(scores, dtype=np.float64)
+        if len(scores) and scores.max() > scores.min():
+            normalized = (scores - scores.min()) / (scores.max() - scores.min())
+        else:
+            normalized = np.ones(len(scores))
+        contributions.append(weight * normalized)
+    return _accumulate([ids for ids, _ in results], contributions)
+
+
+def fuse(results, method="rrf", weights=None, rrf_k=60):
+    """
+    Fuse several (ids, scores) result lists into one scored candidate list.
+
+    Parameters:
+    results (list): (ids, scores) pairs, each sorted best first.
+    method (str): 'rrf' (reciprocal rank fusion) or 'weighted' (normalized weighted sum).
+    weights (list): Weight of each result list.
+    rrf_k (int): Rank offset of RRF.
+
+    Returns:
+    tuple: (ids, fused scores), best first.
+    """
+    if method == "rrf":
+        return reciprocal_rank_fusion([ids for ids, _ in results], weights, rrf_k)
+    if method == "weighted":
+        return weighted_score_fusion(results, weights)
+    raise ValueError(f"Unknown fusion method '{method}', expected one of {FUSION_METHODS}.")
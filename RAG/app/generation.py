@@ -0,0 +1,146 @@
+# app/generation.py
+
+import time
+import logging
+import numpy as np
+import faiss
+from app.dense_index import build_code_indices, update_code_indices, update_dense_index
+from app.router import CodeRouter
+from app.store import DocumentStore
+
+logger = logging.getLogger(__name__)
+
+
+class IndexGeneration:
+    """
+    One consistent version of everything retrieval reads: the document metadata, the
+    embedding matrix, the dense index and its per-code sub-indices, BM25, the
+    synonym lexicon, the passage index and the code router.
+
+    A generation is never modified once published. A refresh builds the next generation
+    and swaps the module-level reference, so a query that captured a generation keeps
+    a consistent view until it finishes.
+    """
+
+    def __init__(self, version, metadata, embeddings, index, bm25, lexicon=None,
+                 bm25_search=None, code_indices=None, updated_at=None, number=1, passages=None,
+                 watermark_ids=frozenset(), search_passages=False):
+        """
+        Parameters:
+        version (str): The collection fingerprint this generation reflects.
+        metadata (DocumentStore): The document columns (doc_id, code_name, article_name,
+        content_english, content_arabic), addressed by document id. A dict of lists is converted.
+        embeddings (np.ndarray): The float32 embedding matrix, aligned with the metadata rows.
+        index (faiss.Index): The dense index over embeddings.
+        bm25 (SparseBM25): The BM25 engine over the English content.
+        lexicon (SynonymLexicon): The synonym lexicon used for query expansion, if any.
+        bm25_search (object): Engine used to rank BM25 candidates (defaults to bm25).
+        code_indices (dict): Per-code sub-indices, built from embeddings when None.
+        updated_at (datetime): Latest updated_at of the articles reflected in this generation.
+        number (int): Sequence number, incremented by every refresh.
+        passages (PassageIndex): The passage-level index, if the articles are chunked.
+        watermark_ids (frozenset): doc_ids of the articles stamped exactly updated_at that
+        this generation reflects. Later writes can carry the same stamp, so refreshes
+        query updated_at >= the watermark and skip only these.
+        search_passages (bool): Whether dense retrieval searches the passage index rather
+        than the article index. The article sub-indices are then not built.
+        """
+        self.version = version
+        self.number = number
+        self.store = metadata if isinstance(metadata, DocumentStore) else DocumentStore(metadata)
+        self.document_code_mapping = np.asarray(list(self.store["code_name"]), dtype=str)
+        self.passages = passages
+        self.doc_positions = {doc_id: i for i, doc_id in enumerate(self.store["doc_id"])}
+        self.embeddings = embeddings
+        self.index = index
+        self.exact = isinstance(index, faiss.IndexFlat)
+        self.bm25 = bm25
+        self.bm25_search = bm25_search if bm25_search is not None else bm25
+        self.lexicon = lexicon
+        self.search_passages = search_passages and passages is not None
+        # Exact search keeps flat per-code sub-indices; approximate indexes filter by id instead
+        self.code_indices = (
+            code_indices if code_indices is not None
+            else build_code_indices(embeddings, self.document_code_mapping, self.sub_indexed)
+        )
+        self.router = CodeRouter.from_code_indices(embeddings, self.code_indices)
+        self.updated_at = updated_at
+        self.watermark_ids = frozenset(watermark_ids)
+        self.created_at = time.time()
+
+    def __len__(self):
+        return len(self.store)
+
+    @property
+    def ids_version(self):
+        """
+        What the positional document and passage ids refer to. Every refresh renumbers
+        them, even when the collection fingerprint is unchanged, so caches keyed on ids
+        use the generation number too.
+        """
+        return self.version, self.number
+
+    @property
+    def sub_indexed(self):
+        """Whether routed article searches use the per-code sub-indices (exact article search)."""
+        return self.exact and not self.search_passages
+
+    def apply_changes(self, removed_ids, rows, tokenize, version, updated_at, bm25_backend=None,
+                      watermark_ids=frozenset()):
+        """
+        Build the next generation from this one. Removed and edited articles are dropped,
+        then the new and edited ones are appended. FAISS and BM25 are updated
+        incrementally, and only the sub-indices of the affected codes are rebuilt.
+
+        Parameters:
+        removed_ids (iterable): doc_ids to drop (deleted or edited articles).
+        rows (list): Articles to append, as dicts with the metadata columns plus "embedding"
+        and "passages" (a list of (text, embedding)).
+        tokenize (callable): Maps an English text to its BM25 tokens.
+        version (str): The collection fingerprint of the new generation.
+        updated_at (datetime): Latest updated_at reflected in the new generation.
+        bm25_backend (callable): Maps the new SparseBM25 to the engine used for ranking.
+        watermark_ids (frozenset): doc_ids stamped exactly updated_at (see __init__).
+
+        Returns:
+        IndexGeneration: The new generation; this one is left unchanged.
+        """
+        drop = sorted({self.doc_positions[doc_id] for doc_id in removed_ids if doc_id in self.doc_positions})
+        keep_mask = np.ones(len(self), dtype=bool)
+        keep_mask[drop] = False
+        keep = np.flatnonzero(keep_mask)
+
+        store = self.store.edit(keep, rows)
+        codes = np.concatenate([
+            self.document_code_mapping[keep], np.asarray([row["code_name"] for row in rows], dtype=str),
+        ])
+        added = np.asarray([row["embedding"] for row in rows], dtype=np.float32).reshape(len(rows), self.embeddings.shape[1])
+        embeddings = np.vstack([np.asarray(self.embeddings)[keep], added])
+
+        # Copy-on-write: queries still running on this generation keep the old index
+        index = update_dense_index(self.index, drop, embeddings)
+
+        passages = None
+        if self.passages is not None:
+            passages = self.passages.update(keep, [row["passages"] for row in rows], codes)
+
+        bm25 = self.bm25.update(keep, [tokenize(row["content_english"]) for row in rows])
+
+        affected = {self.document_code_mapping[i] for i in drop} | {row["code_name"] for row in rows}
+        code_indices = update_code_indices(self.code_indices, embeddings, codes, affected, self.sub_indexed)
+
+        logger.info(
+            f"Built index generation {self.number + 1}: -{len(drop)} +{len(rows)} documents, "
+            f"{len(affected)} codes re-indexed."
+        )
+        return IndexGeneration(
+            version, store, embeddings, index, bm25,
+            lexicon=self.lexicon,
+            bm25_search=bm25_backend(bm25) if bm25_backend else None,
+            code_indices=code_indices,
+            updated_at=updated_at,
+            number=self.number + 1,
+            passages=passages,
+            watermark_ids=watermark_ids,
+            search_passages=self.search_passages,
+        )
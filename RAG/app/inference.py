@@ -0,0 +1,292 @@
+# app/inference.py
+
+import os
+import json
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Inference backends of the encoders: eager PyTorch, or ONNX Runtime on CPU
+INFERENCE_BACKENDS = ("torch", "onnx")
+
+# Files of an exported model, in ONNX_CACHE_DIR/<model name>/
+CONFIG_FILE = "onnx_config.json"
+MODEL_FILE = "model.onnx"
+QUANTIZED_MODEL_FILE = "model.int8.onnx"
+
+
+def _import_onnxruntime():
+    """Import onnxruntime, which is only required by the 'onnx' backend."""
+    try:
+        import onnxruntime
+    except ImportError as e:
+        raise ImportError("The 'onnx' inference backend requires onnxruntime (pip install -r requirements-onnx.txt).") from e
+    return onnxruntime
+
+
+def select_device(backend="torch"):
+    """'cuda' when PyTorch sees a GPU and the backend is 'torch', 'cpu' otherwise."""
+    if backend != "torch":
+        return "cpu"
+    import torch
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+def cached_locally(model_name):
+    """
+    Whether the Hugging Face cache already holds model_name. Such models are loaded with
+    local_files_only, so startup makes no network request and works offline.
+    """
+    try:
+        from huggingface_hub import try_to_load_from_cache
+    except ImportError:
+        return False
+    return isinstance(try_to_load_from_cache(model_name, "config.json"), str)
+
+
+def export_directory(cache_dir, model_name):
+    """Directory holding the ONNX export of a model."""
+    return os.path.join(cache_dir, model_name.replace("/", "__"))
+
+
+def _export(model, tokenizer, directory, config, output_axes):
+    """
+    Export a transformers model to ONNX with dynamic batch and sequence axes, quantize
+    its weights to int8 and save the tokenizer. The config file is written last, so
+    a directory with a config holds a complete export.
+
+    Parameters:
+    model (torch.nn.Module): The transformers model, whose first output is exported.
+    tokenizer (object): Its Hugging Face tokenizer.
+    directory (str): Export directory.
+    config (dict): Settings needed at inference time (pooling, activation, ...).
+    output_axes (dict): Dynamic axes of the output.
+    """
+    import torch
+    _import_onnxruntime()
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    os.makedirs(directory, exist_ok=True)
+    input_names = list(tokenizer.model_input_names)
+    sample = tokenizer(["a query", "a longer sample document"], padding=True, return_tensors="pt")
+
+    class FirstOutput(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.model = model
+
+        def forward(self, *inputs):
+            return self.model(**dict(zip(input_names, inputs)))[0]
+
+    model_path = os.path.join(directory, MODEL_FILE)
+    with torch.no_grad():
+        torch.onnx.export(
+            FirstOutput().eval(),
+            tuple(sample[name] for name in input_names),
+            model_path,
+            input_names=input_names,
+            output_names=["output"],
+            dynamic_axes={**{name: {0: "batch", 1: "sequence"} for name in input_names}, "output": output_axes},
+            opset_version=14,
+        )
+    # Dynamic quantization: int8 weights, activations quantized on the fly
+    quantize_dynamic(model_path, os.path.join(directory, QUANTIZED_MODEL_FILE), weight_type=QuantType.QInt8)
+    tokenizer.save_pretrained(directory)
+    with open(os.path.join(directory, CONFIG_FILE), "w", encoding="utf-8") as f:
+        json.dump({**config, "input_names": input_names}, f)
+
+
+def export_sentence_encoder(model_name, directory):
+    """Export a SentenceTransformer made of a transformer, a CLS or mean pooling and an optional normalization."""
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer(model_name, device="cpu", local_files_only=cached_locally(model_name))
+    modules = list(model)
+    pooling = modules[1].get_pooling_mode_str() if len(modules) > 1 else None
+    extra = [type(module).__name__ for module in modules[2:]]
+    if pooling not in ("cls", "mean") or extra not in ([], ["Normalize"]):
+        raise ValueError(f"Cannot export {model_name}: unsupported modules {[type(m).__name__ for m in modules]}.")
+    logger.info(f"Exporting {model_name} to ONNX in {directory}...")
+    _export(
+        modules[0].auto_model, model.tokenizer, directory,
+        {
+            "model_name": model_name,
+            "pooling": pooling,
+            "max_length": model.max_seq_length,
+            "dimension": model.get_sentence_embedding_dimension(),
+        },
+        {0: "batch", 1: "sequence"},
+    )
+
+
+def export_cross_encoder(model_name, directory):
+    """Export a CrossEncoder, keeping its default activation (sigmoid or identity)."""
+    import torch
+    from sentence_transformers import CrossEncoder
+
+    model = CrossEncoder(model_name, device="cpu", local_files_only=cached_locally(model_name))
+    activation = getattr(model, "default_activation_function", None) or getattr(model, "activation_fn", None)
+    logger.info(f"Exporting {model_name} to ONNX in {directory}...")
+    _export(
+        model.model, model.tokenizer, directory,
+        {
+            "model_name": model_name,
+            "activation": "sigmoid" if isinstance(activation, torch.nn.Sigmoid) else "identity",
+            "max_length": model.max_length or model.tokenizer.model_max_length,
+            "num_labels": model.config.num_labels,
+        },
+        {0: "batch"},
+    )
+
+
+class OnnxModel:
+    """An exported model: its tokenizer, its ONNX Runtime session and its config."""
+
+    def __init__(self, directory, quantize=True, threads=0, spinning=False):
+        """
+        Parameters:
+        directory (str): Export directory.
+        quantize (bool): Run the int8 model instead of the fp32 one.
+        threads (int): Intra-op threads (0 lets onnxruntime use one per physical core).
+        spinning (bool): Let idle intra-op threads spin; off so they do not steal CPU
+        from the concurrent stages of other requests.
+        """
+        ort = _import_onnxruntime()
+        from transformers import AutoTokenizer
+
+        with open(os.path.join(directory, CONFIG_FILE), encoding="utf-8") as f:
+            self.config = json.load(f)
+        self.tokenizer = AutoTokenizer.from_pretrained(directory)
+        self.input_names = self.config["input_names"]
+        self.max_length = self.config["max_length"]
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.inter_op_num_threads = 1
+        if threads > 0:
+            options.intra_op_num_threads = threads
+        options.add_session_config_entry("session.intra_op.allow_spinning", "1" if spinning else "0")
+        path = os.path.join(directory, QUANTIZED_MODEL_FILE if quantize else MODEL_FILE)
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+
+    def run(self, *texts):
+        """Tokenize texts (or text pairs, as two lists) and return the model output and the attention mask."""
+        features = self.tokenizer(
+            *texts, padding=True, truncation="longest_first", max_length=self.max_length, return_tensors="np",
+        )
+        output = self.session.run(None, {name: features[name].astype(np.int64) for name in self.input_names})[0]
+        return output, features["attention_mask"]
+
+
+class OnnxSentenceEncoder(OnnxModel):
+    """ONNX Runtime replacement of SentenceTransformer.encode for CLS or mean pooled models."""
+
+    @classmethod
+    def from_pretrained(cls, model_name, cache_dir, quantize=True, threads=0, spinning=False):
+        """Load the export of model_name from cache_dir, exporting it on first use."""
+        directory = export_directory(cache_dir, model_name)
+        if not os.path.exists(os.path.join(directory, CONFIG_FILE)):
+            export_sentence_encoder(model_name, directory)
+        return cls(directory, quantize, threads, spinning)
+
+    def encode(self, sentences, batch_size=32, convert_to_numpy=True, normalize_embeddings=False, **kwargs):
+        """
+        Encode sentences into embeddings, like SentenceTransformer.encode.
+
+        Parameters:
+        sentences (str or list): The sentence(s) to encode.
+        batch_size (int): Sentences per forward pass.
+        convert_to_numpy (bool): Accepted for compatibility; embeddings are always numpy arrays.
+        normalize_embeddings (bool): Scale the embeddings to unit length.
+
+        Returns:
+        np.ndarray: float32 embeddings, shape (n, dimension), or (dimension,) for one sentence.
+        """
+        single = isinstance(sentences, str)
+        sentences = [sentences] if single else list(sentences)
+        embeddings = np.empty((len(sentences), self.config["dimension"]), dtype=np.float32)
+        # Batches of similar lengths need less padding
+        order = np.argsort([-len(sentence) for sentence in sentences], kind="stable")
+        for start in range(0, len(sentences), batch_size):
+            rows = order[start:start + batch_size]
+            hidden, mask = self.run([sentences[i] for i in rows.tolist()])
+            if self.config["pooling"] == "cls":
+                pooled = hidden[:, 0]
+            else:
+                mask = mask[..., None].astype(np.float32)
+                pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            embeddings[rows] = pooled
+        if normalize_embeddings:
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            embeddings /= np.clip(norms, 1e-12, None)
+        return embeddings[0] if single else embeddings
+
+
+class OnnxCrossEncoder(OnnxModel):
+    """ONNX Runtime replacement of CrossEncoder.predict."""
+
+    @classmethod
+    def from_pretrained(cls, model_name, cache_dir, quantize=True, threads=0, spinning=False):
+        """Load the export of model_name from cache_dir, exporting it on first use."""
+        directory = export_directory(cache_dir, model_name)
+        if not os.path.exists(os.path.join(directory, CONFIG_FILE)):
+            export_cross_encoder(model_name, directory)
+        return cls(directory, quantize, threads, spinning)
+
+    def predict(self, sentences, batch_size=32, **kwargs):
+        """
+        Score (query, document) pairs, like CrossEncoder.predict.
+
+        Returns:
+        np.ndarray: One score per pair (one row of num_labels scores for multi-label models).
+        """
+        pairs = list(sentences)
+        scores = []
+        for start in range(0, len(pairs), batch_size):
+            batch = pairs[start:start + batch_size]
+            logits, _ = self.run([query for query, _ in batch], [document for _, document in batch])
+            scores.append(logits.astype(np.float32))
+        if not scores:
+            return np.empty(0, dtype=np.float32)
+        scores = np.concatenate(scores)
+        if self.config["activation"] == "sigmoid":
+            scores = 1.0 / (1.0 + np.exp(-scores))
+        return scores[:, 0] if self.config["num_labels"] == 1 else scores
+
+
+def load_sentence_encoder(model_name, backend="torch", device="cpu", cache_dir="onnx_models",
+                          quantize=True, threads=0, spinning=False):
+    """
+    Load an embedding model on the selected inference backend.
+
+    Parameters:
+    model_name (str): Hugging Face model name.
+    backend (str): 'torch' (SentenceTransformer on device) or 'onnx' (ONNX Runtime on CPU).
+    device (str): Torch device of the 'torch' backend.
+    cache_dir (str): Directory of the ONNX exports.
+    quantize (bool): Run the int8 quantized ONNX model.
+    threads (int): ONNX Runtime intra-op threads (0 = one per physical core).
+    spinning (bool): Let idle ONNX Runtime threads spin.
+
+    Returns:
+    object: A model with SentenceTransformer's encode method.
+    """
+    if backend == "onnx":
+        return OnnxSentenceEncoder.from_pretrained(model_name, cache_dir, quantize, threads, spinning)
+    if backend != "torch":
+        raise ValueError(f"Unknown inference backend '{backend}', expected one of {INFERENCE_BACKENDS}.")
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(model_name, device=device, local_files_only=cached_locally(model_name))
+
+
+def load_cross_encoder(model_name, backend="torch", device="cpu", cache_dir="onnx_models",
+                       quantize=True, threads=0, spinning=False):
+    """Load a cross-encoder on the selected inference backend; see load_sentence_encoder."""
+    if backend == "onnx":
+        return OnnxCrossEncoder.from_pretrained(model_name, cache_dir, quantize, threads, spinning)
+    if backend != "torch":
+        raise ValueError(f"Unknown inference backend '{backend}', expected one of {INFERENCE_BACKENDS}.")
+    from sentence_transformers import CrossEncoder
+    return CrossEncoder(model_name, device=device, local_files_only=cached_locally(model_name))
@@ -0,0 +1,57 @@
+# app/legal_codes.py
+
+# Tunisian legal codes available in the database, with the descriptions used in prompts
+LEGAL_CODES = {
+    "code-aeronautique-civile": "Governs regulations related to civil aviation, including air travel, aviation safety, and airspace management.",
+    "code-amenagement-territoire-urbanisme": "Covers rules related to urban planning and land management, ensuring sustainable and organized territorial development.",
+    "code-arbitrage": "Regulates arbitration processes for resolving disputes outside of court.",
+    "code-assurances": "Governs insurance policies, companies, and obligations in Tunisia.",
+    "code-changes-commerce-exterieur": "Deals with foreign trade policies and currency exchange regulations.",
+    "code-collectivites-locales": "Outlines laws related to local government administration and responsibilities.",
+    "code-commerce": "Governs merchants, commercial transactions, businesses, and negotiable instruments such as cheques and bills of exchange.",
+    "code-commerce-maritime": "Regulates maritime trade, shipping operations, and associated commercial activities.",
+    "code-comptabilite-publique": "Governs public accounting and management of state funds.",
+    "code-conduite-deontologie-agent-public": "Sets ethical rules and professional conduct standards for public servants.",
+    "code-decorations": "Outlines laws regarding state decorations, medals, and honors.",
+    "code-deontologie-medecin-veterinaire": "Defines professional standards and ethics for veterinary medicine practitioners.",
+    "code-deontologie-medicale": "Regulates ethical conduct and responsibilities of medical professionals.",
+    "code-devoirs-architectes": "Details professional obligations and ethical standards for architects.",
+    "code-disciplinaire-penal-maritime": "Covers disciplinary and penal matters related to maritime operations.",
+    "code-douanes": "Governs customs duties, import/export regulations, and border control.",
+    "code-droit-international-prive": "Regulates private international law matters, such as conflicts of law and cross-border disputes.",
+    "code-droits-enregistrement-timbre": "Governs the registration and stamp duties in financial and legal transactions.",
+    "code-droits-procedures-fiscaux": "Covers tax procedures and fiscal obligations.",
+    "code-droits-reels": "Governs real property rights, including ownership, mortgages, and easements.",
+    "code-eaux": "Manages water resources, usage, and conservation laws.",
+    "code-fiscalite-locale": "Covers taxation and fiscal management at the local government level.",
+    "code-forestier": "Protects and regulates forest areas, logging activities, and wildlife preservation.",
+    "code-hydrocarbures": "Governs exploration, production, and management of hydrocarbons in Tunisia.",
+    "code-impot-sur-revenu-personnes-physiques-impot-sur-les-societes": "Covers personal and corporate income tax regulations.",
+    "code-incitation-aux-investissements": "Provides rules to encourage domestic and foreign investments in Tunisia.",
+    "code-industrie-cinematographique": "Regulates the cinematic industry, including production, distribution, and exhibition of films.",
+    "code-justice-militaire": "Covers legal matters and regulations within the military justice system.",
+    "code-minier": "Regulates mining operations, mineral rights, and related activities.",
+    "code-nationalite": "Defines laws related to Tunisian nationality, acquisition, and loss of citizenship.",
+    "code-obligations-contrats": "Governs contracts, obligations, and related civil matters.",
+    "code-organismes-placement-collectif": "Regulates collective investment schemes and funds management.",
+    "code-patrimoine-archeologique-historique-arts-traditionnels": "Protects archaeological and historical heritage sites in Tunisia.",
+    "code-pecheur": "Covers fishing regulations, rights, and resource management for fisheries.",
+    "code-penal": "Governs criminal law and procedures, defining offenses and their penalties.",
+    "code-police-administrative-navigation-maritime": "Manages administrative police duties related to maritime navigation.",
+    "code-ports-maritimes": "Regulates the operation and management of maritime ports.",
+    "code-poste": "Governs postal services, including mail delivery and related activities.",
+    "code-presse": "Covers press freedom, media laws, and publication regulations.",
+    "code-prestation-services-financiers-aux-non-residents": "Regulates financial services provided to non-residents.",
+    "code-procedure-civile-commerciale": "Governs civil and commercial legal procedures in courts.",
+    "code-procedure-penale": "Covers criminal procedure and the administration of justice.",
+    "code-protection-enfant": "Protects children's rights and welfare in Tunisia.",
+    "code-route": "Contains rules and regulations for road traffic, vehicle operations, and driving safety.",
+    "code-societes-commerciales": "Regulates the formation, operation, and dissolution of commercial companies.",
+    "code-statut-personnel": "Governs family law, including marriage, divorce, and inheritance.",
+    "code-taxe-sur-valeur-ajoutee": "Regulates the application and administration of value-added tax (VAT).",
+    "code-telecommunications": "Covers telecommunications operations, infrastructure, and related services.",
+    "code-travail": "Governs labor laws, including employment contracts, workers' rights, and workplace regulations.",
+    "code-travail-maritime": "Regulates working conditions, rights, and obligations of maritime workers.",
+    "tunisian_constitution_articles": "Refers to the articles of the Tunisian Constitution, including fundamental rights, governance, and legal structure and general info about tunisia's values and info.",
+}
+LEGAL_CODES_PROMPT = "\n".join(f"- {name}: {description}" for name, description in LEGAL_CODES.items())
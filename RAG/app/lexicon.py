@@ -0,0 +1,131 @@
+# app/lexicon.py
+
+import os
+import json
+import logging
+import numpy as np
+from tqdm.auto import tqdm
+
+logger = logging.getLogger(__name__)
+
+TERMS_FILE = "terms.json"
+
+
+class SynonymLexicon:
+    """
+    Precomputed synonym table restricted to the corpus vocabulary.
+
+    Row i of the CSR arrays (indptr, synonyms, weights) lists the synonyms of terms[i]
+    as indices into terms, sorted by decreasing weight (the synonym's BM25 IDF). Only
+    terms that have a synonym, or are one, are stored, so query expansion is a
+    dictionary lookup plus an array slice with no WordNet access.
+    """
+
+    def __init__(self, terms, indptr, synonyms, weights):
+        """
+        Parameters:
+        terms (list): The stored terms.
+        indptr (np.ndarray): int64 row offsets into synonyms/weights, len(terms) + 1 entries.
+        synonyms (np.ndarray): int32 term indices of the synonyms.
+        weights (np.ndarray): float32 weight of each synonym.
+        """
+        self.terms = list(terms)
+        self.term_ids = {term: i for i, term in enumerate(self.terms)}
+        self.indptr = indptr
+        self.synonyms = synonyms
+        self.weights = weights
+
+    @classmethod
+    def build(cls, vocab, idf, synsets, max_synonyms=3, min_idf=1.0):
+        """
+        Extract the synonyms of every vocabulary term from WordNet, keeping only the
+        single-word synonyms that occur in the corpus.
+
+        Parameters:
+        vocab (list): The BM25 vocabulary.
+        idf (np.ndarray): The BM25 IDF of every vocabulary term.
+        synsets (callable): Maps a word to its WordNet synsets (e.g. wn.synsets).
+        max_synonyms (int): Maximum number of synonyms kept per term, highest IDF first.
+        min_idf (float): Synonyms more common than this IDF are dropped as noise.
+
+        Returns:
+        SynonymLexicon: The lexicon.
+        """
+        vocab_ids = {term: i for i, term in enumerate(vocab)}
+        rows = {}
+        for term in tqdm(vocab, desc="Building synonym lexicon"):
+            if len(term) < 3 or not term.isalpha():
+                continue
+            candidates = {}
+            for synset in synsets(term):
+                for lemma in synset.lemmas():
+                    synonym = lemma.replace('_', ' ').lower()
+                    synonym_id = vocab_ids.get(synonym)
+                    if synonym == term or synonym_id is None or idf[synonym_id] < min_idf:
+                        continue
+                    candidates[synonym] = float(idf[synonym_id])
+            if candidates:
+                rows[term] = sorted(candidates.items(), key=lambda item: (-item[1], item[0]))[:max_synonyms]
+
+        terms = sorted(set(rows) | {synonym for row in rows.values() for synonym, _ in row})
+        term_ids = {term: i for i, term in enumerate(terms)}
+        indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+        synonyms, weights = [], []
+        for i, term in enumerate(terms):
+            for synonym, weight in rows.get(term, []):
+                synonyms.append(term_ids[synonym])
+                weights.append(weight)
+            indptr[i + 1] = len(synonyms)
+
+        logger.info(f"Built synonym lexicon: {len(rows)} terms, {len(synonyms)} synonyms.")
+        return cls(terms, indptr, np.array(synonyms, dtype=np.int32), np.array(weights, dtype=np.float32))
+
+    def expand(self, tokens, max_terms=10):
+        """
+        Return the highest-weighted synonyms of the query tokens.
+
+        Parameters:
+        tokens (list): The query tokens.
+        max_terms (int): Maximum number of synonyms returned for the whole query.
+
+        Returns:
+        list: Synonyms not already in the query, highest weight first.
+        """
+        # Tokens are visited in query order and ties broken by synonym, so the expansion
+        # does not depend on set iteration order (string hashes differ between processes)
+        tokens = [token.lower() for token in tokens]
+        seen = set(tokens)
+        visited = set()
+        scored = {}
+        for token in tokens:
+            if token in visited:
+                continue
+            visited.add(token)
+            i = self.term_ids.get(token)
+            if i is None:
+                continue
+            start, end = int(self.indptr[i]), int(self.indptr[i + 1])
+            for synonym_id, weight in zip(self.synonyms[start:end].tolist(), self.weights[start:end].tolist()):
+                synonym = self.terms[synonym_id]
+                if synonym not in seen and weight > scored.get(synonym, float("-inf")):
+                    scored[synonym] = weight
+        return [synonym for synonym, _ in sorted(scored.items(), key=lambda item: (-item[1], item[0]))[:max_terms]]
+
+    def save(self, directory):
+        """Write the lexicon as plain arrays that load() can memory-map."""
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, "indptr.npy"), self.indptr)
+        np.save(os.path.join(directory, "synonyms.npy"), self.synonyms)
+        np.save(os.path.join(directory, "weights.npy"), self.weights)
+        with open(os.path.join(directory, TERMS_FILE), "w", encoding="utf-8") as f:
+            json.dump(self.terms, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        """Load a lexicon written by save()."""
+        def array(name):
+            return np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode)
+
+        with open(os.path.join(directory, TERMS_FILE), "r", encoding="utf-8") as f:
+            terms = json.load(f)
+        return cls(terms, array("indptr"), array("synonyms"), array("weights"))
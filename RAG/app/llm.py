@@ -0,0 +1,262 @@
+# app/llm.py
+
+import os
+import re
+import json
+import time
+import random
+import asyncio
+import logging
+import threading
+from app.legal_codes import LEGAL_CODES
+
+logger = logging.getLogger(__name__)
+
+# -----------------------------------
+# Configuration
+# -----------------------------------
+
+LLM_BACKEND = os.getenv('LLM_BACKEND', 'gemini')  # 'gemini' or 'fake'
+LLM_MODEL = os.getenv('LLM_MODEL', 'gemini-1.5-flash')
+LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT', '60'))  # seconds per request
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', '3'))
+LLM_BACKOFF = float(os.getenv('LLM_BACKOFF', '0.5'))  # base delay in seconds, doubled per retry
+FAKE_LLM_LATENCY = float(os.getenv('FAKE_LLM_LATENCY', '0'))  # seconds per fake call
+
+
+class LLMError(Exception):
+    """Raised when the LLM backend fails after all retries."""
+
+
+# -----------------------------------
+# Backends
+# -----------------------------------
+
+class GeminiBackend:
+    """
+    Google Gemini backend. One GenerativeModel is created per generation mode and
+    reused for every call, so the underlying gRPC transport is shared.
+    """
+
+    def __init__(self, model_name=LLM_MODEL, timeout=LLM_TIMEOUT):
+        import google.generativeai as genai
+        from google.api_core import exceptions as google_exceptions
+
+        api_key = os.getenv('GENAI_API_KEY')
+        if not api_key:
+            raise ValueError("Google Generative AI API key not found in environment variables.")
+        genai.configure(api_key=api_key)
+
+        self.genai = genai
+        self.model_name = model_name
+        self.timeout = timeout
+        self.retryable = (
+            google_exceptions.ResourceExhausted,
+            google_exceptions.ServiceUnavailable,
+            google_exceptions.DeadlineExceeded,
+            google_exceptions.InternalServerError,
+            TimeoutError,
+            ConnectionError,
+        )
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def _model(self, json_mode):
+        with self._lock:
+            if json_mode not in self._models:
+                generation_config = {"response_mime_type": "application/json"} if json_mode else None
+                self._models[json_mode] = self.genai.GenerativeModel(
+                    model_name=self.model_name,
+                    generation_config=generation_config,
+                )
+            return self._models[json_mode]
+
+    def generate(self, prompt, json_mode=False):
+        response = self._model(json_mode).generate_content(
+            prompt, request_options={"timeout": self.timeout}
+        )
+        return response.text
+
+    async def agenerate(self, prompt, json_mode=False):
+        response = await self._model(json_mode).generate_content_async(
+            prompt, request_options={"timeout": self.timeout}
+        )
+        return response.text
+
+    async def astream(self, prompt, json_mode=False):
+        response = await self._model(json_mode).generate_content_async(
+            prompt, stream=True, request_options={"timeout": self.timeout}
+        )
+        async for chunk in response:
+            try:
+                text = chunk.text
+            except ValueError:
+                # Chunks without text parts (e.g. only safety ratings)
+                continue
+            if text:
+                yield text
+
+
+class FakeBackend:
+    """
+    Deterministic in-process backend for offline load tests and benchmarks.
+    It recognizes the prompts of app.rag and returns well-formed canned answers
+    after a configurable latency.
+    """
+
+    retryable = ()
+
+    def __init__(self, latency=FAKE_LLM_LATENCY, responder=None):
+        """
+        Parameters:
+        latency (float): Simulated round-trip time in seconds.
+        responder (callable): Optional prompt -> text function overriding the canned answers.
+        """
+        self.latency = latency
+        self.responder = responder or fake_response
+        self.calls = 0
+
+    def generate(self, prompt, json_mode=False):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return self.responder(prompt)
+
+    async def agenerate(self, prompt, json_mode=False):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self.responder(prompt)
+
+    async def astream(self, prompt, json_mode=False):
+        self.calls += 1
+        tokens = re.findall(r"\S+\s*", self.responder(prompt))
+        for token in tokens:
+            if self.latency:
+                await asyncio.sleep(self.latency / len(tokens))
+            yield token
+
+
+def _quoted_query(prompt):
+    match = re.search(r'Query: "(.*?)"', prompt, re.DOTALL) or re.search(r'Query:\s*\n?(.*?)\n', prompt)
+    return match.group(1).strip() if match else ""
+
+def _matching_codes(text):
+    words = set(re.findall(r"[a-z]+", text.lower()))
+    return [
+        code for code in LEGAL_CODES
+        if any(len(part) > 3 and part != "code" and part in words for part in code.split('-'))
+    ]
+
+def fake_response(prompt):
+    """Canned, deterministic answers for each prompt used by app.rag."""
+    if '"is_legal"' in prompt:
+        query = _quoted_query(prompt)
+        return json.dumps({
+            "is_legal": True,
+            "casual_response": "",
+            "language": "ENGLISH",
+            "english_query": query,
+            "enhanced_query": query,
+            "relevant_codes": _matching_codes(query),
+        })
+    if "conversation classifier" in prompt:
+        return "TRUE"
+    if "Analyze the following query" in prompt:
+        return "ENGLISH"
+    if "which of the following Tunisian legal codes" in prompt:
+        codes = _matching_codes(_quoted_query(prompt))
+        return " ".join(codes) if codes else "answer"
+    if "query enhancement system" in prompt:
+        return _quoted_query(prompt)
+    if "Relevant Document Indices" in prompt:
+        count = len(re.findall(r"^Document \d+:", prompt, re.MULTILINE))
+        return "Relevant Document Indices:\n[" + ", ".join(str(i) for i in range(1, count + 1)) + "]"
+    if "Translate the following text to Arabic" in prompt:
+        return "[ar] " + prompt.split("\n\n")[1]
+    count = len(re.findall(r"^Document \d+:", prompt, re.MULTILINE))
+    return f"This is a fake answer based on {count} documents."
+
+
+BACKENDS = {
+    "gemini": GeminiBackend,
+    "fake": FakeBackend,
+}
+
+# -----------------------------------
+# Client
+# -----------------------------------
+
+class LLMClient:
+    """
+    Shared LLM client with a sync and an async API. Retryable backend errors are
+    retried with exponential backoff; other errors are raised immediately.
+    """
+
+    def __init__(self, backend, max_retries=LLM_MAX_RETRIES, backoff=LLM_BACKOFF):
+        self.backend = backend
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+    def _delay(self, attempt):
+        return self.backoff * (2 ** attempt) * (0.5 + random.random() / 2)
+
+    def generate(self, prompt, json_mode=False):
+        """
+        Generate a completion for a prompt.
+
+        Parameters:
+        prompt (str): The prompt.
+        json_mode (bool): Ask the backend for a JSON response.
+
+        Returns:
+        str: The response text.
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self.backend.generate(prompt, json_mode=json_mode)
+            except self.backend.retryable as e:
+                if attempt == self.max_retries:
+                    raise LLMError(f"LLM call failed after {attempt + 1} attempts: {e}") from e
+                delay = self._delay(attempt)
+                logger.warning(f"LLM call failed ({e}), retrying in {delay:.2f}s")
+                time.sleep(delay)
+
+    async def agenerate(self, prompt, json_mode=False):
+        """Async variant of generate()."""
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await self.backend.agenerate(prompt, json_mode=json_mode)
+            except self.backend.retryable as e:
+                if attempt == self.max_retries:
+                    raise LLMError(f"LLM call failed after {attempt + 1} attempts: {e}") from e
+                delay = self._delay(attempt)
+                logger.warning(f"LLM call failed ({e}), retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+
+    async def astream(self, prompt, json_mode=False):
+        """
+        Stream a completion as text chunks, as the backend produces them.
+        Retryable errors are retried only until the first chunk has been yielded.
+        """
+        for attempt in range(self.max_retries + 1):
+            started = False
+            try:
+                async for text in self.backend.astream(prompt, json_mode=json_mode):
+                    started = True
+                    yield text
+                return
+            except self.backend.retryable as e:
+                if started or attempt == self.max_retries:
+                    raise LLMError(f"LLM stream failed after {attempt + 1} attempts: {e}") from e
+                delay = self._delay(attempt)
+                logger.warning(f"LLM stream failed ({e}), retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+
+
+def create_llm_client(backend_name=LLM_BACKEND):
+    """Create the LLM client for the configured backend."""
+    if backend_name not in BACKENDS:
+        raise ValueError(f"Unknown LLM backend '{backend_name}'. Expected one of {list(BACKENDS)}.")
+    logger.info(f"Using LLM backend: {backend_name}")
+    return LLMClient(BACKENDS[backend_name]())
@@ -1,9 +1,15 @@
 # app/main.py
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi import FastAPI, HTTPException
-from app.models import QueryRequest, QueryResponse, RetrievedDocument,Message
-from app.rag import rag_system, initialize_rag_system
-import uvicorn
+from fastapi import Depends, FastAPI, Header, HTTPException
+from fastapi.responses import StreamingResponse
+from app.models import QueryRequest, QueryResponse, RetrievedDocument,Message, BatchQueryRequest, BatchQueryResult
+from app.rag import (
+    arag_system, arag_batch, arag_stream, startup_rag_system, batching_metrics, cache_metrics, stage_metrics, answer_cache,
+    startup_metrics, refresh_index, refresh_status, start_index_refresher,
+)
+import os
+import json
+import secrets
 import asyncio
 import logging
 
@@ -11,6 +17,10 @@ import logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Token of the /admin routes, sent as "Authorization: Bearer <token>". The routes are
+# disabled when it is not set
+ADMIN_TOKEN = os.getenv('RAG_ADMIN_TOKEN')
+
 app = FastAPI(
     title="RAG System API",
     description="API for a Retrieval-Augmented Generation system using FastAPI",
@@ -27,13 +37,34 @@ app.add_middleware(
 @app.on_event("startup")
 async def startup_event():
     """
-    Initialize the RAG system when the application starts.
+    Initialize the RAG system when the application starts: the models and clients are
+    loaded in parallel with the index, before the first request.
     """
     logger.info("Initializing RAG system...")
     # Run the initialization in a separate thread to avoid blocking
     loop = asyncio.get_event_loop()
-    await loop.run_in_executor(None, initialize_rag_system)
+    await loop.run_in_executor(None, startup_rag_system)
     logger.info("RAG system initialized successfully.")
+    start_index_refresher()
+
+@app.on_event("shutdown")
+def shutdown_event():
+    """
+    Persist the answer cache (when ANSWER_CACHE_PATH is set) so it survives restarts.
+    """
+    answer_cache.save()
+
+def to_retrieved_documents(doc_score_pairs):
+    """Convert (document, score) pairs to the API document model."""
+    retrieved_documents = []
+    for idx, (doc, score) in enumerate(doc_score_pairs, start=1):
+        # Clean up content if necessary
+        cleaned_content = doc.replace('## English Translation:', '').strip()
+        logger.debug(f"Processed Document {idx}: {cleaned_content}")
+
+        # Append document to the response
+        retrieved_documents.append(RetrievedDocument(header="", content=cleaned_content))
+    return retrieved_documents
 
 @app.post("/query", response_model=QueryResponse)
 async def handle_query(request: QueryRequest):
@@ -46,11 +77,12 @@ async def handle_query(request: QueryRequest):
     try:
         logger.info(f"Received query: '{request.query}' with top_k: {request.top_k}")
 
-        # Call rag_system and unpack the results
-        answer, doc_score_pairs = rag_system(
+        # Run the async pipeline and unpack the results
+        answer, doc_score_pairs = await arag_system(
             request.query, 
             top_k=request.top_k,
-            memory=request.memory
+            memory=request.memory,
+            search_params=request.search_params(),
         )
 
         # Log the retrieved doc_score_pairs for debugging
@@ -61,20 +93,10 @@ async def handle_query(request: QueryRequest):
             logger.error("Invalid data structure for doc_score_pairs.")
             raise ValueError("Invalid data structure for doc_score_pairs.")
 
-        # Process documents
-        retrieved_documents = []
-        for idx, (doc, score) in enumerate(doc_score_pairs, start=1):
-            # Clean up content if necessary
-            cleaned_content = doc.replace('## English Translation:', '').strip()
-            logger.debug(f"Processed Document {idx}: {cleaned_content}")
-
-            # Append document to the response
-            retrieved_documents.append(RetrievedDocument(header="", content=cleaned_content))
-
         # Return the response
         return QueryResponse(
             answer=answer,
-            retrieved_documents=retrieved_documents
+            retrieved_documents=to_retrieved_documents(doc_score_pairs)
         )
 
     except Exception as e:
@@ -82,6 +104,105 @@ async def handle_query(request: QueryRequest):
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
 
+@app.post("/query/stream")
+async def handle_stream_query(request: QueryRequest):
+    """
+    Answer a query as Server-Sent Events, to show results before the answer is complete:
+
+    - `documents`: the retrieved documents, sent before generation starts
+    - `token`: the next piece of the answer, to append to the message
+    - `done`: the complete answer
+    - `error`: a failure message; the stream ends
+    """
+    logger.info(f"Received streaming query: '{request.query}' with top_k: {request.top_k}")
+
+    async def events():
+        async for event, payload in arag_stream(
+            request.query,
+            top_k=request.top_k,
+            memory=request.memory,
+            search_params=request.search_params(),
+        ):
+            if event == "documents":
+                data = {"retrieved_documents": [doc.model_dump() for doc in to_retrieved_documents(payload)]}
+            elif event == "token":
+                data = {"text": payload}
+            elif event == "done":
+                data = {"answer": payload}
+            else:
+                data = {"detail": payload}
+            yield f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+    # Disable proxy buffering so tokens reach the client as they are produced
+    return StreamingResponse(
+        events(), media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/query/batch")
+async def handle_batch_query(request: BatchQueryRequest):
+    """
+    Answer many queries in one request. Encoding, dense search and reranking are
+    batched across queries and answers are generated concurrently.
+
+    The response is NDJSON: one BatchQueryResult per line, in completion order;
+    use `index` to match results with the submitted queries.
+    """
+    logger.info(f"Received batch of {len(request.queries)} queries")
+
+    async def results():
+        async for index, result, error in arag_batch(request.queries):
+            if error is not None:
+                line = BatchQueryResult(index=index, error=error)
+            else:
+                answer, doc_score_pairs = result
+                line = BatchQueryResult(
+                    index=index, answer=answer, retrieved_documents=to_retrieved_documents(doc_score_pairs or []),
+                )
+            yield line.model_dump_json() + "\n"
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+
+@app.get("/metrics", tags=["Monitoring"])
+def read_metrics():
+    """
+    Micro-batching (batch size, queue delay), cache (hit/miss), pipeline stage
+    (mean duration, critical path share), startup (load time per resource) and index
+    (current generation, outcome of the last refresh) metrics.
+    """
+    return {
+        "batching": batching_metrics(),
+        "cache": cache_metrics(),
+        "pipeline": stage_metrics(),
+        "startup": startup_metrics(),
+        "index": refresh_status(),
+    }
+
+
+def require_admin(authorization: str = Header(default="")):
+    """Reject requests without the admin bearer token."""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin routes are disabled (RAG_ADMIN_TOKEN is not set).")
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not secrets.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Invalid admin token.", headers={"WWW-Authenticate": "Bearer"})
+
+
+@app.post("/admin/refresh", tags=["Admin"], dependencies=[Depends(require_admin)])
+async def trigger_refresh():
+    """
+    Apply the articles added, edited or removed in MongoDB without restarting the API.
+    Requires the admin bearer token.
+    """
+    loop = asyncio.get_event_loop()
+    try:
+        return await loop.run_in_executor(None, refresh_index)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Index refresh failed: {e}")
+
+
 # Optionally, include a root endpoint
 @app.get("/", tags=["Root"])
 def read_root():
@@ -89,4 +210,6 @@ def read_root():
 
 # Entry point for running the app with `python main.py`
 if __name__ == "__main__":
+    import uvicorn
+
     uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
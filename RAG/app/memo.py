@@ -0,0 +1,167 @@
+# app/memo.py
+
+import json
+import time
+import pickle
+import sqlite3
+import hashlib
+import inspect
+import functools
+import threading
+from app.cache import TTLCache
+
+_MISSING = object()  # distinguishes a miss from a memoized None
+
+
+def stable_hash(name, args, kwargs):
+    """Hash a function name and its arguments into a key that is stable across processes."""
+    payload = json.dumps([name, list(args), sorted(kwargs.items())], sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class Memoizer:
+    """
+    Memoization layer for pure, expensive helpers (LLM sub-steps, query expansion).
+
+    Each memoized function gets its own bounded in-memory LRU with its own TTL.
+    When db_path is set, results are also written to SQLite so they survive restarts
+    and are shared between workers. Per-function statistics estimate the time saved
+    by every hit as the function's average computation time.
+    """
+
+    def __init__(self, maxsize=4096, db_path=None):
+        """
+        Parameters:
+        maxsize (int): Maximum number of in-memory entries per function.
+        db_path (str): Optional SQLite file for on-disk persistence.
+        """
+        self.maxsize = maxsize
+        self.db_path = db_path
+        self._caches = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS memo ("
+                "name TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL, expires_at REAL NOT NULL, "
+                "PRIMARY KEY (name, key))"
+            )
+
+    def _db_get(self, name, key):
+        if self._db is None:
+            return None
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value, expires_at FROM memo WHERE name = ? AND key = ?", (name, key)
+            ).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return pickle.loads(row[0]), row[1]
+
+    def _db_set(self, name, key, value, expires_at):
+        if self._db is None:
+            return
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO memo (name, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (name, key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), expires_at),
+            )
+
+    def _lookup(self, name, key):
+        cache = self._caches[name]
+        # A single get: an entry expiring between a membership test and the read would
+        # otherwise be reported as a hit with the value None
+        value = cache.get(key, _MISSING)
+        if value is not _MISSING:
+            return True, value
+        stored = self._db_get(name, key)
+        if stored is not None:
+            value, expires_at = stored
+            cache.set(key, value, expires_at=expires_at)
+            return True, value
+        return False, None
+
+    def _record_hit(self, name):
+        with self._lock:
+            stats = self._stats[name]
+            stats["hits"] += 1
+            if stats["misses"]:
+                stats["time_saved"] += stats["compute_time"] / stats["misses"]
+
+    def _store(self, name, key, value, elapsed, ttl):
+        with self._lock:
+            stats = self._stats[name]
+            stats["misses"] += 1
+            stats["compute_time"] += elapsed
+        expires_at = time.time() + ttl
+        self._caches[name].set(key, value, expires_at=expires_at)
+        self._db_set(name, key, value, expires_at)
+
+    def memoize(self, name, ttl):
+        """
+        Decorator memoizing a sync or async function. Functions decorated with the
+        same name (e.g. a helper and its async variant) share one cache.
+
+        Parameters:
+        name (str): Cache name, also used in statistics.
+        ttl (float): Time-to-live of a result in seconds.
+        """
+        if name not in self._caches:
+            self._caches[name] = TTLCache(self.maxsize, ttl)
+            self._stats[name] = {"hits": 0, "misses": 0, "compute_time": 0.0, "time_saved": 0.0}
+
+        def decorator(func):
+            if inspect.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    key = stable_hash(name, args, kwargs)
+                    found, value = self._lookup(name, key)
+                    if found:
+                        self._record_hit(name)
+                        return value
+                    start = time.perf_counter()
+                    value = await func(*args, **kwargs)
+                    self._store(name, key, value, time.perf_counter() - start, ttl)
+                    return value
+                return async_wrapper
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                key = stable_hash(name, args, kwargs)
+                found, value = self._lookup(name, key)
+                if found:
+                    self._record_hit(name)
+                    return value
+                start = time.perf_counter()
+                value = func(*args, **kwargs)
+                self._store(name, key, value, time.perf_counter() - start, ttl)
+                return value
+            return wrapper
+
+        return decorator
+
+    def clear(self):
+        """Drop every memoized result, in memory and on disk."""
+        for cache in self._caches.values():
+            cache.clear()
+        if self._db is not None:
+            with self._lock:
+                self._db.execute("DELETE FROM memo")
+
+    def stats(self):
+        """Per-function hits, misses, average computation time and estimated time saved."""
+        with self._lock:
+            snapshot = {name: dict(stats) for name, stats in self._stats.items()}
+        return {
+            name: {
+                "size": len(self._caches[name]),
+                "hits": stats["hits"],
+                "misses": stats["misses"],
+                "avg_compute_ms": 1000.0 * stats["compute_time"] / stats["misses"] if stats["misses"] else 0.0,
+                "time_saved_s": stats["time_saved"],
+            }
+            for name, stats in snapshot.items()
+        }
@@ -1,7 +1,7 @@
 # app/models.py
 
 from pydantic import BaseModel,Field
-from typing import List
+from typing import List, Literal, Optional
 
 class Message(BaseModel):
     role: str  # 'user' or 'assistant'
@@ -11,6 +11,21 @@ class QueryRequest(BaseModel):
     query: str
     top_k: int = 5
     memory: List[Message] = Field(default_factory=list, description="Last 10 messages from conversation history")
+    nprobe: Optional[int] = Field(default=None, ge=1, description="IVF lists probed by the dense search (IVF indexes only)")
+    ef_search: Optional[int] = Field(default=None, ge=1, description="HNSW search depth (HNSW indexes only)")
+    fusion: Optional[Literal["rrf", "weighted"]] = Field(default=None, description="Fusion of the BM25 and dense rankings")
+    bm25_weight: Optional[float] = Field(default=None, ge=0, le=1, description="Weight of BM25 in the fusion (dense gets 1 - weight)")
+    candidate_pool: Optional[int] = Field(default=None, ge=1, description="Fused candidates diversified with MMR before reranking")
+
+    def search_params(self):
+        """The per-request search settings passed to the retrieval pipeline."""
+        return {
+            "nprobe": self.nprobe,
+            "ef_search": self.ef_search,
+            "fusion": self.fusion,
+            "bm25_weight": self.bm25_weight,
+            "candidate_pool": self.candidate_pool,
+        }
 
 class RetrievedDocument(BaseModel):
     header: str=""
@@ -19,3 +34,12 @@ class RetrievedDocument(BaseModel):
 class QueryResponse(BaseModel):
     answer: str
     retrieved_documents: List[RetrievedDocument]
+
+class BatchQueryRequest(BaseModel):
+    queries: List[QueryRequest] = Field(..., min_length=1, max_length=10000, description="Queries answered independently")
+
+class BatchQueryResult(BaseModel):
+    index: int  # position of the query in the batch request
+    answer: Optional[str] = None
+    retrieved_documents: List[RetrievedDocument] = Field(default_factory=list)
+    error: Optional[str] = None
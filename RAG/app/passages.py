@@ -0,0 +1,224 @@
+# app/passages.py
+
+import logging
+import numpy as np
+import faiss
+from app.dense_index import build_code_indices, search_parameters, update_code_indices, update_dense_index
+from app.store import StringColumn
+
+logger = logging.getLogger(__name__)
+
+# Passages fetched per requested article, so that articles with several matching
+# passages do not crowd out the others before aggregation
+PASSAGE_OVERFETCH = 4
+
+
+def chunk_text(text, sentence_tokenizer, max_words=180, overlap_sentences=1):
+    """
+    Split a text into windows of whole sentences, so every window fits the embedding
+    model's input length.
+
+    Parameters:
+    text (str): The text to split (an article body).
+    sentence_tokenizer (object): Punkt sentence tokenizer (anything with tokenize(text)).
+    max_words (int): Maximum number of words per window. Longer sentences, such as
+    table rows, are split on word boundaries.
+    overlap_sentences (int): Number of sentences repeated at the start of the next window.
+
+    Returns:
+    list: The passages, in order.
+    """
+    units = []
+    for line in text.splitlines():
+        for sentence in sentence_tokenizer.tokenize(line):
+            words = sentence.split()
+            for start in range(0, len(words), max_words):
+                units.append(words[start:start + max_words])
+
+    chunks = []
+    start = 0
+    while start < len(units):
+        end, size = start, 0
+        while end < len(units) and (end == start or size + len(units[end]) <= max_words):
+            size += len(units[end])
+            end += 1
+        chunks.append(" ".join(word for unit in units[start:end] for word in unit))
+        if end >= len(units):
+            break
+        start = max(end - overlap_sentences, start + 1)
+    return chunks
+
+
+class PassageIndex:
+    """
+    Dense index over article passages.
+
+    Passages are stored grouped by parent article, in article order, so the passages of
+    article a are rows offsets[a]:offsets[a + 1]. Searches score passages and aggregate
+    them back to their articles with a max, keeping the best passage of each article.
+    Like the article index, an exact passage index keeps flat per-code sub-indices for
+    routed queries; approximate ones restrict the main index by id.
+    """
+
+    def __init__(self, texts, parent, embeddings, index, article_codes, code_indices=None):
+        """
+        Parameters:
+        texts (StringColumn): Passage texts (a list of strings is converted).
+        parent (np.ndarray): Parent article id of every passage, non-decreasing.
+        embeddings (np.ndarray): float32 passage embeddings, aligned with texts.
+        index (faiss.Index): Dense index over the passage embeddings.
+        article_codes (np.ndarray): Code name of every article (defines the number of articles).
+        code_indices (dict): Per-code passage sub-indices, built from embeddings when None.
+        """
+        self.texts = texts if isinstance(texts, StringColumn) else StringColumn.from_strings(texts)
+        self.parent = np.asarray(parent, dtype=np.int64)
+        self.embeddings = embeddings
+        self.index = index
+        self.offsets = np.searchsorted(self.parent, np.arange(len(article_codes) + 1), side='left')
+        self.passage_codes = np.asarray(article_codes, dtype=str)[self.parent]
+        self.exact = isinstance(index, faiss.IndexFlat)
+        self.code_indices = (
+            code_indices if code_indices is not None
+            else build_code_indices(embeddings, self.passage_codes, self.exact)
+        )
+
+    @classmethod
+    def from_articles(cls, article_passages, article_codes, build_index):
+        """
+        Build the passage index of a corpus.
+
+        Parameters:
+        article_passages (list): For each article, its list of (text, embedding).
+        article_codes (list): Code name of every article.
+        build_index (callable): Builds the dense index from the passage embedding matrix.
+
+        Returns:
+        PassageIndex: The passage index.
+        """
+        texts, parent, embeddings = [], [], []
+        for article_id, passages in enumerate(article_passages):
+            for text, embedding in passages:
+                texts.append(text)
+                parent.append(article_id)
+                embeddings.append(embedding)
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        return cls(texts, np.asarray(parent, dtype=np.int64), embeddings, build_index(embeddings), article_codes)
+
+    def __len__(self):
+        return len(self.texts)
+
+    def search(self, query_embedding, k, relevant_codes=None, nprobe=None, ef_search=None):
+        """
+        Return the k best articles by their best passage.
+
+        Parameters:
+        query_embedding (np.ndarray): The normalized query embedding.
+        k (int): Number of articles to return.
+        relevant_codes (list): Restrict the search to the passages of these codes.
+        nprobe (int): IVF lists to probe.
+        ef_search (int): HNSW search depth.
+
+        Returns:
+        tuple: (scores, article ids, passage ids), best first.
+        """
+        return self.search_batch(query_embedding.reshape(1, -1), k, relevant_codes, nprobe, ef_search)[0]
+
+    def search_batch(self, query_embeddings, k, relevant_codes=None, nprobe=None, ef_search=None):
+        """
+        Batched variant of search: one index search for a matrix of queries sharing
+        the same code restriction.
+
+        Returns:
+        list: One (scores, article ids, passage ids) tuple per query row.
+        """
+        query_matrix = np.ascontiguousarray(query_embeddings, dtype=np.float32)
+        routed_codes = [code for code in relevant_codes or [] if code in self.code_indices]
+        n_passages = k * PASSAGE_OVERFETCH
+
+        if not routed_codes or not self.exact:
+            passage_ids = np.concatenate([self.code_indices[code][1] for code in routed_codes]) if routed_codes else None
+            params = search_parameters(self.index, nprobe, ef_search, passage_ids)
+            distances, ids = self.index.search(query_matrix, n_passages, params=params)
+            hits = [(row_distances[row_ids >= 0], row_ids[row_ids >= 0]) for row_distances, row_ids in zip(distances, ids)]
+        else:
+            scores = [[] for _ in range(len(query_matrix))]
+            ids = [[] for _ in range(len(query_matrix))]
+            for code in routed_codes:
+                sub_index, passage_ids = self.code_indices[code]
+                distances, local_ids = sub_index.search(query_matrix, min(n_passages, sub_index.ntotal))
+                for row, (row_distances, row_ids) in enumerate(zip(distances, local_ids)):
+                    found = row_ids >= 0
+                    scores[row].append(row_distances[found])
+                    ids[row].append(passage_ids[row_ids[found]])
+            hits = []
+            for row_scores, row_ids in zip(scores, ids):
+                row_scores, row_ids = np.concatenate(row_scores), np.concatenate(row_ids)
+                order = np.argsort(-row_scores, kind='stable')[:n_passages]
+                hits.append((row_scores[order], row_ids[order]))
+
+        results = []
+        for scores, row_ids in hits:
+            # Results are sorted, so the first passage seen of an article is its best one
+            parents = self.parent[row_ids]
+            _, first = np.unique(parents, return_index=True)
+            best = np.sort(first)[:k]
+            results.append((scores[best], parents[best], row_ids[best]))
+        return results
+
+    def best_passages(self, query_embedding, article_ids):
+        """
+        Return, for each article, its passage closest to the query (-1 when it has none).
+        """
+        article_ids = np.asarray(article_ids, dtype=np.int64)
+        best = np.full(len(article_ids), -1, dtype=np.int64)
+        starts, ends = self.offsets[article_ids], self.offsets[article_ids + 1]
+        has_passages = ends > starts
+        if not has_passages.any():
+            return best
+
+        counts = (ends - starts)[has_passages]
+        ids = np.concatenate([np.arange(s, e) for s, e in zip(starts[has_passages].tolist(), ends[has_passages].tolist())])
+        scores = np.asarray(self.embeddings[ids]) @ query_embedding.astype('float32')
+        segments = np.repeat(np.arange(len(counts)), counts)
+        order = np.lexsort((-scores, segments))
+        _, first = np.unique(segments[order], return_index=True)
+        best[has_passages] = ids[order[first]]
+        return best
+
+    def update(self, keep, new_passages, article_codes):
+        """
+        Build the passage index of an edited corpus, leaving this one unchanged.
+
+        Parameters:
+        keep (np.ndarray): Ids of the kept articles, in increasing order.
+        new_passages (list): For each appended article, its list of (text, embedding).
+        article_codes (np.ndarray): Code name of every article of the new corpus.
+
+        Returns:
+        PassageIndex: The new passage index.
+        """
+        remap = np.full(len(self.offsets) - 1, -1, dtype=np.int64)
+        remap[keep] = np.arange(len(keep))
+        kept_mask = remap[self.parent] >= 0
+        kept = np.flatnonzero(kept_mask)
+        drop = np.flatnonzero(~kept_mask).tolist()
+
+        new_texts, parent, added = [], [remap[self.parent[kept]]], []
+        for offset, passages in enumerate(new_passages):
+            new_texts.extend(text for text, _ in passages)
+            parent.append(np.full(len(passages), len(keep) + offset, dtype=np.int64))
+            added.extend(embedding for _, embedding in passages)
+
+        dimension = self.embeddings.shape[1]
+        embeddings = np.vstack([
+            np.asarray(self.embeddings)[kept],
+            np.asarray(added, dtype=np.float32).reshape(len(added), dimension),
+        ])
+        index = update_dense_index(self.index, drop, embeddings)
+        texts = self.texts.take(kept).extend(new_texts)
+        parent = np.concatenate(parent)
+
+        article_codes = np.asarray(article_codes, dtype=str)
+        affected = set(self.passage_codes[drop].tolist()) | set(article_codes[parent[len(kept):]].tolist())
+        code_indices = update_code_indices(self.code_indices, embeddings, article_codes[parent], affected, self.exact)
+        return PassageIndex(texts, parent, embeddings, index, article_codes, code_indices)
@@ -0,0 +1,164 @@
+# app/pipeline.py
+
+import time
+import asyncio
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class StageGraph:
+    """
+    Dependency graph of the async stages of one request.
+
+    Every stage starts as soon as the stages it depends on are done, so independent
+    stages (e.g. LLM calls on the raw query) run concurrently. Stages can be started
+    speculatively and cancelled once their result is known not to be needed; stages
+    depending on a cancelled stage are cancelled too. Start and end times are recorded
+    so that the critical path of the request can be reported.
+    """
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.tasks = {}
+        self.deps = {}
+        self.times = {}
+
+    def __contains__(self, name):
+        return name in self.tasks
+
+    def add(self, name, func, deps=()):
+        """
+        Schedule a stage.
+
+        Parameters:
+        name (str): Unique stage name.
+        func (callable): Async function called with the results of deps, in order.
+        deps (tuple): Names of the stages this one depends on.
+
+        Returns:
+        asyncio.Task: The task running the stage.
+        """
+        if name in self.tasks:
+            raise ValueError(f"Stage '{name}' already exists.")
+        dep_tasks = [self.tasks[dep] for dep in deps]
+
+        async def run():
+            results = [await task for task in dep_tasks]
+            self.times[name] = [time.perf_counter(), None]
+            try:
+                return await func(*results)
+            finally:
+                self.times[name][1] = time.perf_counter()
+
+        self.deps[name] = tuple(deps)
+        self.tasks[name] = asyncio.create_task(run(), name=name)
+        return self.tasks[name]
+
+    async def result(self, name):
+        """Wait for a stage and return its result."""
+        return await self.tasks[name]
+
+    def cancel(self, *names):
+        """Cancel stages that are no longer needed (unknown or finished ones are ignored)."""
+        for name in names:
+            task = self.tasks.get(name)
+            if task is not None and not task.done():
+                task.cancel()
+
+    def close(self):
+        """Cancel the stages still running and consume the errors of failed ones."""
+        for task in self.tasks.values():
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled():
+                task.exception()
+
+    def _status(self, name):
+        task = self.tasks[name]
+        if task.cancelled():
+            return "cancelled"
+        if not task.done():
+            return "pending"
+        return "failed" if task.exception() is not None else "done"
+
+    def report(self):
+        """
+        Timings of the stages and the critical path: starting from the stage that
+        finished last, repeatedly follow the dependency that finished last.
+
+        Returns:
+        dict: total_ms, stages (name -> start_ms, duration_ms, status, deps) and
+        critical_path (stage names, in execution order).
+        """
+        stages = {}
+        for name in self.tasks:
+            start, end = self.times.get(name, (None, None))
+            stages[name] = {
+                "start_ms": 1000.0 * (start - self.origin) if start is not None else None,
+                "duration_ms": 1000.0 * (end - start) if end is not None else None,
+                "status": self._status(name),
+                "deps": list(self.deps[name]),
+            }
+
+        def end_time(name):
+            start, end = self.times.get(name, (None, None))
+            return end if end is not None and stages[name]["status"] == "done" else None
+
+        finished = [name for name in self.tasks if end_time(name) is not None]
+        path = []
+        if finished:
+            name = max(finished, key=end_time)
+            while name is not None:
+                path.append(name)
+                deps = [dep for dep in self.deps[name] if end_time(dep) is not None]
+                name = max(deps, key=end_time) if deps else None
+        path.reverse()
+
+        return {
+            "total_ms": 1000.0 * (time.perf_counter() - self.origin),
+            "stages": stages,
+            "critical_path": path,
+        }
+
+
+class PipelineMetrics:
+    """Aggregated stage timings of many requests: mean duration and critical path share."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._stages = {}
+        self._total_ms = 0.0
+
+    def record(self, report):
+        with self._lock:
+            self._requests += 1
+            self._total_ms += report["total_ms"]
+            critical = set(report["critical_path"])
+            for name, stage in report["stages"].items():
+                stats = self._stages.setdefault(name, {"runs": 0, "cancelled": 0, "total_ms": 0.0, "critical": 0})
+                if stage["status"] == "cancelled":
+                    stats["cancelled"] += 1
+                if stage["duration_ms"] is not None:
+                    stats["runs"] += 1
+                    stats["total_ms"] += stage["duration_ms"]
+                if name in critical:
+                    stats["critical"] += 1
+
+    def summary(self):
+        with self._lock:
+            return {
+                "requests": self._requests,
+                "avg_total_ms": self._total_ms / self._requests if self._requests else 0.0,
+                "stages": {
+                    name: {
+                        "runs": stats["runs"],
+                        "cancelled": stats["cancelled"],
+                        "avg_ms": stats["total_ms"] / stats["runs"] if stats["runs"] else 0.0,
+                        "critical_path_share": stats["critical"] / self._requests,
+                    }
+                    for name, stats in self._stages.items()
+                },
+            }
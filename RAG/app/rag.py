@@ -1,21 +1,39 @@
 # app/rag.py
 
 import os
-import torch
+import re
+import json
+import time
+import asyncio
+import threading
 import numpy as np
-import faiss
 import nltk
-import wn
-import google.generativeai as genai
 from pymongo import MongoClient
-from sentence_transformers import SentenceTransformer, CrossEncoder
-from rank_bm25 import BM25Okapi
 from nltk.tokenize import word_tokenize, PunktSentenceTokenizer
 from tqdm.auto import tqdm
 from dotenv import load_dotenv
 import logging
 from typing import List
+from concurrent.futures import ThreadPoolExecutor
 from app.models import Message
+from app.batching import MicroBatcher
+from app.cache import AnswerCache, normalize_query
+from app.memo import Memoizer
+from app.bm25 import SparseBM25
+from app.lexicon import SynonymLexicon
+from app.generation import IndexGeneration
+from app.pipeline import StageGraph, PipelineMetrics
+from app.passages import PassageIndex
+from app.store import DocumentStore
+from app.fusion import fuse
+from app.rerank import RerankCascade
+from app.inference import load_sentence_encoder, load_cross_encoder, select_device
+from app.resources import Resources
+from app.codec import decode_embedding
+from app.llm import create_llm_client
+from app.legal_codes import LEGAL_CODES_PROMPT
+from app.snapshot import METADATA_COLUMNS, collection_fingerprint, load_snapshot, save_snapshot, save_index
+from app.dense_index import build_dense_index, index_key, search_parameters
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -28,68 +46,280 @@ load_dotenv()
 # Configuration and Initialization
 # -----------------------------------
 
-# Initialize MongoDB connection
 MONGODB_URI = os.getenv('MONGODB_URI', 'mongodb://localhost:27017/')
 MONGODB_DB = os.getenv('MONGODB_DB', 'rag_system_project')
 MONGODB_COLLECTION = os.getenv('MONGODB_COLLECTION', 'articles')
 
-client = MongoClient(MONGODB_URI)
-db = client[MONGODB_DB]
-collection = db[MONGODB_COLLECTION]
-
-# Initialize Google Generative AI with your API key
-GENAI_API_KEY = os.getenv('GENAI_API_KEY')
-if not GENAI_API_KEY:
-    raise ValueError("Google Generative AI API key not found in environment variables.")
-genai.configure(api_key=GENAI_API_KEY)
-
-# Download Open English WordNet
-wn.download('oewn:2021')  # 'oewn' is the correct identifier for Open English WordNet
-
-import os
+# NLTK data (punkt) and WordNet are looked up locally first and only downloaded when missing
+NLTK_DATA_DIR = os.getenv('NLTK_DATA_DIR', os.path.join(os.getcwd(), "venv", "nltk_data"))
+NLTK_PACKAGES = ('punkt', 'punkt_tab')
+WORDNET_LEXICON = os.getenv('WORDNET_LEXICON', 'oewn:2021')  # Open English WordNet
+
+EMBEDDING_MODEL = 'sentence-transformers/multi-qa-mpnet-base-dot-v1'
+CROSS_ENCODER_MODEL = 'cross-encoder/ms-marco-MiniLM-L-12-v2'
+FIRST_STAGE_MODEL = 'cross-encoder/ms-marco-MiniLM-L-6-v2'
+
+# Encoder inference backend: 'torch' (eager PyTorch on device) or 'onnx' (ONNX Runtime on
+# CPU). ONNX models are exported once to ONNX_CACHE_DIR, run int8-quantized unless
+# ONNX_QUANTIZE is false, with ONNX_THREADS intra-op threads (0 = one per physical core)
+INFERENCE_BACKEND = os.getenv('INFERENCE_BACKEND', 'torch')
+ONNX_CACHE_DIR = os.getenv('ONNX_CACHE_DIR', 'onnx_models')
+ONNX_QUANTIZE = os.getenv('ONNX_QUANTIZE', 'true').lower() == 'true'
+ONNX_THREADS = int(os.getenv('ONNX_THREADS', '0'))
+ONNX_SPINNING = os.getenv('ONNX_SPINNING', 'false').lower() == 'true'
+inference_options = {
+    "backend": INFERENCE_BACKEND,
+    "cache_dir": ONNX_CACHE_DIR,
+    "quantize": ONNX_QUANTIZE,
+    "threads": ONNX_THREADS,
+    "spinning": ONNX_SPINNING,
+}
+
+# Reranking cascade in front of the L-12 cross-encoder. The first stage scores the
+# MMR-selected candidates: 'dense' with their query similarities (free), 'minilm6' with
+# the 6-layer cross-encoder, 'none' sends every candidate to the L-12 model. Candidates
+# more than RERANK_PRUNE_MARGIN below the best are pruned, and the L-12 model is skipped
+# when the best leads by RERANK_EXIT_MARGIN (both margins in first-stage score units).
+RERANK_FIRST_STAGE = os.getenv('RERANK_FIRST_STAGE', 'dense')
+RERANK_PRUNE_MARGIN = float(os.getenv('RERANK_PRUNE_MARGIN', '0.15'))
+RERANK_MIN_CANDIDATES = int(os.getenv('RERANK_MIN_CANDIDATES', '3'))
+RERANK_EXIT_MARGIN = float(os.getenv('RERANK_EXIT_MARGIN', '0.2'))
+RERANK_CACHE_SIZE = int(os.getenv('RERANK_CACHE_SIZE', '65536'))  # cached (query, document) scores
+RERANK_CACHE_TTL = float(os.getenv('RERANK_CACHE_TTL', '3600'))  # seconds
+
+rerank_cascade = RerankCascade(
+    prune_margin=RERANK_PRUNE_MARGIN,
+    min_candidates=RERANK_MIN_CANDIDATES,
+    exit_margin=RERANK_EXIT_MARGIN,
+    cache_size=RERANK_CACHE_SIZE,
+    cache_ttl=RERANK_CACHE_TTL,
+)
+
+# Micro-batching of query encoding and reranking across concurrent requests
+BATCH_MAX_WAIT_MS = float(os.getenv('BATCH_MAX_WAIT_MS', '5'))
+EMBEDDING_MAX_BATCH_SIZE = int(os.getenv('EMBEDDING_MAX_BATCH_SIZE', '32'))
+RERANK_MAX_BATCH_SIZE = int(os.getenv('RERANK_MAX_BATCH_SIZE', '128'))
+
+def _encode_batch(texts):
+    return resources.embedding_model.encode(
+        texts,
+        batch_size=len(texts),
+        convert_to_numpy=True,
+        normalize_embeddings=True
+    )
 
-# Ensure NLTK uses the correct local path
-nltk_path = os.path.join(os.getcwd(), "venv", "nltk_data")
-if nltk_path not in nltk.data.path:
-    nltk.data.path.insert(0, nltk_path)
+def _rerank_batch(pairs):
+    return resources.cross_encoder.predict(pairs, batch_size=len(pairs))
+
+def _first_stage_batch(pairs):
+    return resources.first_stage_encoder.predict(pairs, batch_size=len(pairs))
+
+embedding_batcher = MicroBatcher("embedding", _encode_batch, EMBEDDING_MAX_BATCH_SIZE, BATCH_MAX_WAIT_MS)
+rerank_batcher = MicroBatcher("rerank", _rerank_batch, RERANK_MAX_BATCH_SIZE, BATCH_MAX_WAIT_MS)
+first_stage_batcher = MicroBatcher("first_stage", _first_stage_batch, RERANK_MAX_BATCH_SIZE, BATCH_MAX_WAIT_MS)
+
+# Batch query API: requests are processed in chunks of QUERY_BATCH_SIZE, with at most
+# BATCH_LLM_CONCURRENCY queries waiting on the LLM at a time
+QUERY_BATCH_SIZE = int(os.getenv('QUERY_BATCH_SIZE', '64'))
+BATCH_LLM_CONCURRENCY = int(os.getenv('BATCH_LLM_CONCURRENCY', '8'))
+
+# Concurrent pipeline stages: unrouted candidates are over-fetched by ROUTING_OVERFETCH so
+# that they can be filtered by the routed codes afterwards. With SPECULATIVE_RETRIEVAL,
+# retrieval starts on the raw query while the pre-flight call classifies it (queries in
+# Arabic script are translated first, so they wait for the English query of the per-step
+# fallback). The result is kept only when the enhanced query equals the speculated one and
+# discarded for casual queries. It is opt-in because the enhancement usually rewrites the
+# query, and every discarded speculation costs an encode and a whole-corpus over-fetch.
+SPECULATIVE_RETRIEVAL = os.getenv('SPECULATIVE_RETRIEVAL', 'false').lower() == 'true'
+ARABIC_SCRIPT = re.compile(r"[\u0600-\u06FF]")
+ROUTING_OVERFETCH = int(os.getenv('ROUTING_OVERFETCH', '4'))
+pipeline_metrics = PipelineMetrics()
+
+# Two-level (exact + semantic) answer cache, invalidated when the articles snapshot changes
+ANSWER_CACHE_SIZE = int(os.getenv('ANSWER_CACHE_SIZE', '1024'))
+ANSWER_CACHE_TTL = float(os.getenv('ANSWER_CACHE_TTL', '86400'))  # seconds
+ANSWER_CACHE_SIMILARITY = float(os.getenv('ANSWER_CACHE_SIMILARITY', '0.95'))
+ANSWER_CACHE_PATH = os.getenv('ANSWER_CACHE_PATH')  # optional file to persist the cache across restarts
+
+answer_cache = AnswerCache(
+    maxsize=ANSWER_CACHE_SIZE,
+    ttl=ANSWER_CACHE_TTL,
+    similarity_threshold=ANSWER_CACHE_SIMILARITY,
+    path=ANSWER_CACHE_PATH,
+)
+
+# Memoization of pure sub-steps (routing, translation, expansion), optionally persisted to SQLite
+MEMO_CACHE_SIZE = int(os.getenv('MEMO_CACHE_SIZE', '4096'))  # entries per function
+MEMO_DB_PATH = os.getenv('MEMO_DB_PATH')
+ROUTING_MEMO_TTL = float(os.getenv('ROUTING_MEMO_TTL', '86400'))  # seconds
+TRANSLATION_MEMO_TTL = float(os.getenv('TRANSLATION_MEMO_TTL', '604800'))
+EXPANSION_MEMO_TTL = float(os.getenv('EXPANSION_MEMO_TTL', '2592000'))
+
+memo = Memoizer(maxsize=MEMO_CACHE_SIZE, db_path=MEMO_DB_PATH)
 
-# Log final search paths
-logger.info(f"Final NLTK search paths: {nltk.data.path}")
+# Initialize tokenizer for BM25
+tokenizer = PunktSentenceTokenizer()
 
-# Download `punkt` inside venv
-nltk.download('punkt', download_dir=nltk_path)
-nltk.download('punkt_tab', download_dir=nltk_path)
+# BM25 engine used for scoring: 'sparse' (SparseBM25) or 'okapi' (rank_bm25, for A/B comparisons)
+BM25_BACKEND = os.getenv('BM25_BACKEND', 'sparse')
+
+# Dense index: 'flat' (exact), 'ivf_flat', 'ivf_pq', 'hnsw' or 'sq8'
+DENSE_INDEX_TYPE = os.getenv('DENSE_INDEX_TYPE', 'flat')
+DENSE_IVF_NLIST = int(os.getenv('DENSE_IVF_NLIST', '0'))  # 0 = 4 * sqrt(corpus size)
+DENSE_PQ_M = int(os.getenv('DENSE_PQ_M', '64'))
+DENSE_HNSW_M = int(os.getenv('DENSE_HNSW_M', '32'))
+DENSE_NPROBE = int(os.getenv('DENSE_NPROBE', '16'))  # default IVF lists probed per query
+DENSE_EF_SEARCH = int(os.getenv('DENSE_EF_SEARCH', '64'))  # default HNSW search depth
+DENSE_INDEX_KEY = index_key(DENSE_INDEX_TYPE, DENSE_IVF_NLIST, DENSE_PQ_M, DENSE_HNSW_M)
+
+# Fusion of the BM25 and dense rankings: 'rrf' (reciprocal rank fusion) or 'weighted'
+# (sum of min-max normalized scores). The best CANDIDATE_POOL_FACTOR * top_k fused
+# candidates are diversified with MMR; requests can override all of these but FUSION_RRF_K
+FUSION_METHOD = os.getenv('FUSION_METHOD', 'rrf')
+FUSION_BM25_WEIGHT = float(os.getenv('FUSION_BM25_WEIGHT', '0.5'))  # the dense ranking gets 1 - weight
+FUSION_RRF_K = int(os.getenv('FUSION_RRF_K', '60'))
+CANDIDATE_POOL_FACTOR = int(os.getenv('CANDIDATE_POOL_FACTOR', '4'))
+
+# Passage-level retrieval over chunked articles ('false' ranks whole articles, for A/B comparisons)
+PASSAGE_RETRIEVAL = os.getenv('PASSAGE_RETRIEVAL', 'true').lower() == 'true'
+
+# Code routing: 'local' scores the query against per-code centroid embeddings and calls
+# Gemini only when the routed codes cover less than ROUTER_MIN_CONFIDENCE of the probability
+# mass; 'llm' always routes with Gemini (inside the pre-flight call when it succeeds)
+ROUTER_MODE = os.getenv('ROUTER_MODE', 'local')
+ROUTER_TEMPERATURE = float(os.getenv('ROUTER_TEMPERATURE', '0.05'))
+ROUTER_MAX_CODES = int(os.getenv('ROUTER_MAX_CODES', '3'))
+ROUTER_CUMULATIVE = float(os.getenv('ROUTER_CUMULATIVE', '0.8'))  # stop adding codes at this mass
+ROUTER_MIN_CONFIDENCE = float(os.getenv('ROUTER_MIN_CONFIDENCE', '0.5'))
+
+# Query expansion from the precomputed synonym lexicon
+SYNONYMS_PER_TERM = int(os.getenv('SYNONYMS_PER_TERM', '3'))
+SYNONYM_MIN_IDF = float(os.getenv('SYNONYM_MIN_IDF', '1.0'))
+MAX_EXPANSION_TERMS = int(os.getenv('MAX_EXPANSION_TERMS', '10'))
+
+# Bounded executor for CPU-bound stages (encoding, BM25, FAISS, reranking).
+# At most CPU_QUEUE_SIZE stages run or wait in the executor; further requests queue on the event loop.
+CPU_WORKERS = int(os.getenv('RAG_CPU_WORKERS', max(1, (os.cpu_count() or 2) // 2)))
+CPU_QUEUE_SIZE = int(os.getenv('RAG_CPU_QUEUE_SIZE', 4 * CPU_WORKERS))
+cpu_executor = ThreadPoolExecutor(max_workers=CPU_WORKERS, thread_name_prefix="rag-cpu")
+_cpu_slots = None  # (event loop, asyncio.Semaphore)
+
+# Live index refresh: poll MongoDB for added, edited or removed articles (0 disables polling)
+INDEX_REFRESH_INTERVAL = float(os.getenv('INDEX_REFRESH_INTERVAL', '60'))  # seconds
+INDEX_REFRESH_MAX_BACKOFF = float(os.getenv('INDEX_REFRESH_MAX_BACKOFF', '900'))  # seconds between retries after failures
+_refresh_lock = threading.Lock()
+_refresher = None
+_refresh_state = {"last_run": None, "last_result": None, "last_error": None, "consecutive_failures": 0}
+
+# Current index generation (documents, embeddings, FAISS, BM25, lexicon).
+# Replaced as a whole by refreshes; each query reads a single generation.
+generation = None
 
-# Verify where `punkt` is actually loaded from
-try:
-    punkt_path = nltk.data.find('tokenizers/punkt')
-    logger.info(f"NLTK 'punkt' tokenizer found at: {punkt_path}")
-except LookupError:
-    logger.error("NLTK 'punkt' tokenizer NOT found!")
+# -----------------------------------
+# Shared Resources
+# -----------------------------------
 
-# Initialize embedding models
-device = 'cuda' if torch.cuda.is_available() else 'cpu'
-logger.info(f"Using device: {device}")
+def load_collection():
+    """The MongoDB articles collection (the client connects in the background)."""
+    return MongoClient(MONGODB_URI)[MONGODB_DB][MONGODB_COLLECTION]
 
-embedding_model = SentenceTransformer('sentence-transformers/multi-qa-mpnet-base-dot-v1', device=device)
-cross_encoder = CrossEncoder('cross-encoder/ms-marco-MiniLM-L-12-v2')
+def load_word_tokenize():
+    """
+    Return nltk's word_tokenize once its punkt data is available. The local NLTK paths
+    are searched first; missing packages are downloaded to NLTK_DATA_DIR.
+    """
+    if NLTK_DATA_DIR not in nltk.data.path:
+        nltk.data.path.insert(0, NLTK_DATA_DIR)
+    for package in NLTK_PACKAGES:
+        try:
+            nltk.data.find(f'tokenizers/{package}')
+        except LookupError:
+            logger.info(f"NLTK '{package}' not found locally, downloading it to {NLTK_DATA_DIR}...")
+            nltk.download(package, download_dir=NLTK_DATA_DIR, quiet=True)
+            nltk.data.find(f'tokenizers/{package}')  # LookupError when the download failed
+    return word_tokenize
 
-# Initialize tokenizer for BM25
-tokenizer = PunktSentenceTokenizer()
+def load_synsets():
+    """Return wn.synsets, downloading WORDNET_LEXICON only when it is not installed."""
+    import wn
 
-# Global variables for documents and indexes
-documents_mapping = {}
-documents = []
-embeddings = None
-index = None
-bm25 = None
-tokenized_corpus = []
-document_code_mapping = []  # To map each document to its code(s)
+    try:
+        installed = bool(wn.lexicons(lexicon=WORDNET_LEXICON))
+    except wn.Error:
+        installed = False
+    if not installed:
+        logger.info(f"WordNet {WORDNET_LEXICON} not installed, downloading it...")
+        wn.download(WORDNET_LEXICON)
+    return wn.synsets
+
+def load_device():
+    device = select_device(INFERENCE_BACKEND)
+    logger.info(f"Using device: {device}, {INFERENCE_BACKEND} inference backend.")
+    return device
+
+# Nothing below is loaded at import: each resource is created on first use, or by
+# startup_rag_system before the first request
+resources = Resources()
+resources.register("collection", load_collection)
+resources.register("llm", create_llm_client)  # backend selected by LLM_BACKEND, Gemini by default
+resources.register("word_tokenize", load_word_tokenize)
+resources.register("synsets", load_synsets)
+resources.register("device", load_device)
+resources.register(
+    "embedding_model",
+    lambda: load_sentence_encoder(EMBEDDING_MODEL, device=resources.device, **inference_options),
+    depends=("device",),
+)
+resources.register(
+    "cross_encoder",
+    lambda: load_cross_encoder(CROSS_ENCODER_MODEL, device=resources.device, **inference_options),
+    depends=("device",),
+)
+resources.register(
+    "first_stage_encoder",
+    lambda: load_cross_encoder(FIRST_STAGE_MODEL, device=resources.device, **inference_options),
+    depends=("device",),
+)
+
+# Loaded in parallel at startup. WordNet is only needed to build a synonym lexicon (or
+# to expand queries without one), so it stays lazy
+STARTUP_RESOURCES = ["llm", "collection", "word_tokenize", "embedding_model", "cross_encoder"]
+if RERANK_FIRST_STAGE == 'minilm6':
+    STARTUP_RESOURCES.append("first_stage_encoder")
+_startup_timings = {}
 
 # -----------------------------------
 # Helper Functions
 # -----------------------------------
 
+def _document_routing_prompt(query):
+    """Build the prompt used by document_routing."""
+    return f"""
+You are a legal assistant. Your task is to analyze the query and determine 
+which of the following Tunisian legal codes are relevant to it. Return the 
+exact names of the relevant or relating codes provided in the list, separated by spaces. 
+Do not add any additional text or modify the code names.
+in case you did not find related code return the word "answer.
+
+Here are the Tunisian legal codes with descriptions:
+{LEGAL_CODES_PROMPT}
+
+Query:
+{query}
+
+Answer:
+"""
+
+def _parse_document_routing(response_text):
+    """Parse the routing response into a list of code names."""
+    # Print and return the response as a list of codes
+    logger.info(f"Document Routing Response: {response_text}")
+    if "answer" in response_text.lower() :
+        return []
+    # Names that are not codes of the corpus are dropped by the caller (known_codes)
+    return response_text.split()
+
+@memo.memoize("document_routing", ttl=ROUTING_MEMO_TTL)
 def document_routing(query):
     """
     Routes a query into relevant Tunisian legal codes by using the Gemini model.
@@ -101,91 +331,179 @@ def document_routing(query):
     Returns:
     list: A list of relevant Tunisian legal codes separated by spaces.
     """
+    return _parse_document_routing(resources.llm.generate(_document_routing_prompt(query)))
 
-    gemini_input = f"""
-You are a legal assistant. Your task is to analyze the query and determine 
-which of the following Tunisian legal codes are relevant to it. Return the 
-exact names of the relevant or relating codes provided in the list, separated by spaces. 
-Do not add any additional text or modify the code names.
-in case you did not find related code return the word "answer.
+@memo.memoize("document_routing", ttl=ROUTING_MEMO_TTL)
+async def adocument_routing(query):
+    """Async variant of document_routing."""
+    return _parse_document_routing(await resources.llm.agenerate(_document_routing_prompt(query)))
 
-Here are the Tunisian legal codes with descriptions:
-- code-aeronautique-civile: Governs regulations related to civil aviation, including air travel, aviation safety, and airspace management.
-- code-amenagement-territoire-urbanisme: Covers rules related to urban planning and land management, ensuring sustainable and organized territorial development.
-- code-arbitrage: Regulates arbitration processes for resolving disputes outside of court.
-- code-assurances: Governs insurance policies, companies, and obligations in Tunisia.
-- code-changes-commerce-exterieur: Deals with foreign trade policies and currency exchange regulations.
-- code-collectivites-locales: Outlines laws related to local government administration and responsibilities.
-- code-commerce-maritime: Regulates maritime trade, shipping operations, and associated commercial activities.
-- code-compatibilite-publique: Governs public accounting and management of state funds.
-- code-conduite-deontologie-agent-public: Sets ethical rules and professional conduct standards for public servants.
-- code-decorations: Outlines laws regarding state decorations, medals, and honors.
-- code-deontologie-medecin-veterinaire: Defines professional standards and ethics for veterinary medicine practitioners.
-- code-deontologie-medicale: Regulates ethical conduct and responsibilities of medical professionals.
-- code-devoirs-architectes: Details professional obligations and ethical standards for architects.
-- code-disciplinaire-penal-maritime: Covers disciplinary and penal matters related to maritime operations.
-- code-douanes: Governs customs duties, import/export regulations, and border control.
-- code-droit-international-prive: Regulates private international law matters, such as conflicts of law and cross-border disputes.
-- code-droits-enregistrement-timbre: Governs the registration and stamp duties in financial and legal transactions.
-- code-droits-procedures-fiscaux: Covers tax procedures and fiscal obligations.
-- code-droits-reels: Governs real property rights, including ownership, mortgages, and easements.
-- code-eaux: Manages water resources, usage, and conservation laws.
-- code-fiscalite-locale: Covers taxation and fiscal management at the local government level.
-- code-forestier: Protects and regulates forest areas, logging activities, and wildlife preservation.
-- code-hydrocarbures: Governs exploration, production, and management of hydrocarbons in Tunisia.
-- code-impot-sur-revenu-personnes-physiques-impot-sur-les-societes: Covers personal and corporate income tax regulations.
-- code-incitation-aux-investissements: Provides rules to encourage domestic and foreign investments in Tunisia.
-- code-industrie-cinematographique: Regulates the cinematic industry, including production, distribution, and exhibition of films.
-- code-justice-militaire: Covers legal matters and regulations within the military justice system.
-- code-minier: Regulates mining operations, mineral rights, and related activities.
-- code-nationalite: Defines laws related to Tunisian nationality, acquisition, and loss of citizenship.
-- code-obligations-contrats: Governs contracts, obligations, and related civil matters.
-- code-organismes-placement-collectif: Regulates collective investment schemes and funds management.
-- code-patrimoine-archeologique-historique-arts-traditionnels: Protects archaeological and historical heritage sites in Tunisia.
-- code-pecheur: Covers fishing regulations, rights, and resource management for fisheries.
-- code-penal: Governs criminal law and procedures, defining offenses and their penalties.
-- code-police-administrative-navigation-maritime: Manages administrative police duties related to maritime navigation.
-- code-ports-maritimes: Regulates the operation and management of maritime ports.
-- code-poste: Governs postal services, including mail delivery and related activities.
-- code-presse: Covers press freedom, media laws, and publication regulations.
-- code-prestation-services-financiers-aux-non-residents: Regulates financial services provided to non-residents.
-- code-procedure-civile-commerciale: Governs civil and commercial legal procedures in courts.
-- code-procedure-penale: Covers criminal procedure and the administration of justice.
-- code-protection-enfant: Protects children's rights and welfare in Tunisia.
-- code-route: Contains rules and regulations for road traffic, vehicle operations, and driving safety.
-- code-societes-commerciales: Regulates the formation, operation, and dissolution of commercial companies.
-- code-statut-personnel: Governs family law, including marriage, divorce, and inheritance.
-- code-taxe-sur-valeur-ajoutee: Regulates the application and administration of value-added tax (VAT).
-- code-telecommunications: Covers telecommunications operations, infrastructure, and related services.
-- code-travail: Governs labor laws, including employment contracts, workers' rights, and workplace regulations.
-- code-travail-maritime: Regulates working conditions, rights, and obligations of maritime workers.
-- tunisian_constitution_articles: Refers to the articles of the Tunisian Constitution, including fundamental rights, governance, and legal structure and general info about tunisia's values and info.
+def local_routing_batch(query_embeddings, gen=None):
+    """
+    Route queries with the centroid router of the index generation.
 
-Query:
-{query}
+    Returns:
+    list: Per query, (routed code names, confidence), or None when the confidence is
+    below ROUTER_MIN_CONFIDENCE and Gemini should route instead.
+    """
+    gen = gen or generation
+    results = []
+    for routed, confidence in gen.router.route_batch(
+        query_embeddings, ROUTER_MAX_CODES, ROUTER_CUMULATIVE, ROUTER_TEMPERATURE
+    ):
+        logger.info(f"Local routing: {[(code, round(p, 3)) for code, p in routed]} (confidence {confidence:.2f})")
+        results.append([code for code, _ in routed] if confidence >= ROUTER_MIN_CONFIDENCE else None)
+    return results
+
+def route_query(query, query_embedding, gen=None):
+    """
+    Route a query to legal codes: locally when ROUTER_MODE is 'local' and the router
+    is confident, with Gemini (document_routing) otherwise.
+    """
+    if ROUTER_MODE == 'local':
+        codes = local_routing_batch(query_embedding.reshape(1, -1), gen)[0]
+        if codes is not None:
+            return codes
+        logger.info("Local routing is not confident, routing with Gemini.")
+    return known_codes(document_routing(query), gen)
+
+async def aroute_query(query, query_embedding, gen=None):
+    """Async variant of route_query."""
+    if ROUTER_MODE == 'local':
+        codes = local_routing_batch(query_embedding.reshape(1, -1), gen)[0]
+        if codes is not None:
+            return codes
+        logger.info("Local routing is not confident, routing with Gemini.")
+    return known_codes(await adocument_routing(query), gen)
+
+def dense_search(query_embedding, k, relevant_codes=None, gen=None, nprobe=None, ef_search=None):
+    """
+    Search the dense index, restricted to the sub-indices of the routed codes.
 
-Answer:
-"""
+    Parameters:
+    query_embedding (np.ndarray): The normalized query embedding.
+    k (int): Number of documents to return.
+    relevant_codes (list): Routed code names. Searches the whole corpus when empty.
+    gen (IndexGeneration): The index generation to search (the current one when None).
+    nprobe (int): IVF lists to probe (DENSE_NPROBE when None).
+    ef_search (int): HNSW search depth (DENSE_EF_SEARCH when None).
+
+    Returns:
+    tuple: (scores, global document ids), best first.
+    """
+    return dense_search_batch(query_embedding.reshape(1, -1), k, relevant_codes, gen, nprobe, ef_search)[0]
 
-    # Instantiate the Gemini model
-    model = genai.GenerativeModel(model_name="gemini-1.5-flash")
+def dense_search_batch(query_embeddings, k, relevant_codes=None, gen=None, nprobe=None, ef_search=None):
+    """
+    Batched variant of dense_search: the queries share the same routed codes and are
+    searched with a single multi-row query matrix.
 
-    # Generate a response
-    response = model.generate_content(gemini_input)
+    Returns:
+    list: One (scores, global document ids) tuple per query row.
+    """
+    gen = gen or generation
+    query_matrix = np.ascontiguousarray(query_embeddings, dtype=np.float32)
+    routed_codes = [code for code in relevant_codes or [] if code in gen.code_indices]
+
+    if not routed_codes or not gen.sub_indexed:
+        # Approximate indexes restrict the search to the routed documents with an id selector
+        doc_ids = np.concatenate([gen.code_indices[code][1] for code in routed_codes]) if routed_codes else None
+        params = search_parameters(gen.index, nprobe or DENSE_NPROBE, ef_search or DENSE_EF_SEARCH, doc_ids)
+        distances, ids = gen.index.search(query_matrix, k, params=params)
+        return [(row_distances[row_ids >= 0], row_ids[row_ids >= 0]) for row_distances, row_ids in zip(distances, ids)]
+
+    scores = [[] for _ in range(len(query_matrix))]
+    ids = [[] for _ in range(len(query_matrix))]
+    for code in routed_codes:
+        sub_index, doc_ids = gen.code_indices[code]
+        distances, local_ids = sub_index.search(query_matrix, min(k, sub_index.ntotal))
+        for row, (row_distances, row_ids) in enumerate(zip(distances, local_ids)):
+            found = row_ids >= 0
+            scores[row].append(row_distances[found])
+            ids[row].append(doc_ids[row_ids[found]])
+
+    results = []
+    for row_scores, row_ids in zip(scores, ids):
+        row_scores = np.concatenate(row_scores)
+        row_ids = np.concatenate(row_ids)
+        order = np.argsort(-row_scores, kind='stable')[:k]
+        results.append((row_scores[order], row_ids[order]))
+    return results
+
+def dense_candidates_batch(query_embeddings, ks, relevant_codes_list, gen=None, search_params_list=None):
+    """
+    Dense candidates of a batch of queries. Queries with the same routed codes and
+    search settings are grouped into one multi-row search of the article index, or
+    of the passage index when passage retrieval is enabled.
 
-    # Print and return the response as a list of codes
-    logger.info(f"Document Routing Response: {response.text}")
-    if "answer" in response.text.lower() :
-        return []
-    return list(response.text.split())
+    Parameters:
+    query_embeddings (np.ndarray): Normalized query embeddings, shape (n_queries, dim).
+    ks (list): Number of candidates per query.
+    relevant_codes_list (list): Routed code names per query.
+    gen (IndexGeneration): The index generation to search (the current one when None).
+    search_params_list (list): Per-query search settings (nprobe, ef_search), or None.
 
-def query_expansion(query):
+    Returns:
+    list: Per query, (scores, document ids) for articles or (scores, article ids,
+    passage ids) for passages.
+    """
+    gen = gen or generation
+    search_params_list = search_params_list or [None] * len(ks)
+    groups = {}
+    for row, (k, codes, params) in enumerate(zip(ks, relevant_codes_list, search_params_list)):
+        params = params or {}
+        key = (k, tuple(codes or []), params.get("nprobe") or DENSE_NPROBE, params.get("ef_search") or DENSE_EF_SEARCH)
+        groups.setdefault(key, []).append(row)
+
+    results = [None] * len(ks)
+    for (k, codes, nprobe, ef_search), rows in groups.items():
+        if PASSAGE_RETRIEVAL and gen.passages is not None:
+            hits = gen.passages.search_batch(query_embeddings[rows], k, list(codes), nprobe, ef_search)
+        else:
+            hits = dense_search_batch(query_embeddings[rows], k, list(codes), gen, nprobe, ef_search)
+        for row, hit in zip(rows, hits):
+            results[row] = hit
+    return results
+
+class OkapiBM25Adapter:
+    """Expose rank_bm25.BM25Okapi through the SparseBM25 top_k interface."""
+
+    def __init__(self, engine):
+        self.okapi = engine.to_okapi()
+
+    def top_k(self, query_tokens, k, doc_ids=None):
+        scores = np.asarray(self.okapi.get_scores(query_tokens))
+        doc_ids = np.arange(len(scores)) if doc_ids is None else np.asarray(doc_ids, dtype=np.int64)
+        order = np.argsort(scores[doc_ids])[::-1][:k]
+        return doc_ids[order], scores[doc_ids][order]
+
+def select_bm25_backend(engine):
+    """Return the BM25 engine selected by BM25_BACKEND."""
+    if BM25_BACKEND == 'okapi':
+        logger.info("Using rank_bm25 BM25Okapi backend.")
+        return OkapiBM25Adapter(engine)
+    return engine
+
+def query_expansion(query, lexicon=None):
+    """
+    Expand the query with corpus synonyms from the precomputed lexicon, falling back
+    to WordNet (using the `wn` library) when no lexicon is loaded.
+    """
+    if lexicon is None:
+        lexicon = generation.lexicon if generation is not None else None
+    if lexicon is None:
+        return wordnet_expansion(query)
+    synonyms = lexicon.expand(resources.word_tokenize(query), MAX_EXPANSION_TERMS)
+    return query + ' ' + ' '.join(synonyms) if synonyms else query
+
+@memo.memoize("query_expansion", ttl=EXPANSION_MEMO_TTL)
+def wordnet_expansion(query):
     """
     Expand the query using synonyms from WordNet (using the `wn` library).
     """
     synonyms = set()
-    for word in nltk.word_tokenize(query):
-        for synset in wn.synsets(word):
+    for word in resources.word_tokenize(query):
+        for synset in resources.synsets(word):
             for lemma in synset.lemmas():  # Corrected: Added parentheses to call the method
                 synonym = lemma.replace('_', ' ')
                 if synonym.lower() != word.lower():
@@ -193,45 +511,67 @@ def query_expansion(query):
     expanded_query = query + ' ' + ' '.join(synonyms)
     return expanded_query
 
-def mmr(query_embedding, doc_embeddings, documents, top_k, diversity=0.7):
-    """
-    Calculate Maximal Marginal Relevance (MMR) to diversify the results.
+def mmr_batch(query_embeddings, doc_embeddings, top_k, diversity=0.7, candidate_mask=None):
     """
-    # Calculate similarity between query and documents
-    doc_similarities = np.dot(doc_embeddings, query_embedding.T).flatten()
+    Maximal Marginal Relevance for a batch of queries over shared candidates.
 
-    # Initialize list of selected documents and their embeddings
-    selected_docs = []
-    selected_indices = []
+    The candidate-candidate similarity matrix is computed once, and each query keeps a
+    running max-similarity-to-selected vector, so every selection step is a masked argmax.
+
+    Parameters:
+    query_embeddings (np.ndarray): Query embeddings, shape (n_queries, dim).
+    doc_embeddings (np.ndarray): Candidate embeddings, shape (n_docs, dim).
+    top_k (int): Number of documents to select per query.
+    diversity (float): Weight of relevance against redundancy.
+    candidate_mask (np.ndarray): Optional (n_queries, n_docs) boolean mask of each query's candidates.
 
-    for _ in range(top_k):
-        if len(selected_docs) == 0:
+    Returns:
+    np.ndarray: Selected candidate positions, shape (n_queries, top_k), padded with -1.
+    """
+    query_embeddings = np.atleast_2d(query_embeddings)
+    n_queries, n_docs = query_embeddings.shape[0], doc_embeddings.shape[0]
+    k = min(top_k, n_docs)
+    selected = np.full((n_queries, max(k, 0)), -1, dtype=np.int64)
+    if k <= 0:
+        return selected
+
+    doc_similarities = query_embeddings @ doc_embeddings.T
+    pairwise_similarities = doc_embeddings @ doc_embeddings.T
+    available = np.ones((n_queries, n_docs), dtype=bool) if candidate_mask is None else candidate_mask.copy()
+    max_similarity = np.zeros((n_queries, n_docs), dtype=doc_similarities.dtype)
+    rows = np.arange(n_queries)
+
+    for step in range(k):
+        if step == 0:
             # Select the document with the highest similarity
-            idx = np.argmax(doc_similarities)
-            selected_docs.append(documents[idx])
-            selected_indices.append(idx)
+            scores = doc_similarities.copy()
         else:
-            # Calculate MMR
-            mmr_scores = []
-            for idx in range(len(documents)):
-                if idx in selected_indices:
-                    continue
-                relevance = doc_similarities[idx]
-                diversity_scores = max(
-                    [np.dot(doc_embeddings[idx], doc_embeddings[i]) for i in selected_indices]
-                )
-                mmr_score = diversity * relevance - (1 - diversity) * diversity_scores
-                mmr_scores.append((idx, mmr_score))
-            if not mmr_scores:
-                break
-            # Select document with highest MMR score
-            idx, _ = max(mmr_scores, key=lambda x: x[1])
-            selected_docs.append(documents[idx])
-            selected_indices.append(idx)
-
-    return selected_docs
-def early_response(query, conversation):
-    gemini_input = f"""You are a conversation classifier for a legal assistant system. Analyze if this interaction requires legal expertise or is casual conversation.
+            scores = diversity * doc_similarities - (1 - diversity) * max_similarity
+        scores[~available] = -np.inf
+        idx = np.argmax(scores, axis=1)
+        has_candidate = available[rows, idx]
+        if not has_candidate.any():
+            break
+        selected[has_candidate, step] = idx[has_candidate]
+        available[rows[has_candidate], idx[has_candidate]] = False
+        new_similarity = pairwise_similarities[idx]
+        if step == 0:
+            max_similarity = new_similarity
+        else:
+            np.maximum(max_similarity, new_similarity, out=max_similarity)
+
+    return selected
+
+def mmr(query_embedding, doc_embeddings, documents, top_k, diversity=0.7):
+    """
+    Calculate Maximal Marginal Relevance (MMR) to diversify the results.
+    """
+    selected = mmr_batch(query_embedding.reshape(1, -1), doc_embeddings, top_k, diversity)[0]
+    return [documents[idx] for idx in selected if idx >= 0]
+
+def _early_response_prompt(query, conversation):
+    """Build the prompt used by early_response."""
+    return f"""You are a conversation classifier for a legal assistant system. Analyze if this interaction requires legal expertise or is casual conversation.
 
 Query: "{query}"
 
@@ -272,11 +612,10 @@ TRUE  (for legal queries)
 
 Evaluate the current query and respond accordingly:"""
 
-    model = genai.GenerativeModel(model_name="gemini-1.5-flash")
-    response = model.generate_content(gemini_input)
-    
+def _parse_early_response(response_text):
+    """Parse the classifier response into ["FALSE", reply] or ["TRUE", ""]."""
     try:
-        response_text = response.text.strip()
+        response_text = response_text.strip()
         if response_text.lower().startswith("false"):
             return ["FALSE", response_text[5:].strip()]
         else:
@@ -284,10 +623,17 @@ Evaluate the current query and respond accordingly:"""
     except:
         return ["TRUE", ""]
 
+def early_response(query, conversation):
+    return _parse_early_response(resources.llm.generate(_early_response_prompt(query, conversation)))
+
+async def aearly_response(query, conversation):
+    """Async variant of early_response."""
+    return _parse_early_response(await resources.llm.agenerate(_early_response_prompt(query, conversation)))
 
-def detect_language_and_translate(query):
-    """Helper function to detect language and translate if needed"""
-    gemini_input = f"""Analyze the following query:
+
+def _detect_language_prompt(query):
+    """Build the prompt used by detect_language_and_translate."""
+    return f"""Analyze the following query:
 "{query}"
 If the query is in Arabic or contains Arabic script, translate it to English and return exactly in this format:
 ARABIC  <english translation>
@@ -295,87 +641,170 @@ If the query is in English or any other non-Arabic script, return exactly in thi
 ENGLISH
 Only return the array format described above, nothing else."""
 
-    model = genai.GenerativeModel(model_name="gemini-1.5-flash")
-    response = model.generate_content(gemini_input)
+def _parse_detect_language(response_text, query):
+    """Parse the language detection response into [language, English query]."""
     try:
-        if response.text.lower()[:3]=="ara" :
-            return ["ARABIC",response.text[6:]]
+        if response_text.lower()[:3]=="ara" :
+            return ["ARABIC",response_text[6:]]
         else :
             return ["ENGLISH", query]
     except:
         return ["ENGLISH", query]
 
-def retrieve_documents(query, top_k=5):
-    """
-    Retrieve documents using document routing, BM25, and FAISS.
-    """
+@memo.memoize("detect_language", ttl=TRANSLATION_MEMO_TTL)
+def detect_language_and_translate(query):
+    """Helper function to detect language and translate if needed"""
+    return _parse_detect_language(resources.llm.generate(_detect_language_prompt(query)), query)
 
+@memo.memoize("detect_language", ttl=TRANSLATION_MEMO_TTL)
+async def adetect_language_and_translate(query):
+    """Async variant of detect_language_and_translate."""
+    return _parse_detect_language(await resources.llm.agenerate(_detect_language_prompt(query)), query)
 
-    # 1. Document Routing to get relevant legal codes
-    relevant_codes = document_routing(query)
-    logger.info(f"Relevant Legal Codes: {relevant_codes}")
+def known_codes(relevant_codes, gen=None):
+    """Keep the routed code names that have documents in the index generation."""
+    gen = gen or generation
+    return [code for code in relevant_codes if code in gen.code_indices]
+
+def filter_by_codes(relevant_codes, gen=None):
+    """
+    Keep the routed codes that exist in the corpus and list their documents.
 
+    Returns:
+    tuple: (known routed codes, ids of the documents to search).
+    """
+    gen = gen or generation
+    relevant_codes = known_codes(relevant_codes, gen)
     if not relevant_codes:
         logger.warning("No relevant legal codes found. Falling back to all documents.")
-        relevant_indices = list(range(len(documents)))
+        relevant_indices = list(range(len(gen)))
     else:
         # 2. Filter documents based on relevant codes
-        relevant_indices = [
-            idx for idx, code in enumerate(document_code_mapping)
-            if code in relevant_codes
-        ]
+        relevant_indices = np.sort(np.concatenate(
+            [gen.code_indices[code][1] for code in relevant_codes]
+        )).tolist()
         logger.info(f"Number of relevant documents: {len(relevant_indices)}")
+    return relevant_codes, relevant_indices
 
-    if not relevant_indices:
-        logger.warning("No documents found for the relevant codes.")
-        return []
-
-    # 3. Perform BM25 retrieval on the filtered documents
-    expanded_query = query_expansion(query)
-    tokenized_query = nltk.word_tokenize(expanded_query.lower())
-    bm25_scores = bm25.get_scores(tokenized_query)
-
-    # Filter BM25 scores based on relevant indices
-    bm25_scores_filtered = [bm25_scores[idx] for idx in relevant_indices]
-    bm25_top_n = np.argsort(bm25_scores_filtered)[::-1][:top_k * 10]
-    bm25_selected_indices = [relevant_indices[i] for i in bm25_top_n]
-    bm25_docs = [documents[i] for i in bm25_selected_indices]
-    bm25_embeddings = embeddings[bm25_selected_indices]
-
-    # 4. Perform FAISS retrieval on the filtered documents
-    query_embedding = embedding_model.encode(
-        expanded_query,
-        convert_to_numpy=True,
-        normalize_embeddings=True  # Ensure embeddings are not normalized
-    )
-    distances, indices = index.search(query_embedding.reshape(1, -1), top_k * 10)
+def prepare_query(query, gen=None):
+    """Expand the query with synonyms and tokenize it for BM25."""
+    gen = gen or generation
+    expanded_query = query_expansion(query, gen.lexicon)
+    tokenized_query = resources.word_tokenize(expanded_query.lower())
+    return expanded_query, tokenized_query
 
-    # Map FAISS indices back to original document indices
-    faiss_selected_indices = [relevant_indices[i] for i in indices[0] if i < len(relevant_indices)]
-    faiss_docs = [documents[i] for i in faiss_selected_indices]
-    faiss_embeddings = embeddings[faiss_selected_indices]
+def candidate_pool_size(top_k, search_params=None):
+    """Number of fused candidates passed to MMR: the request's candidate_pool or CANDIDATE_POOL_FACTOR * top_k."""
+    candidate_pool = (search_params or {}).get("candidate_pool")
+    return max(candidate_pool or CANDIDATE_POOL_FACTOR * top_k, top_k)
 
-    # 5. Combine BM25 and FAISS results while avoiding duplicates
-    combined_docs = []
-    combined_embeddings = []
-
-    for doc, emb in zip(bm25_docs + faiss_docs, np.vstack((bm25_embeddings, faiss_embeddings))):
-        if doc not in combined_docs:
-            combined_docs.append(doc)
-            combined_embeddings.append(emb)
+def fuse_candidates(bm25_hits, dense_hits, search_params=None):
+    """
+    Fuse the BM25 and dense rankings into one scored list of article ids, with the
+    request's fusion method and BM25 weight (FUSION_METHOD and FUSION_BM25_WEIGHT by default).
 
-    combined_embeddings = np.array(combined_embeddings)
+    Returns:
+    tuple: (article ids, fused scores), best first.
+    """
+    search_params = search_params or {}
+    bm25_weight = search_params.get("bm25_weight")
+    bm25_weight = FUSION_BM25_WEIGHT if bm25_weight is None else bm25_weight
+    bm25_ids, bm25_scores = bm25_hits
+    # The first two fields of dense hits are the scores and the article ids, for articles and passages
+    dense_scores, dense_ids = dense_hits[0], dense_hits[1]
+    return fuse(
+        [(bm25_ids, bm25_scores), (dense_ids, dense_scores)],
+        method=search_params.get("fusion") or FUSION_METHOD,
+        weights=[bm25_weight, 1.0 - bm25_weight],
+        rrf_k=FUSION_RRF_K,
+    )
 
-    if not combined_docs:
+def select_candidates(query_embedding, tokenized_query, top_k, relevant_codes, relevant_indices, gen=None,
+                      search_params=None, dense_hits=None, bm25_hits=None):
+    """
+    Retrieve BM25 and FAISS candidates from the routed documents, fuse them into one
+    scored list and diversify the best candidate_pool_size of them with MMR.
+    Returns the ids of the selected documents (passage ids in passage mode, see unit_texts).
+    search_params holds per-request search settings (nprobe, ef_search, fusion,
+    bm25_weight, candidate_pool); dense_hits and bm25_hits the dense and BM25
+    candidates of this query, when already computed (batched search, speculative retrieval).
+    """
+    gen = gen or generation
+    if bm25_hits is None:
+        # Only the routed documents are scored and ranked
+        bm25_hits = gen.bm25_search.top_k(tokenized_query, top_k * 10, relevant_indices)
+    if dense_hits is None:
+        dense_hits = dense_candidates_batch(
+            query_embedding.reshape(1, -1), [top_k * 10], [relevant_codes], gen, [search_params]
+        )[0]
+
+    # 3-5. Fuse the BM25 and FAISS rankings and keep the best candidates
+    # Only the sub-indices of the routed codes were scanned
+    fused_ids, _ = fuse_candidates(bm25_hits, dense_hits, search_params)
+    pool = fused_ids[:candidate_pool_size(top_k, search_params)]
+    if passage_mode(gen):
+        return select_passage_candidates(query_embedding, top_k, gen, pool, dense_hits)
+    if not len(pool):
         logger.warning("No documents retrieved after combining BM25 and FAISS results.")
         return []
 
     # 6. Apply MMR to select diverse and relevant documents
-    mmr_docs = mmr(query_embedding, combined_embeddings, combined_docs, top_k=top_k)
+    selected = mmr_batch(query_embedding.reshape(1, -1), np.asarray(gen.embeddings[pool]), top_k)[0]
+    return pool[selected[selected >= 0]].tolist()
+
+def select_passage_candidates(query_embedding, top_k, gen, article_ids, dense_hits):
+    """
+    Passage-level variant of select_candidates. Each fused article is represented by
+    the passage the dense search found for it, or else by its passage closest to the
+    query. Only the ids of the selected passages are returned, so reranking and
+    prompts see the matching part of long articles.
+    """
+    passages = gen.passages
+    _, dense_articles, dense_passages = dense_hits
+    best = dict(zip(dense_articles.tolist(), dense_passages.tolist()))
+    missing = [article_id for article_id in article_ids.tolist() if article_id not in best]
+    best.update(zip(missing, passages.best_passages(query_embedding, missing).tolist()))
+    candidates = [best[article_id] for article_id in article_ids.tolist() if best[article_id] >= 0]
+
+    if not candidates:
+        logger.warning("No passages retrieved after combining BM25 and FAISS results.")
+        return []
+
+    selected = mmr_batch(query_embedding.reshape(1, -1), np.asarray(passages.embeddings[candidates]), top_k)[0]
+    return [candidates[idx] for idx in selected.tolist() if idx >= 0]
 
-    # 7. Re-rank with CrossEncoder
-    query_doc_pairs = [(query, doc) for doc in mmr_docs]
-    rerank_scores = cross_encoder.predict(query_doc_pairs)
+def passage_mode(gen):
+    """True when retrieval over gen returns passage ids rather than article ids."""
+    return PASSAGE_RETRIEVAL and gen.passages is not None
+
+def unit_texts(ids, gen, arabic=False):
+    """
+    Decode the texts of retrieved ids (passages in passage mode, articles otherwise).
+    With arabic=True the Arabic text of the article, or of the parent article of a
+    passage, is returned instead, falling back to the English text when there is none.
+    """
+    if passage_mode(gen):
+        english = gen.passages.texts.take_list(ids)
+        article_ids = gen.passages.parent[np.asarray(ids, dtype=np.int64)]
+    else:
+        english = gen.store.get("content_english", ids)
+        article_ids = ids
+    if not arabic:
+        return english
+    return [
+        content_ar or content_en
+        for content_ar, content_en in zip(gen.store.get("content_arabic", article_ids), english)
+    ]
+
+def resolve_documents(doc_score_pairs, gen=None, arabic=False):
+    """Replace the ids of (id, score) pairs by their texts, for the response."""
+    gen = gen or generation
+    texts = unit_texts([doc_id for doc_id, _ in doc_score_pairs], gen, arabic)
+    return [(text, score) for text, (_, score) in zip(texts, doc_score_pairs)]
+
+def rank_documents(mmr_docs, rerank_scores):
+    """Normalize the cross-encoder scores and sort the document ids by them."""
+    rerank_scores = np.asarray(rerank_scores)
 
     # Normalize re-rank scores
     if rerank_scores.max() != rerank_scores.min():
@@ -391,10 +820,263 @@ def retrieve_documents(query, top_k=5):
     )
 
     return doc_score_pairs
-def make_query_better(query, conversation):
 
+def unit_embeddings(ids, gen):
+    """Embeddings of retrieved ids (passages in passage mode, articles otherwise)."""
+    embeddings = gen.passages.embeddings if passage_mode(gen) else gen.embeddings
+    return np.asarray(embeddings[np.asarray(ids, dtype=np.int64)], dtype=np.float32)
+
+def first_stage_scores(query, ids, gen, query_embedding):
+    """Cheap first-stage scores of the candidates (None when RERANK_FIRST_STAGE is 'none')."""
+    if RERANK_FIRST_STAGE == 'minilm6':
+        return first_stage_batcher.submit([(query, doc) for doc in unit_texts(ids, gen)])
+    if RERANK_FIRST_STAGE == 'dense':
+        return unit_embeddings(ids, gen) @ query_embedding
+    return None
+
+async def afirst_stage_scores(query, ids, gen, query_embedding):
+    """Async variant of first_stage_scores."""
+    if RERANK_FIRST_STAGE == 'minilm6':
+        return await first_stage_batcher.asubmit([(query, doc) for doc in unit_texts(ids, gen)])
+    return first_stage_scores(query, ids, gen, query_embedding)
+
+def rerank_documents(query, ids, gen, query_embedding):
+    """
+    Rerank candidate ids through the cascade: the first stage prunes them or decides
+    alone, cached scores are reused and only the remaining pairs go to the cross-encoder.
+
+    Returns:
+    list: (id, normalized score) pairs, best first.
+    """
+    kept, scores, missing = rerank_cascade.plan(
+        query, gen.ids_version, ids, first_stage_scores(query, ids, gen, query_embedding)
+    )
+    if missing:
+        missing_scores = rerank_batcher.submit([(query, doc) for doc in unit_texts(missing, gen)])
+        rerank_cascade.complete(query, gen.ids_version, scores, missing, missing_scores)
+    return rank_documents(kept, [scores[doc_id] for doc_id in kept])
+
+async def arerank_documents(query, ids, gen, query_embedding):
+    """Async variant of rerank_documents."""
+    first_scores = await afirst_stage_scores(query, ids, gen, query_embedding)
+    kept, scores, missing = rerank_cascade.plan(query, gen.ids_version, ids, first_scores)
+    if missing:
+        missing_scores = await rerank_batcher.asubmit([(query, doc) for doc in unit_texts(missing, gen)])
+        rerank_cascade.complete(query, gen.ids_version, scores, missing, missing_scores)
+    return rank_documents(kept, [scores[doc_id] for doc_id in kept])
+
+def retrieve_documents(query, top_k=5, relevant_codes=None, gen=None, search_params=None):
+    """
+    Retrieve documents using document routing, BM25, and FAISS.
+    Routing is skipped when relevant_codes is already known (e.g. from the pre-flight call).
+    All stages read the same index generation, even if a refresh swaps it meanwhile.
+    Returns (document id, score) pairs; resolve_documents decodes their texts.
+    """
+    gen = gen or generation
+
+
+    # 1. Document Routing to get relevant legal codes
+    if relevant_codes is None:
+        relevant_codes = route_query(query, embedding_batcher.submit([query])[0], gen)
+    logger.info(f"Relevant Legal Codes: {relevant_codes}")
+
+    relevant_codes, relevant_indices = filter_by_codes(relevant_codes, gen)
+    if not relevant_indices:
+        logger.warning("No documents found for the relevant codes.")
+        return []
+
+    expanded_query, tokenized_query = prepare_query(query, gen)
+    query_embedding = embedding_batcher.submit([expanded_query])[0]
+    mmr_docs = select_candidates(query_embedding, tokenized_query, top_k, relevant_codes, relevant_indices, gen, search_params)
+    if not mmr_docs:
+        return []
+
+    # 7. Re-rank with the cascade and the CrossEncoder
+    return rerank_documents(query, mmr_docs, gen, query_embedding)
+
+async def run_cpu(func, *args, **kwargs):
+    """
+    Run a CPU-bound function on the bounded executor without blocking the event loop.
+    """
+    global _cpu_slots
+    loop = asyncio.get_running_loop()
+    if _cpu_slots is None or _cpu_slots[0] is not loop:
+        _cpu_slots = (loop, asyncio.Semaphore(CPU_QUEUE_SIZE))
+    slots = _cpu_slots[1]
+    await slots.acquire()
+    # A cancelled caller cannot stop a running call: the slot is released when the call
+    # itself finishes (or is cancelled before starting), not when the caller stops waiting
+    future = cpu_executor.submit(func, *args, **kwargs)
+    future.add_done_callback(lambda _: loop.call_soon_threadsafe(slots.release))
+    return await asyncio.wrap_future(future)
+
+async def aretrieve_documents(query, top_k=5, relevant_codes=None, gen=None, search_params=None):
+    """
+    Async variant of retrieve_documents: routing is awaited, CPU-bound stages run on
+    the bounded executor, and encoding/reranking go through the shared micro-batchers.
+    """
+    gen = gen or generation
+    if relevant_codes is None:
+        relevant_codes = await aroute_query(query, (await embedding_batcher.asubmit([query]))[0], gen)
+    logger.info(f"Relevant Legal Codes: {relevant_codes}")
+
+    relevant_codes, relevant_indices = filter_by_codes(relevant_codes, gen)
+    if not relevant_indices:
+        logger.warning("No documents found for the relevant codes.")
+        return []
+
+    expanded_query, tokenized_query = await run_cpu(prepare_query, query, gen)
+    query_embedding = (await embedding_batcher.asubmit([expanded_query]))[0]
+    mmr_docs = await run_cpu(
+        select_candidates, query_embedding, tokenized_query, top_k, relevant_codes, relevant_indices, gen, search_params
+    )
+    if not mmr_docs:
+        return []
+
+    return await arerank_documents(query, mmr_docs, gen, query_embedding)
+
+def encode_queries(texts):
+    """Encode a batch of queries in one call to the embedding model."""
+    return resources.embedding_model.encode(
+        texts,
+        batch_size=EMBEDDING_MAX_BATCH_SIZE,
+        convert_to_numpy=True,
+        normalize_embeddings=True
+    )
+
+def retrieve_documents_batch(queries, top_ks, relevant_codes_list, gen=None, search_params_list=None):
+    """
+    Batched variant of retrieve_documents for already routed queries. The queries are
+    encoded in one call, dense candidates come from one multi-row search per group of
+    queries with the same routing, and all (query, document) pairs are reranked in
+    one cross-encoder call.
+
+    Parameters:
+    queries (list): The enhanced English queries.
+    top_ks (list): Number of documents to return per query.
+    relevant_codes_list (list): Routed code names per query.
+    gen (IndexGeneration): The index generation to search (the current one when None).
+    search_params_list (list): Per-query search settings (nprobe, ef_search, fusion, bm25_weight,
+    candidate_pool), or None.
+
+    Returns:
+    list: The ranked (document id, score) pairs of each query.
+    """
+    gen = gen or generation
+    search_params_list = search_params_list or [None] * len(queries)
+    filtered = [filter_by_codes(codes or [], gen) for codes in relevant_codes_list]
+    prepared = [prepare_query(query, gen) for query in queries]
+    query_embeddings = encode_queries([expanded_query for expanded_query, _ in prepared])
+    dense_hits = dense_candidates_batch(
+        query_embeddings, [top_k * 10 for top_k in top_ks], [codes for codes, _ in filtered], gen, search_params_list
+    )
 
-    gemini_input = f"""You are a query enhancement system. Your task is to transform the given query by incorporating relevant context from the conversation history. Pay special attention to:
+    mmr_docs = [
+        select_candidates(
+            query_embedding, tokenized_query, top_k, relevant_codes, relevant_indices, gen, search_params, hits
+        )
+        for query_embedding, (_, tokenized_query), top_k, (relevant_codes, relevant_indices), search_params, hits
+        in zip(query_embeddings, prepared, top_ks, filtered, search_params_list, dense_hits)
+    ]
+
+    # One first-stage call and one cross-encoder call for the pairs of all queries
+    first_scores = [None] * len(queries)
+    if RERANK_FIRST_STAGE == 'minilm6':
+        pairs = [(query, doc) for query, docs in zip(queries, mmr_docs) for doc in unit_texts(docs, gen)]
+        scores = resources.first_stage_encoder.predict(pairs, batch_size=RERANK_MAX_BATCH_SIZE) if pairs else []
+        start = 0
+        for i, docs in enumerate(mmr_docs):
+            first_scores[i] = scores[start:start + len(docs)]
+            start += len(docs)
+    elif RERANK_FIRST_STAGE == 'dense':
+        first_scores = [unit_embeddings(docs, gen) @ emb for docs, emb in zip(mmr_docs, query_embeddings)]
+    plans = [
+        rerank_cascade.plan(query, gen.ids_version, docs, scores)
+        for query, docs, scores in zip(queries, mmr_docs, first_scores)
+    ]
+
+    pairs = [(query, doc) for query, (_, _, missing) in zip(queries, plans) for doc in unit_texts(missing, gen)]
+    rerank_scores = resources.cross_encoder.predict(pairs, batch_size=RERANK_MAX_BATCH_SIZE) if pairs else []
+    results = []
+    start = 0
+    for query, (kept, scores, missing) in zip(queries, plans):
+        rerank_cascade.complete(query, gen.ids_version, scores, missing, rerank_scores[start:start + len(missing)])
+        start += len(missing)
+        results.append(rank_documents(kept, [scores[doc_id] for doc_id in kept]) if kept else [])
+    return results
+
+def overfetch_candidates(query, top_k=5, gen=None, search_params=None):
+    """
+    BM25 and dense candidates of a query over the whole corpus, over-fetched by
+    ROUTING_OVERFETCH so they can be filtered by codes routed later (select_routed_candidates).
+
+    Returns:
+    dict: query, embedding, tokenized query, bm25_hits, dense_hits and the search settings.
+    """
+    gen = gen or generation
+    expanded_query, tokenized_query = prepare_query(query, gen)
+    query_embedding = embedding_batcher.submit([expanded_query])[0]
+    k = top_k * 10 * ROUTING_OVERFETCH
+    bm25_hits = gen.bm25_search.top_k(tokenized_query, k)
+    dense_hits = dense_candidates_batch(query_embedding.reshape(1, -1), [k], [None], gen, [search_params])[0]
+    return {
+        "query": query,
+        "embedding": query_embedding,
+        "tokenized_query": tokenized_query,
+        "bm25_hits": bm25_hits,
+        "dense_hits": dense_hits,
+        "search_params": search_params,
+    }
+
+def select_routed_candidates(candidates, top_k, relevant_codes, gen=None):
+    """
+    Keep the over-fetched candidates of the routed codes and diversify them with MMR,
+    like select_candidates does for a routed search.
+    """
+    gen = gen or generation
+    relevant_codes, relevant_indices = filter_by_codes(relevant_codes or [], gen)
+    bm25_hits, dense_hits = candidates["bm25_hits"], candidates["dense_hits"]
+    if relevant_codes:
+        allowed = np.zeros(len(gen), dtype=bool)
+        allowed[relevant_indices] = True
+        routed = allowed[bm25_hits[0]]
+        bm25_hits = tuple(part[routed] for part in bm25_hits)
+        # The second field holds article ids for both article and passage hits
+        routed = allowed[dense_hits[1]]
+        dense_hits = tuple(part[routed] for part in dense_hits)
+    k = top_k * 10
+    return select_candidates(
+        candidates["embedding"], candidates["tokenized_query"], top_k, relevant_codes, relevant_indices, gen,
+        candidates["search_params"], tuple(part[:k] for part in dense_hits), tuple(part[:k] for part in bm25_hits),
+    )
+
+async def arerank_candidates(query, candidates, top_k, relevant_codes, gen=None):
+    """Finish a speculative retrieval once the codes are routed: filter, MMR and rerank."""
+    gen = gen or generation
+    mmr_docs = await run_cpu(select_routed_candidates, candidates, top_k, relevant_codes, gen)
+    if not mmr_docs:
+        return []
+    return await arerank_documents(query, mmr_docs, gen, candidates["embedding"])
+
+def stage_metrics():
+    """Mean stage durations and how often each stage is on the critical path."""
+    return pipeline_metrics.summary()
+
+def cache_metrics():
+    """Hit/miss counters of the answer cache, the memoized sub-steps and the rerank cascade."""
+    return {"answers": answer_cache.stats(), "memo": memo.stats(), "rerank": rerank_cascade.stats()}
+
+def batching_metrics():
+    """Batch-size and queue-delay metrics of the shared micro-batchers."""
+    return {
+        "embedding": embedding_batcher.metrics(),
+        "rerank": rerank_batcher.metrics(),
+        "first_stage": first_stage_batcher.metrics(),
+    }
+
+def _make_query_better_prompt(query, conversation):
+    """Build the prompt used by make_query_better."""
+    return f"""You are a query enhancement system. Your task is to transform the given query by incorporating relevant context from the conversation history. Pay special attention to:
     1. References to previous topics or articles
     2. Follow-up questions like "tell me more" or "analyze this"
     3. Requests for specific details mentioned earlier
@@ -422,115 +1104,235 @@ def make_query_better(query, conversation):
     Your task is to generate ONE clear, specific query that will help retrieve relevant legal information from our database of Tunisian legal codes and regulations.
 
     Database coverage includes topics like:
-- code-aeronautique-civile: Governs regulations related to civil aviation, including air travel, aviation safety, and airspace management.
-- code-amenagement-territoire-urbanisme: Covers rules related to urban planning and land management, ensuring sustainable and organized territorial development.
-- code-arbitrage: Regulates arbitration processes for resolving disputes outside of court.
-- code-assurances: Governs insurance policies, companies, and obligations in Tunisia.
-- code-changes-commerce-exterieur: Deals with foreign trade policies and currency exchange regulations.
-- code-collectivites-locales: Outlines laws related to local government administration and responsibilities.
-- code-commerce-maritime: Regulates maritime trade, shipping operations, and associated commercial activities.
-- code-compatibilite-publique: Governs public accounting and management of state funds.
-- code-conduite-deontologie-agent-public: Sets ethical rules and professional conduct standards for public servants.
-- code-decorations: Outlines laws regarding state decorations, medals, and honors.
-- code-deontologie-medecin-veterinaire: Defines professional standards and ethics for veterinary medicine practitioners.
-- code-deontologie-medicale: Regulates ethical conduct and responsibilities of medical professionals.
-- code-devoirs-architectes: Details professional obligations and ethical standards for architects.
-- code-disciplinaire-penal-maritime: Covers disciplinary and penal matters related to maritime operations.
-- code-douanes: Governs customs duties, import/export regulations, and border control.
-- code-droit-international-prive: Regulates private international law matters, such as conflicts of law and cross-border disputes.
-- code-droits-enregistrement-timbre: Governs the registration and stamp duties in financial and legal transactions.
-- code-droits-procedures-fiscaux: Covers tax procedures and fiscal obligations.
-- code-droits-reels: Governs real property rights, including ownership, mortgages, and easements.
-- code-eaux: Manages water resources, usage, and conservation laws.
-- code-fiscalite-locale: Covers taxation and fiscal management at the local government level.
-- code-forestier: Protects and regulates forest areas, logging activities, and wildlife preservation.
-- code-hydrocarbures: Governs exploration, production, and management of hydrocarbons in Tunisia.
-- code-impot-sur-revenu-personnes-physiques-impot-sur-les-societes: Covers personal and corporate income tax regulations.
-- code-incitation-aux-investissements: Provides rules to encourage domestic and foreign investments in Tunisia.
-- code-industrie-cinematographique: Regulates the cinematic industry, including production, distribution, and exhibition of films.
-- code-justice-militaire: Covers legal matters and regulations within the military justice system.
-- code-minier: Regulates mining operations, mineral rights, and related activities.
-- code-nationalite: Defines laws related to Tunisian nationality, acquisition, and loss of citizenship.
-- code-obligations-contrats: Governs contracts, obligations, and related civil matters.
-- code-organismes-placement-collectif: Regulates collective investment schemes and funds management.
-- code-patrimoine-archeologique-historique-arts-traditionnels: Protects archaeological and historical heritage sites in Tunisia.
-- code-pecheur: Covers fishing regulations, rights, and resource management for fisheries.
-- code-penal: Governs criminal law and procedures, defining offenses and their penalties.
-- code-police-administrative-navigation-maritime: Manages administrative police duties related to maritime navigation.
-- code-ports-maritimes: Regulates the operation and management of maritime ports.
-- code-poste: Governs postal services, including mail delivery and related activities.
-- code-presse: Covers press freedom, media laws, and publication regulations.
-- code-prestation-services-financiers-aux-non-residents: Regulates financial services provided to non-residents.
-- code-procedure-civile-commerciale: Governs civil and commercial legal procedures in courts.
-- code-procedure-penale: Covers criminal procedure and the administration of justice.
-- code-protection-enfant: Protects children's rights and welfare in Tunisia.
-- code-route: Contains rules and regulations for road traffic, vehicle operations, and driving safety.
-- code-societes-commerciales: Regulates the formation, operation, and dissolution of commercial companies.
-- code-statut-personnel: Governs family law, including marriage, divorce, and inheritance.
-- code-taxe-sur-valeur-ajoutee: Regulates the application and administration of value-added tax (VAT).
-- code-telecommunications: Covers telecommunications operations, infrastructure, and related services.
-- code-travail: Governs labor laws, including employment contracts, workers' rights, and workplace regulations.
-- code-travail-maritime: Regulates working conditions, rights, and obligations of maritime workers.
-- tunisian_constitution_articles: Refers to the articles of the Tunisian Constitution, including fundamental rights, governance, and legal structure and general info about tunisia's values and info.
+{LEGAL_CODES_PROMPT}
 
     ONLY RETURN THE ENHANCED QUERY, NOTHING ELSE
     Enhanced Query:"""
 
-    # Instantiate the Gemini model
-    model = genai.GenerativeModel(model_name="gemini-1.5-flash")
-
+def make_query_better(query, conversation):
     # Generate a response
-    response = model.generate_content(gemini_input)
+    return resources.llm.generate(_make_query_better_prompt(query, conversation))
 
+async def amake_query_better(query, conversation):
+    """Async variant of make_query_better."""
+    return await resources.llm.agenerate(_make_query_better_prompt(query, conversation))
 
-    return response.text
+def _preflight_prompt(query, conversation, with_routing=True):
+    """
+    Build the prompt used by preflight. Without routing, the code list and the
+    relevant_codes field are left out (the local router picks the codes).
+    """
+    routing_field = ""
+    codes_section = ""
+    if with_routing:
+        routing_field = '\n- "relevant_codes": the exact names of the relevant or relating codes from the list below, or [] if none is related.'
+        codes_section = f"""
+Tunisian legal codes:
+{LEGAL_CODES_PROMPT}
+"""
+    return f"""You are the pre-processing stage of a Tunisian legal assistant. Analyze the query and the conversation and return ONE JSON object with exactly these fields:
+
+- "is_legal": false for casual conversation (greetings, introductions, small talk, thanks, farewells, questions about the AI itself), true for legal queries (Tunisian laws, legal procedures, rights and obligations, court procedures, compliance, follow-ups to legal discussions).
+- "casual_response": if is_legal is false, a short friendly reply (you are HouyemAI, an AI legal assistant); otherwise "".
+- "language": "ARABIC" if the query is in Arabic or contains Arabic script, otherwise "ENGLISH".
+- "english_query": the query translated to English if it is in Arabic, otherwise the query unchanged.
+- "enhanced_query": ONE clear, specific English search query that resolves references to previous topics ("tell me more", "what about the fourth article") using the conversation history, expands implicit requests and stays focused on the Tunisian legal framework.{routing_field}
+{codes_section}
+Query: "{query}"
 
-def rag_system(query, top_k=5, memory: List[Message] = None):
+Previous Conversation:
+{conversation}
+
+JSON:"""
+
+def _parse_preflight(response_text, query, with_routing=True):
     """
-    Retrieval-Augmented Generation system with Gemini filtering.
+    Validate the pre-flight JSON. Raises ValueError/KeyError when it is unusable.
+    relevant_codes is None when the call did not route the query.
+    """
+    # Models sometimes wrap the JSON in a Markdown code fence despite the JSON mode
+    response_text = re.sub(r"^\s*```(?:json)?\s*|\s*```\s*$", "", response_text)
+    result = json.loads(response_text)
+    if not isinstance(result, dict):
+        raise ValueError(f"Pre-flight response is not a JSON object: {response_text!r}")
+    is_legal = result["is_legal"]
+    if not isinstance(is_legal, bool):
+        raise ValueError(f"is_legal is not a boolean: {is_legal!r}")
+    if not is_legal:
+        casual_response = str(result.get("casual_response", "")).strip()
+        if not casual_response:
+            raise ValueError("Missing casual_response for a casual query")
+        return {"is_legal": False, "casual_response": casual_response}
+
+    language = "ARABIC" if str(result["language"]).strip().upper() == "ARABIC" else "ENGLISH"
+    english_query = str(result.get("english_query") or "").strip() or query
+    enhanced_query = str(result.get("enhanced_query") or "").strip() or english_query
+    relevant_codes = None
+    if with_routing:
+        # Checked against the codes of the corpus by the caller (known_codes)
+        relevant_codes = [str(code) for code in result.get("relevant_codes") or []]
+    logger.info(f"Pre-flight: language={language}, codes={relevant_codes}, enhanced query={enhanced_query}")
+    return {
+        "is_legal": True,
+        "casual_response": "",
+        "language": language,
+        "english_query": english_query,
+        "enhanced_query": enhanced_query,
+        "relevant_codes": relevant_codes,
+    }
+
+def preflight(query, conversation, client=None):
+    """
+    Run the four pre-retrieval steps (early_response, detect_language_and_translate,
+    make_query_better and document_routing) as a single structured Gemini call.
+
+    Parameters:
+    query (str): The raw user query.
+    conversation (str): The formatted conversation history.
+    client (LLMClient): The LLM client to use, e.g. one with a stub backend returning
+        canned JSON. Defaults to the shared client.
+
+    Returns:
+    dict: is_legal, casual_response, language, english_query, enhanced_query and
+    relevant_codes, or None if the response could not be parsed. Routing is left to
+    the local router (relevant_codes None) when ROUTER_MODE is 'local'.
     """
+    client = client or resources.llm
+    with_routing = ROUTER_MODE != 'local'
     try:
-        logger.info(f"Starting RAG system for query: {query}")
-                # Format conversation history
-        conversation_history = ""
-        if memory and len(memory) > 0:
-            conversation_history = "\nPrevious conversation:\n" + "\n".join([
-                f"{'Human' if msg.role == 'user' else 'Assistant'}: {msg.content}"
-                for msg in memory[-10:]  # Take last 10 messages
-            ])
-            logger.info("Added conversation history to context")
-        logger.info("conversation history : " ,conversation_history)
-        early_tag,early_rep=early_response(query,conversation_history)
-        if early_tag=="FALSE" :
-            return early_rep,[]
-        logger.info("early tag :",early_tag)
-        logger.info("early rep :",early_rep)
-        # New Step: Detect language and translate if needed
-        lang_tag, query = detect_language_and_translate(query)
-        logger.info(f"Query language: {lang_tag}, Processed query: {query}")
-        queryfinal=query
-        query=make_query_better(query,conversation_history)
-        logger.info("new query is : " , query)
-        # Step 1: Retrieve and re-rank documents
-        logger.info("Retrieving documents...")
-        doc_score_pairs = retrieve_documents(query, top_k=top_k)
-        logger.info(f"Retrieved {len(doc_score_pairs)} documents.")
+        prompt = _preflight_prompt(query, conversation, with_routing)
+        return _parse_preflight(client.generate(prompt, json_mode=True), query, with_routing)
+    except Exception as e:
+        logger.warning(f"Pre-flight call failed, falling back to per-step calls: {e}")
+        return None
 
-        if not doc_score_pairs:
-            logger.warning("No relevant documents found for the given query.")
-            return "No relevant documents found for the given query.", ""
+async def apreflight(query, conversation, client=None):
+    """Async variant of preflight."""
+    client = client or resources.llm
+    with_routing = ROUTER_MODE != 'local'
+    try:
+        prompt = _preflight_prompt(query, conversation, with_routing)
+        return _parse_preflight(await client.agenerate(prompt, json_mode=True), query, with_routing)
+    except Exception as e:
+        logger.warning(f"Pre-flight call failed, falling back to per-step calls: {e}")
+        return None
+
+def format_conversation(memory):
+    """Format the last 10 messages of the conversation history for the prompts."""
+    if not memory:
+        return ""
+    return "\nPrevious conversation:\n" + "\n".join([
+        f"{'Human' if msg.role == 'user' else 'Assistant'}: {msg.content}"
+        for msg in memory[-10:]  # Take last 10 messages
+    ])
+
+async def aunderstand_query(query, conversation_history, graph=None, speculate=None):
+    """
+    Classify, translate, enhance and route a query: one pre-flight call, or the
+    per-step calls when the pre-flight call fails. The fallback classification and
+    language detection both read the raw query and run concurrently; the translation
+    chain is cancelled when the query turns out to be casual.
+
+    Parameters:
+    query (str): The raw user query.
+    conversation_history (str): The formatted conversation history.
+    graph (StageGraph): The request's stage graph, to record the stages in.
+    speculate (callable): Async function retrieving candidates for an English query, run
+    as the "speculative_retrieval" stage: on the raw query while it is classified, or, for
+    queries in Arabic script, on the translated query of a legal question in the per-step
+    fallback. It is cancelled when the query turns out to be casual.
 
-        # Step 2: Clean each document before including in context
-        cleaned_docs = [doc.replace('## English Translation:', '').strip() for doc, _ in doc_score_pairs]
-        scores = [score for _, score in doc_score_pairs]
+    Returns:
+    dict: casual_response (set for non-legal queries), language, english_query,
+    query (the enhanced query), relevant_codes (None when routing is still needed) and
+    speculated_query (the query of the speculative retrieval, or None).
+    """
+    graph = graph or StageGraph()
+    speculated_query = None
+    if speculate is not None and not ARABIC_SCRIPT.search(query):
+        graph.add("speculative_retrieval", lambda: speculate(query))
+        speculated_query = query
+
+    async def understood_from_preflight(pre):
+        # A casual verdict carries only the reply
+        if not pre["is_legal"]:
+            return {"casual_response": pre["casual_response"]}
+        return {
+            "casual_response": None,
+            "language": pre["language"],
+            "english_query": pre["english_query"],
+            "query": pre["enhanced_query"],
+            "relevant_codes": pre["relevant_codes"],
+            "speculated_query": speculated_query,
+        }
+
+    pre = await graph.add("preflight", lambda: apreflight(query, conversation_history))
+    if pre is not None:
+        if not pre["is_legal"]:
+            graph.cancel("speculative_retrieval")
+        return await graph.add("understand", understood_from_preflight, deps=("preflight",))
+
+    step_speculation = speculate is not None and speculated_query is None
+
+    async def understood_from_steps(early, detected, enhanced):
+        lang_tag, translated = detected
+        logger.info(f"Query language: {lang_tag}, Processed query: {translated}")
+        logger.info(f"new query is : {enhanced}")
+        return {
+            "casual_response": None,
+            "language": lang_tag,
+            "english_query": translated,
+            "query": enhanced,
+            "relevant_codes": None,
+            "speculated_query": translated if step_speculation else speculated_query,
+        }
+
+    graph.add("early_response", lambda: aearly_response(query, conversation_history))
+    # New Step: Detect language and translate if needed
+    graph.add("detect_language", lambda: adetect_language_and_translate(query))
+    graph.add(
+        "make_query_better", lambda detected: amake_query_better(detected[1], conversation_history),
+        deps=("detect_language",),
+    )
+    if step_speculation:
+        async def speculative_retrieval(early, detected):
+            # Casual queries are answered without retrieval
+            if early[0] == "FALSE":
+                return None
+            return await speculate(detected[1])
+
+        graph.add("speculative_retrieval", speculative_retrieval, deps=("early_response", "detect_language"))
+    early_tag,early_rep=await graph.result("early_response")
+    if early_tag=="FALSE" :
+        graph.cancel("detect_language", "make_query_better", "speculative_retrieval")
+        return {"casual_response": early_rep}
+    logger.info(f"early tag : {early_tag}")
+    logger.info(f"early rep : {early_rep}")
+    return await graph.add(
+        "understand", understood_from_steps, deps=("early_response", "detect_language", "make_query_better"),
+    )
 
-        # Step 3: Prepare initial context for Gemini filtering
-        initial_context = "\n\n".join([
-            f"Document {i+1}:\n{doc}"
-            for i, doc in enumerate(cleaned_docs)
-        ])
+async def averify_documents(query, lang_tag, doc_score_pairs, gen=None):
+    """
+    Ask Gemini which retrieved documents are relevant to the query.
 
-        gemini_input = f"""Based on the following documents and the query, provide the indices of the **most relevant documents** as integers corresponding to their order in the list of documents. only exclude documents that are totally irrelevants don't be harsh. 
+    Returns:
+    tuple: (verified (id, score) pairs sorted by score, None), or (None, message to
+    return to the user) when no document could be verified.
+    """
+    # Step 2: Clean each document before including in context
+    cleaned_docs = [
+        doc.replace('## English Translation:', '').strip()
+        for doc, _ in resolve_documents(doc_score_pairs, gen)
+    ]
+
+    # Step 3: Prepare initial context for Gemini filtering
+    initial_context = "\n\n".join([
+        f"Document {i+1}:\n{doc}"
+        for i, doc in enumerate(cleaned_docs)
+    ])
+
+    gemini_input = f"""Based on the following documents and the query, provide the indices of the **most relevant documents** as integers corresponding to their order in the list of documents. only exclude documents that are totally irrelevants don't be harsh. 
 Include only the document indices in a comma-separated format.
 
 Example format:
@@ -545,81 +1347,76 @@ Documents:
 Query:
 {query}
 """
-        logger.info("Sending initial context to Gemini for filtering relevant document indices...")
+    logger.info("Sending initial context to Gemini for filtering relevant document indices...")
 
-        # Step 4: Instantiate the Gemini model
-        model = genai.GenerativeModel(model_name="gemini-1.5-flash")
+    # Step 5: Use Google Gemini to identify relevant document indices
+    response_text = (await resources.llm.agenerate(gemini_input)).strip()
+    logger.info("Received response from Gemini.")
 
-        # Step 5: Use Google Gemini to identify relevant document indices
-        gemini_response = model.generate_content(gemini_input)
-        response_text = gemini_response.text.strip()
-        logger.info("Received response from Gemini.")
-
-        try:
-            indices_section = response_text.split("Relevant Document Indices:")[1].strip()
-            relevant_indices = [
-                int(idx.strip()) for idx in indices_section.strip("[]").split(",") if idx.strip().isdigit()
-            ]
-            
-            # Handle case where no indices are found
-            if not relevant_indices:
-                no_relevant_msg = "While I found some documents, none seem directly relevant to your query. Could you please provide more specific details about what you're looking for?"
-                if lang_tag.lower() == "arabic":
-                    return translate_to_arabic(no_relevant_msg), []
-                return no_relevant_msg, []
-                
-            logger.info(f"Relevant document indices identified: {relevant_indices}")
-            
-            # Filter and verify documents
-            gemini_verified = [
-                doc_score_pairs[idx - 1] for idx in relevant_indices
-                if 1 <= idx <= len(doc_score_pairs)
-            ]
-            
-            # Handle case where no documents pass verification
-            if not gemini_verified:
-                no_verified_msg = "I found some potential matches, but couldn't verify their relevance to your query. Could you please rephrase your question?"
-                if lang_tag.lower() == "arabic":
-                    return translate_to_arabic(no_verified_msg), []
-                return no_verified_msg, []
-                
-        except (IndexError, ValueError) as e:
-            logger.error(f"Error processing Gemini response: {e}")
-            error_msg = "I encountered an issue processing your query. Could you please try asking in a different way?"
+    try:
+        indices_section = response_text.split("Relevant Document Indices:")[1].strip()
+        relevant_indices = [
+            int(idx.strip()) for idx in indices_section.strip("[]").split(",") if idx.strip().isdigit()
+        ]
+        
+        # Handle case where no indices are found
+        if not relevant_indices:
+            no_relevant_msg = "While I found some documents, none seem directly relevant to your query. Could you please provide more specific details about what you're looking for?"
             if lang_tag.lower() == "arabic":
-                return translate_to_arabic(error_msg), []
-            return error_msg, []
-
-        # Step 8: Sort the verified documents by score in descending order
-        gemini_verified_sorted = sorted(gemini_verified, key=lambda x: x[1], reverse=True)
-        logger.info("Sorted verified documents by score in descending order.")
-        if lang_tag.lower() == "arabic" :
-            logger.info("Converting documents to Arabic...")
-            arabic_verified = []
-            for doc, score in gemini_verified_sorted:
-                arabic_content = documents_mapping.get(doc)
-                if arabic_content:
-                    logger.info(f"Found Arabic mapping for document")
-                    arabic_verified.append((arabic_content, score))
-                else:
-                    logger.warning(f"Arabic mapping not found for document")
-                    arabic_verified.append((doc, score))  # Fallback to English if no Arabic version
-        # Step 9: Clean the verified documents (remove unwanted prefixes)
-        cleaned_verified_docs = [
-            doc.replace('## English Translation:', '').strip()
-            for doc, _ in gemini_verified_sorted
+                return None, await atranslate_to_arabic(no_relevant_msg)
+            return None, no_relevant_msg
+            
+        logger.info(f"Relevant document indices identified: {relevant_indices}")
+        
+        # Filter and verify documents
+        gemini_verified = [
+            doc_score_pairs[idx - 1] for idx in relevant_indices
+            if 1 <= idx <= len(doc_score_pairs)
         ]
-        logger.info(cleaned_verified_docs)
-        # Step 10: Prepare context without showing scores
-        context = "\n\n".join([
-            f"Document {i+1}:\n{doc}" 
-            for i, doc in enumerate(cleaned_verified_docs)  
-        ])
-        logger.info("Prepared context with filtered and sorted documents.")
-        logger.info(context)
-
-        # Step 11: Prepare the prompt for Google Gemini to generate the final answer
-        gemini_final_input = f"""As a legal assistant with expertise in Tunisian law, answer the following question based solely on the provided documents. Be concise and provide accurate information. Interpret those documents and be analytical and go into details.
+        
+        # Handle case where no documents pass verification
+        if not gemini_verified:
+            no_verified_msg = "I found some potential matches, but couldn't verify their relevance to your query. Could you please rephrase your question?"
+            if lang_tag.lower() == "arabic":
+                return None, await atranslate_to_arabic(no_verified_msg)
+            return None, no_verified_msg
+            
+    except (IndexError, ValueError) as e:
+        logger.error(f"Error processing Gemini response: {e}")
+        error_msg = "I encountered an issue processing your query. Could you please try asking in a different way?"
+        if lang_tag.lower() == "arabic":
+            return None, await atranslate_to_arabic(error_msg)
+        return None, error_msg
+
+    # Step 8: Sort the verified documents by score in descending order
+    gemini_verified_sorted = sorted(gemini_verified, key=lambda x: x[1], reverse=True)
+    logger.info("Sorted verified documents by score in descending order.")
+    return gemini_verified_sorted, None
+
+def answer_prompt(conversation_history, doc_score_pairs, queryfinal, language=None):
+    """
+    Build the final answer prompt from the verified documents. With language="ARABIC"
+    the model is asked to answer in Arabic directly, instead of translating afterwards.
+    """
+    # Step 9: Clean the verified documents (remove unwanted prefixes)
+    cleaned_verified_docs = [
+        doc.replace('## English Translation:', '').strip()
+        for doc, _ in doc_score_pairs
+    ]
+    logger.info(cleaned_verified_docs)
+    # Step 10: Prepare context without showing scores
+    context = "\n\n".join([
+        f"Document {i+1}:\n{doc}" 
+        for i, doc in enumerate(cleaned_verified_docs)  
+    ])
+    logger.info("Prepared context with filtered and sorted documents.")
+    logger.info(context)
+
+    # Step 11: Prepare the prompt for Google Gemini to generate the final answer
+    answer_language = ""
+    if language and language.lower() == "arabic":
+        answer_language = " Write the answer in Modern Standard Arabic."
+    return f"""As a legal assistant with expertise in Tunisian law, answer the following question based solely on the provided documents. Be concise and provide accurate information. Interpret those documents and be analytical and go into details.{answer_language}
 conversation history :
 {conversation_history}
 
@@ -630,87 +1427,734 @@ Question:
 {queryfinal}
 
 Answer:"""
-        logger.info("Sending final context and query to Gemini for answer generation.")
-
-        # Step 12: Use Google Gemini to generate the final answer
-        final_response = model.generate_content(gemini_final_input)
-        answer = final_response.text.strip() if final_response.text else "Gemini did not return a response. Please try again."
-        logger.info("Final answer generated by Gemini.")
-        # Step 13: Return the answer and the sorted, verified doc_score_pairs
-        logger.info("original answer is : " ,answer )
-        if lang_tag.lower() == "arabic":
-            answer = translate_to_arabic(answer)
-            return answer, arabic_verified
-        return answer, gemini_verified_sorted
 
+async def agenerate_answer(query, queryfinal, lang_tag, conversation_history, doc_score_pairs, gen,
+                           top_k=5, cache_embedding=None, search_params=None):
+    """
+    Verify the retrieved documents with Gemini, generate the final answer and cache it.
+
+    Returns:
+    tuple: (answer, verified (text, score) pairs).
+    """
+    verified, message = await averify_documents(query, lang_tag, doc_score_pairs, gen)
+    if message is not None:
+        return message, []
+
+    # Texts are only decoded for the verified documents
+    gemini_verified_sorted = resolve_documents(verified, gen)
+    arabic_verified = None
+    if lang_tag.lower() == "arabic" :
+        logger.info("Converting documents to Arabic...")
+        arabic_verified = resolve_documents(verified, gen, arabic=True)
+    gemini_final_input = answer_prompt(conversation_history, gemini_verified_sorted, queryfinal)
+    logger.info("Sending final context and query to Gemini for answer generation.")
+
+    # Step 12: Use Google Gemini to generate the final answer
+    final_text = await resources.llm.agenerate(gemini_final_input)
+    answer = final_text.strip() if final_text else "Gemini did not return a response. Please try again."
+    logger.info("Final answer generated by Gemini.")
+    # Step 13: Return the answer and the sorted, verified doc_score_pairs
+    logger.info(f"original answer is : {answer}")
+    if lang_tag.lower() == "arabic":
+        answer = await atranslate_to_arabic(answer)
+        answer_cache.set(
+            query, lang_tag, top_k, (answer, arabic_verified),
+            embedding=cache_embedding, version=gen.version, search_params=search_params,
+        )
+        return answer, arabic_verified
+    answer_cache.set(
+        query, lang_tag, top_k, (answer, gemini_verified_sorted),
+        embedding=cache_embedding, version=gen.version, search_params=search_params,
+    )
+    return answer, gemini_verified_sorted
+
+def speculative_retriever(top_k, gen, search_params=None):
+    """The speculate callback of aunderstand_query, or None when SPECULATIVE_RETRIEVAL is off."""
+    if not SPECULATIVE_RETRIEVAL:
+        return None
+    return lambda english_query: run_cpu(overfetch_candidates, english_query, top_k, gen, search_params)
+
+async def aretrieve_for_query(graph, understood, top_k, gen, search_params=None):
+    """
+    Schedule the stages that follow query understanding and wait for the documents.
+
+    The speculative retrieval is kept when the enhanced query is the speculated query
+    and cancelled otherwise. When routing still needs an LLM call, unrouted candidates are
+    over-fetched concurrently and filtered by the routed codes afterwards. The answer
+    cache is checked while retrieval runs; on a hit the remaining stages are cancelled.
+
+    Returns:
+    tuple: (cache embedding, cached (answer, doc_score_pairs) or None, doc_score_pairs).
+    """
+    query = understood["query"]
+    relevant_codes = understood["relevant_codes"]
+    if relevant_codes is not None:
+        relevant_codes = known_codes(relevant_codes, gen)
+    speculated_query = understood.get("speculated_query")
+    speculated = (
+        "speculative_retrieval" in graph and speculated_query is not None
+        and normalize_query(query) == normalize_query(speculated_query)
+    )
+    if not speculated:
+        graph.cancel("speculative_retrieval")
+
+    async def route(cache_embedding):
+        if relevant_codes is not None:
+            return relevant_codes
+        return await aroute_query(query, cache_embedding[0], gen)
+
+    graph.add("cache_embedding", lambda _: embedding_batcher.asubmit([query]), deps=("understand",))
+    # The local router scores the same embedding as the cache lookup
+    graph.add("routing", route, deps=("cache_embedding",))
+    if speculated:
+        candidates = "speculative_retrieval"
+    elif relevant_codes is None:
+        candidates = "candidates"
+        graph.add(candidates, lambda _: run_cpu(overfetch_candidates, query, top_k, gen, search_params), deps=("understand",))
+    else:
+        candidates = None
+        graph.add(
+            "retrieval", lambda codes: aretrieve_documents(query, top_k, codes, gen, search_params), deps=("routing",)
+        )
+    if candidates is not None:
+        graph.add(
+            "retrieval", lambda found, codes: arerank_candidates(query, found, top_k, codes, gen),
+            deps=(candidates, "routing"),
+        )
+
+    # Serve repeated questions from the answer cache
+    cache_embedding = (await graph.result("cache_embedding"))[0]
+    cached = answer_cache.get(
+        query, understood["language"], top_k, embedding=cache_embedding, search_params=search_params
+    )
+    if cached is not None:
+        logger.info("Answer cache hit.")
+        graph.cancel("speculative_retrieval", "candidates", "routing", "retrieval")
+        return cache_embedding, cached, None
+
+    # Step 1: Retrieve and re-rank documents
+    logger.info("Retrieving documents...")
+    doc_score_pairs = await graph.result("retrieval")
+    logger.info(f"Retrieved {len(doc_score_pairs)} documents.")
+    return cache_embedding, None, doc_score_pairs
+
+def finish_pipeline(graph):
+    """Record the stage timings of a request and stop its leftover stages."""
+    report = graph.report()
+    graph.close()
+    pipeline_metrics.record(report)
+    logger.info(f"Pipeline took {report['total_ms']:.0f} ms, critical path: {' -> '.join(report['critical_path'])}")
+    return report
+
+async def arag_system(query, top_k=5, memory: List[Message] = None, search_params=None):
+    """
+    Retrieval-Augmented Generation system with Gemini filtering.
+    The stages form a dependency graph: independent LLM calls run concurrently,
+    retrieval can start speculatively while the query is enhanced, and CPU-bound
+    stages run on the bounded executor.
+    search_params optionally overrides the search settings (nprobe, ef_search, fusion,
+    bm25_weight, candidate_pool).
+    """
+    graph = StageGraph()
+    try:
+        logger.info(f"Starting RAG system for query: {query}")
+        # Pin the index generation so a concurrent refresh cannot mix two versions
+        gen = generation
+        # Format conversation history
+        conversation_history = format_conversation(memory)
+        if conversation_history:
+            logger.info("Added conversation history to context")
+        logger.info(f"conversation history : {conversation_history}")
+        # Classification, translation, enhancement and routing in one call
+        understood = await aunderstand_query(
+            query, conversation_history, graph, speculate=speculative_retriever(top_k, gen, search_params)
+        )
+        if understood["casual_response"] is not None:
+            return understood["casual_response"], []
+
+        cache_embedding, cached, doc_score_pairs = await aretrieve_for_query(graph, understood, top_k, gen, search_params)
+        if cached is not None:
+            return cached
+
+        if not doc_score_pairs:
+            logger.warning("No relevant documents found for the given query.")
+            return "No relevant documents found for the given query.", ""
+
+        return await graph.add(
+            "answer",
+            lambda docs: agenerate_answer(
+                understood["query"], understood["english_query"], understood["language"], conversation_history,
+                docs, gen, top_k=top_k, cache_embedding=cache_embedding, search_params=search_params,
+            ),
+            deps=("retrieval",),
+        )
 
     except Exception as e:
         logger.error(f"An error occurred in rag_system: {e}", exc_info=True)
         return "An error occurred while processing your request.", ""
+    finally:
+        finish_pipeline(graph)
+
+async def arag_stream(query, top_k=5, memory: List[Message] = None, search_params=None):
+    """
+    Streaming variant of arag_system. The verified documents are emitted first, then
+    the answer as the LLM produces it. Arabic answers are generated in Arabic directly,
+    without a translation pass.
+
+    Yields:
+    tuple: (event, payload) with events "documents" (doc_score_pairs), "token" (text),
+    "done" (the complete answer) and "error" (a message).
+    """
+    def complete(answer, doc_score_pairs):
+        return [("documents", doc_score_pairs), ("token", answer), ("done", answer)]
+
+    graph = StageGraph()
+    try:
+        logger.info(f"Starting streaming RAG system for query: {query}")
+        # Pin the index generation so a concurrent refresh cannot mix two versions
+        gen = generation
+        conversation_history = format_conversation(memory)
+        understood = await aunderstand_query(
+            query, conversation_history, graph, speculate=speculative_retriever(top_k, gen, search_params)
+        )
+        if understood["casual_response"] is not None:
+            for event in complete(understood["casual_response"], []):
+                yield event
+            return
+        lang_tag = understood["language"]
+        queryfinal = understood["english_query"]
+
+        cache_embedding, cached, doc_score_pairs = await aretrieve_for_query(graph, understood, top_k, gen, search_params)
+        query = understood["query"]
+        if cached is not None:
+            for event in complete(*cached):
+                yield event
+            return
+
+        if not doc_score_pairs:
+            logger.warning("No relevant documents found for the given query.")
+            for event in complete("No relevant documents found for the given query.", []):
+                yield event
+            return
+
+        verified_ids, message = await averify_documents(query, lang_tag, doc_score_pairs, gen)
+        if message is not None:
+            for event in complete(message, []):
+                yield event
+            return
+
+        verified = resolve_documents(verified_ids, gen)
+        documents = verified
+        if lang_tag.lower() == "arabic":
+            documents = resolve_documents(verified_ids, gen, arabic=True)
+        yield "documents", documents
+
+        parts = []
+        async for text in resources.llm.astream(answer_prompt(conversation_history, verified, queryfinal, language=lang_tag)):
+            parts.append(text)
+            yield "token", text
+        answer = "".join(parts).strip()
+        if not answer:
+            answer = "Gemini did not return a response. Please try again."
+            yield "token", answer
+        logger.info("Final answer streamed.")
+        answer_cache.set(
+            query, lang_tag, top_k, (answer, documents),
+            embedding=cache_embedding, version=gen.version, search_params=search_params,
+        )
+        yield "done", answer
+
+    except Exception as e:
+        logger.error(f"An error occurred in rag_stream: {e}", exc_info=True)
+        yield "error", "An error occurred while processing your request."
+    finally:
+        finish_pipeline(graph)
+
+def rag_system(query, top_k=5, memory: List[Message] = None, search_params=None):
+    """
+    Synchronous entry point to arag_system, for scripts and tools without an event loop.
+    """
+    return asyncio.run(arag_system(query, top_k=top_k, memory=memory, search_params=search_params))
+
+
+async def arag_batch(requests):
+    """
+    Answer a batch of QueryRequests, yielding each result as soon as it is ready.
 
+    Requests are processed in chunks of QUERY_BATCH_SIZE. Within a chunk the query
+    understanding calls run concurrently, then the cache embeddings, retrieval and
+    reranking are batched on the CPU executor, and answers are generated concurrently
+    while the next chunk is retrieved. At most BATCH_LLM_CONCURRENCY queries wait on
+    the LLM at any time. Every request has its own stage graph, in which the batched
+    stages it shares with the other requests of its chunk are recorded too.
+
+    Parameters:
+    requests (list): The QueryRequests.
+
+    Yields:
+    tuple: (position of the request, (answer, doc_score_pairs) or None, error message
+    or None), once per request, in completion order.
+    """
+    llm_slots = asyncio.Semaphore(BATCH_LLM_CONCURRENCY)
+    results = asyncio.Queue()
+    reported = set()
+    graphs = [StageGraph() for _ in requests]
+    # Pin the index generation so a concurrent refresh cannot mix two versions
+    gen = generation
+
+    async def report(position, result=None, error=None):
+        if position not in reported:
+            reported.add(position)
+            await results.put((position, result, error))
+
+    async def understand(position, request):
+        conversation_history = format_conversation(request.memory)
+        async with llm_slots:
+            understood = await aunderstand_query(request.query, conversation_history, graphs[position])
+        understood["conversation_history"] = conversation_history
+        return position, understood
+
+    def share(positions, name, task, deps):
+        """Record a batched stage in the graph of every request it serves."""
+        for position in positions:
+            # Shielded: closing one request's graph must not cancel the other requests' work
+            graphs[position].add(name, lambda *_: asyncio.shield(task), deps=deps(position))
+        return task
+
+    async def route(understood):
+        async with llm_slots:
+            understood["relevant_codes"] = known_codes(await adocument_routing(understood["query"]), gen)
+
+    async def answer(position, understood, doc_score_pairs, cache_embedding):
+        try:
+            async with llm_slots:
+                result = await agenerate_answer(
+                    understood["query"], understood["english_query"], understood["language"],
+                    understood["conversation_history"], doc_score_pairs, gen,
+                    top_k=requests[position].top_k, cache_embedding=cache_embedding,
+                    search_params=requests[position].search_params(),
+                )
+            await report(position, result)
+        except Exception as e:
+            logger.error(f"Answer generation failed for batch query {position}: {e}", exc_info=True)
+            await report(position, error=str(e))
+
+    async def process(start, chunk):
+        legal = []
+        for pending in asyncio.as_completed([understand(start + i, request) for i, request in enumerate(chunk)]):
+            position, understood = await pending
+            if understood["casual_response"] is not None:
+                await report(position, (understood["casual_response"], []))
+            else:
+                legal.append((position, understood))
+        if not legal:
+            return []
+
+        # Serve repeated questions from the answer cache
+        cache_embeddings = await share(
+            [position for position, _ in legal], "cache_embedding",
+            asyncio.ensure_future(run_cpu(encode_queries, [understood["query"] for _, understood in legal])),
+            lambda position: ("understand",),
+        )
+        misses = []
+        for (position, understood), cache_embedding in zip(legal, cache_embeddings):
+            cached = answer_cache.get(
+                understood["query"], understood["language"], requests[position].top_k, embedding=cache_embedding,
+                search_params=requests[position].search_params(),
+            )
+            if cached is not None:
+                await report(position, cached)
+            else:
+                misses.append((position, understood, cache_embedding))
+        if not misses:
+            return []
+
+        # Route the queries the pre-flight call did not route, locally when confident
+        unrouted = [(position, understood, cache_embedding) for position, understood, cache_embedding in misses
+                    if understood["relevant_codes"] is None]
+        if unrouted:
+            if ROUTER_MODE == 'local':
+                local_codes = local_routing_batch(np.stack([embedding for _, _, embedding in unrouted]), gen)
+            else:
+                local_codes = [None] * len(unrouted)
+            for (_, understood, _), codes in zip(unrouted, local_codes):
+                understood["relevant_codes"] = codes
+            await asyncio.gather(*[
+                graphs[position].add("routing", lambda _, understood=understood: route(understood), deps=("cache_embedding",))
+                for position, understood, _ in unrouted if understood["relevant_codes"] is None
+            ])
+
+        doc_score_pairs_list = await share(
+            [position for position, _, _ in misses], "retrieval",
+            asyncio.ensure_future(run_cpu(
+                retrieve_documents_batch,
+                [understood["query"] for _, understood, _ in misses],
+                [requests[position].top_k for position, _, _ in misses],
+                [understood["relevant_codes"] for _, understood, _ in misses],
+                gen,
+                [requests[position].search_params() for position, _, _ in misses],
+            )),
+            lambda position: ("routing",) if "routing" in graphs[position] else ("cache_embedding",),
+        )
+        tasks = []
+        for (position, understood, cache_embedding), doc_score_pairs in zip(misses, doc_score_pairs_list):
+            if not doc_score_pairs:
+                await report(position, ("No relevant documents found for the given query.", []))
+            else:
+                tasks.append(graphs[position].add(
+                    "answer",
+                    lambda _, position=position, understood=understood, doc_score_pairs=doc_score_pairs,
+                    cache_embedding=cache_embedding: answer(position, understood, doc_score_pairs, cache_embedding),
+                    deps=("retrieval",),
+                ))
+        return tasks
+
+    async def produce():
+        tasks = []
+        for start in range(0, len(requests), QUERY_BATCH_SIZE):
+            try:
+                tasks.extend(await process(start, requests[start:start + QUERY_BATCH_SIZE]))
+            except Exception as e:
+                logger.error(f"Batch chunk starting at {start} failed: {e}", exc_info=True)
+                for position in range(start, min(start + QUERY_BATCH_SIZE, len(requests))):
+                    await report(position, error=str(e))
+        if tasks:
+            await asyncio.gather(*tasks)
+
+    producer = asyncio.create_task(produce())
+    try:
+        for _ in range(len(requests)):
+            yield await results.get()
+        # Let the answer stages finish so their timings are recorded
+        await producer
+    finally:
+        producer.cancel()
+        for graph in graphs:
+            finish_pipeline(graph)
+
+def latest_update():
+    """
+    Return the most recent updated_at of the articles collection (or None) and the ids
+    of the articles stamped with it. Writes carrying the same stamp can still be in
+    flight (mangodb_fill.py stamps a whole batch at once), so refreshes query
+    updated_at >= this watermark and skip only the ids already applied.
+    """
+    doc = resources.collection.find_one({"updated_at": {"$exists": True}}, {"updated_at": 1}, sort=[("updated_at", -1)])
+    if doc is None:
+        return None, frozenset()
+    ids = resources.collection.find({"updated_at": doc["updated_at"]}, {"_id": 1})
+    return doc["updated_at"], frozenset(str(row["_id"]) for row in ids)
+
+def article_row(doc):
+    """
+    Map an articles document to a generation row (the metadata columns plus "embedding"
+    and "passages"), or None when it lacks English content, an embedding or a code name.
+    Articles that were not chunked at ingestion form a single passage.
+    """
+    content_en = doc.get("content_english", "")
+    embedding = doc.get("embedding_english")
+    code_name = doc.get("code_name", "")
+    if not (content_en and embedding is not None and len(embedding) and code_name):
+        return None
+    embedding = decode_embedding(embedding)
+    passages = [
+        (passage["content_english"], decode_embedding(passage["embedding_english"]))
+        for passage in doc.get("passages") or []
+    ]
+    return {
+        "doc_id": str(doc["_id"]),
+        "code_name": code_name,
+        "article_name": doc.get("article_name", ""),
+        "content_english": content_en,
+        "content_arabic": doc.get("content_arabic", ""),
+        "embedding": embedding,
+        "passages": passages or [(content_en, embedding)],
+    }
+
+def tokenize_document(text):
+    """Tokenize a document for BM25."""
+    return resources.word_tokenize(text.lower())
+
+def build_dense_index_from_config(doc_embeddings):
+    """Build the dense index selected by the DENSE_* settings."""
+    return build_dense_index(
+        doc_embeddings, DENSE_INDEX_TYPE,
+        nlist=DENSE_IVF_NLIST, pq_m=DENSE_PQ_M, hnsw_m=DENSE_HNSW_M,
+    )
 
 def initialize_rag_system():
     """
     Initialize the RAG system with English-Arabic content mapping
     """
-    global documents, embeddings, index, bm25, tokenized_corpus, document_code_mapping, documents_mapping
+    global generation
 
     try:
+        # Read before the fingerprint so that later edits are always picked up by a refresh
+        updated_at, watermark_ids = latest_update()
+
+        # Reuse the persisted snapshot when the collection has not changed
+        fingerprint = collection_fingerprint(resources.collection)
+        snapshot = load_snapshot(fingerprint, DENSE_INDEX_KEY)
+
+        # Cached answers are only valid for the snapshot they were computed on
+        if answer_cache.version is None:
+            answer_cache.load()
+        answer_cache.set_version(fingerprint)
+
+        if snapshot is not None:
+            logger.info(f"Loading retrieval snapshot {fingerprint}...")
+            if snapshot["lexicon"] is None:
+                logger.warning("Snapshot has no synonym lexicon, query expansion falls back to WordNet.")
+            index = snapshot["index"]
+            if index is None:
+                # First start with this index configuration: train it once from the snapshot
+                index = build_dense_index_from_config(snapshot["embeddings"])
+                save_index(fingerprint, index, DENSE_INDEX_KEY)
+            store = DocumentStore(snapshot["metadata"])
+            passages = None
+            if snapshot["passages"] is not None:
+                stored = snapshot["passages"]
+                passage_index = stored["index"]
+                if passage_index is None:
+                    passage_index = build_dense_index_from_config(stored["embeddings"])
+                    save_index(fingerprint, passage_index, DENSE_INDEX_KEY, passages=True)
+                passages = PassageIndex(
+                    stored["texts"], stored["parent"], stored["embeddings"], passage_index,
+                    np.asarray(list(store["code_name"]), dtype=str),
+                )
+            generation = IndexGeneration(
+                fingerprint, store, snapshot["embeddings"], index, snapshot["bm25"],
+                lexicon=snapshot["lexicon"],
+                bm25_search=select_bm25_backend(snapshot["bm25"]),
+                updated_at=updated_at,
+                passages=passages,
+                watermark_ids=watermark_ids,
+                search_passages=PASSAGE_RETRIEVAL,
+            )
+            logger.info(f"Loaded {len(generation)} documents from snapshot.")
+            return
+
         # Fetch all documents from MongoDB
-        all_docs_cursor = collection.find({})
+        all_docs_cursor = resources.collection.find({})
 
         # Extract documents, embeddings, and mappings
-        documents = []
         embeddings_list = []
-        document_code_mapping = []
-        documents_mapping = {}  # Clear existing mapping
+        article_passages = []
+        metadata = {name: [] for name in METADATA_COLUMNS}
 
         logger.info("Fetching all documents and embeddings from MongoDB...")
         for doc in tqdm(all_docs_cursor, desc="Fetching"):
-            content_en = doc.get("content_english", "")
-            content_ar = doc.get("content_arabic", "")
-            embedding = doc.get("embedding_english", [])
-            code_name = doc.get("code_name", "")
-
-            if content_en and embedding and code_name:
-                # Store main English content and mappings
-                documents.append(content_en)
-                embeddings_list.append(embedding)
-                document_code_mapping.append(code_name)
-                
-                # Store mapping between English and Arabic content
-                if content_ar:
-                    documents_mapping[content_en] = content_ar
-
-        logger.info(f"Fetched {len(documents)} documents and built {len(documents_mapping)} language mappings.")
+            row = article_row(doc)
+            if row is not None:
+                embeddings_list.append(row["embedding"])
+                article_passages.append(row["passages"])
+                for name in METADATA_COLUMNS:
+                    metadata[name].append(row[name])
+
+        documents = metadata["content_english"]
+        logger.info(f"Fetched {len(documents)} documents.")
 
         # Rest of initialization remains the same...
         if not documents:
             logger.warning("No documents found in MongoDB.")
             return
 
-        embeddings = np.array(embeddings_list).astype('float32')
-        
-        embedding_size = embeddings.shape[1]
-        index = faiss.IndexFlatIP(embedding_size)
-        index.add(embeddings)
+        embeddings = np.stack(embeddings_list)
         
+        index = build_dense_index_from_config(embeddings)
+        passages = PassageIndex.from_articles(
+            article_passages, np.asarray(metadata["code_name"], dtype=str), build_dense_index_from_config
+        )
+        logger.info(f"Indexed {len(passages)} passages.")
+
         logger.info("Tokenizing documents for BM25...")
-        tokenized_corpus = [word_tokenize(doc.lower()) for doc in tqdm(documents, desc="Tokenizing")]
-        bm25 = BM25Okapi(tokenized_corpus)
+        tokenized_corpus = [tokenize_document(doc) for doc in tqdm(documents, desc="Tokenizing")]
+        # The text columns are packed once; the pipeline then reads them by document id
+        metadata = DocumentStore(metadata)
+        bm25 = SparseBM25.from_corpus(tokenized_corpus)
         logger.info("BM25 index built.")
 
+        lexicon = SynonymLexicon.build(
+            bm25.vocab, bm25.idf, resources.synsets,
+            max_synonyms=SYNONYMS_PER_TERM, min_idf=SYNONYM_MIN_IDF,
+        )
+
+        save_snapshot(fingerprint, metadata, embeddings, index, bm25, lexicon, DENSE_INDEX_KEY, passages)
+        generation = IndexGeneration(
+            fingerprint, metadata, embeddings, index, bm25,
+            lexicon=lexicon,
+            bm25_search=select_bm25_backend(bm25),
+            updated_at=updated_at,
+            passages=passages,
+            watermark_ids=watermark_ids,
+            search_passages=PASSAGE_RETRIEVAL,
+        )
+        logger.info(f"Indexed the documents of {len(generation.code_indices)} legal codes for routing.")
+
     except Exception as e:
         logger.error(f"Failed to initialize RAG system: {e}")
         raise e
-def translate_to_arabic(text):
-    """Helper function to translate text to Arabic using Gemini"""
-    prompt = f"""Translate the following text to Arabic, maintaining legal terminology and professional tone:
+
+def startup_rag_system():
+    """
+    Prepare everything the first request needs: the STARTUP_RESOURCES, loaded in
+    parallel, and the index generation, initialized at the same time since it only
+    needs MongoDB and the NLTK data.
+
+    Returns:
+    dict: Startup timing breakdown in ms (total, index, and per resource).
+    """
+    started = time.perf_counter()
+
+    def timed_initialize():
+        index_started = time.perf_counter()
+        initialize_rag_system()
+        return 1000.0 * (time.perf_counter() - index_started)
+
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="rag-startup") as pool:
+        index = pool.submit(timed_initialize)
+        timings = resources.load(STARTUP_RESOURCES)
+        index_ms = index.result()
+
+    _startup_timings.update({
+        "total_ms": 1000.0 * (time.perf_counter() - started),
+        "index_ms": index_ms,
+        "resources": {name: timings[name]["ms"] for name in STARTUP_RESOURCES},
+    })
+    breakdown = ", ".join(f"{name} {ms:.0f} ms" for name, ms in _startup_timings["resources"].items())
+    logger.info(f"Startup took {_startup_timings['total_ms']:.0f} ms: index {index_ms:.0f} ms, {breakdown}.")
+    return dict(_startup_timings)
+
+def startup_metrics():
+    """Startup timing breakdown and the load state of every shared resource."""
+    return {**_startup_timings, "loaded": resources.timings()}
+
+def refresh_index():
+    """
+    Apply the articles added, edited or removed in MongoDB since the current generation.
+    Edits are found through updated_at, additions and removals by comparing ids. The
+    next generation is built incrementally, saved as a snapshot and swapped in at once.
+
+    Returns:
+    dict: Summary of the refresh (generation number, documents added and removed, duration).
+    """
+    global generation
+
+    with _refresh_lock:
+        started = time.perf_counter()
+        _refresh_state["last_run"] = time.time()
+        try:
+            current = generation
+            if current is None:
+                initialize_rag_system()
+                result = {"mode": "full", "generation": generation.number if generation else None}
+            else:
+                # Read before the watermark and the changes, so the fingerprint never covers
+                # a write that next_generation misses (a later refresh still applies it)
+                fingerprint = collection_fingerprint(resources.collection)
+                updated_at, watermark_ids = latest_update()
+                mongo_ids = {str(doc["_id"]): doc["_id"] for doc in resources.collection.find({}, {"_id": 1})}
+                removed = [doc_id for doc_id in current.doc_positions if doc_id not in mongo_ids]
+                new_ids = [raw_id for doc_id, raw_id in mongo_ids.items() if doc_id not in current.doc_positions]
+
+                since = {"$gte": current.updated_at} if current.updated_at is not None else {"$exists": True}
+                changes = [{"_id": {"$in": new_ids}}, {"updated_at": since}]
+                # Articles at the previous watermark that this generation already reflects match $gte again
+                changed = [
+                    doc for doc in resources.collection.find({"$or": changes})
+                    if not (doc.get("updated_at") == current.updated_at and str(doc["_id"]) in current.watermark_ids)
+                ]
+                rows = [row for row in map(article_row, changed) if row is not None]
+
+                if not removed and not changed:
+                    result = {"mode": "incremental", "generation": current.number, "changed": False}
+                else:
+                    next_generation = current.apply_changes(
+                        removed + [str(doc["_id"]) for doc in changed], rows, tokenize_document,
+                        version=fingerprint,
+                        updated_at=updated_at,
+                        bm25_backend=select_bm25_backend,
+                        watermark_ids=watermark_ids,
+                    )
+                    save_snapshot(
+                        fingerprint, next_generation.store, next_generation.embeddings,
+                        next_generation.index, next_generation.bm25, next_generation.lexicon, DENSE_INDEX_KEY,
+                        next_generation.passages,
+                    )
+                    generation = next_generation
+                    answer_cache.set_version(fingerprint)
+                    result = {
+                        "mode": "incremental",
+                        "generation": next_generation.number,
+                        "changed": True,
+                        "removed": len(removed),
+                        "upserted": len(rows),
+                        "documents": len(next_generation),
+                    }
+            result["duration_ms"] = 1000.0 * (time.perf_counter() - started)
+            _refresh_state["last_result"] = result
+            _refresh_state["last_error"] = None
+            return result
+        except Exception as e:
+            _refresh_state["last_error"] = str(e)
+            logger.error(f"Index refresh failed: {e}")
+            raise
+
+def start_index_refresher(interval=INDEX_REFRESH_INTERVAL):
+    """Start the background thread polling MongoDB every interval seconds (disabled when <= 0)."""
+    global _refresher
+    if interval <= 0 or (_refresher is not None and _refresher.is_alive()):
+        return
+
+    def poll():
+        delay = interval
+        failures = 0
+        while True:
+            time.sleep(delay)
+            try:
+                refresh_index()
+                failures = 0
+                delay = interval
+            except Exception:
+                # Back off exponentially while MongoDB (or the snapshot disk) keeps failing
+                failures += 1
+                delay = min(interval * 2 ** failures, max(interval, INDEX_REFRESH_MAX_BACKOFF))
+                logger.exception(f"Index refresh failed {failures} time(s) in a row, retrying in {delay:.0f}s.")
+            _refresh_state["consecutive_failures"] = failures
+
+    _refresher = threading.Thread(target=poll, name="index-refresher", daemon=True)
+    _refresher.start()
+    logger.info(f"Index refresher polling every {interval:.0f}s.")
+
+def refresh_status():
+    """Current index generation and outcome of the last refresh."""
+    current = generation
+    return {
+        "generation": current.number if current else None,
+        "version": current.version if current else None,
+        "documents": len(current) if current else 0,
+        "dense_index": DENSE_INDEX_KEY,
+        "updated_at": current.updated_at.isoformat() if current and current.updated_at else None,
+        "loaded_at": current.created_at if current else None,
+        "refreshing": _refresh_lock.locked(),
+        "interval": INDEX_REFRESH_INTERVAL,
+        **_refresh_state,
+    }
+
+def _translate_to_arabic_prompt(text):
+    """Build the prompt used by translate_to_arabic."""
+    return f"""Translate the following text to Arabic, maintaining legal terminology and professional tone:
 
 {text}
 
 Provide only the Arabic translation, nothing else."""
-    
-    model = genai.GenerativeModel(model_name="gemini-1.5-flash")
-    response = model.generate_content(prompt)
-    return response.text.strip()
+
+@memo.memoize("translate_to_arabic", ttl=TRANSLATION_MEMO_TTL)
+def translate_to_arabic(text):
+    """Helper function to translate text to Arabic using Gemini"""
+    return resources.llm.generate(_translate_to_arabic_prompt(text)).strip()
+
+@memo.memoize("translate_to_arabic", ttl=TRANSLATION_MEMO_TTL)
+async def atranslate_to_arabic(text):
+    """Async variant of translate_to_arabic."""
+    return (await resources.llm.agenerate(_translate_to_arabic_prompt(text))).strip()
@@ -0,0 +1,103 @@
+# app/rerank.py
+
+import threading
+import numpy as np
+from app.cache import TTLCache, normalize_query
+
+
+class RerankCascade:
+    """
+    Reranking cascade in front of the cross-encoder.
+
+    A cheap first stage scores every candidate. Candidates scoring more than
+    prune_margin below the best are pruned (keeping at least min_candidates), and when
+    the best candidate leads the second by exit_margin or more the first-stage scores
+    are final and the cross-encoder is skipped. Cross-encoder scores are cached per
+    (ids version, normalized query, document id), so repeated and follow-up queries
+    only score the documents they have not seen. Document ids are positions, so the
+    ids version must change whenever they are renumbered (IndexGeneration.ids_version).
+    """
+
+    def __init__(self, prune_margin=0.15, min_candidates=3, exit_margin=0.2, cache_size=65536, cache_ttl=3600):
+        """
+        Parameters:
+        prune_margin (float): Prune candidates this far below the best first-stage score.
+        min_candidates (int): Minimum number of candidates kept after pruning.
+        exit_margin (float): Top-1 over top-2 first-stage margin that skips the cross-encoder.
+        cache_size (int): Maximum number of cached cross-encoder scores.
+        cache_ttl (float): Time-to-live of the cached scores, in seconds.
+        """
+        self.prune_margin = prune_margin
+        self.min_candidates = min_candidates
+        self.exit_margin = exit_margin
+        self.cache = TTLCache(cache_size, cache_ttl)
+        self._lock = threading.Lock()
+        self._queries = 0
+        self._candidates = 0
+        self._pruned = 0
+        self._early_exits = 0
+        self._scored = 0
+
+    def plan(self, query, version, ids, first_scores=None):
+        """
+        Prune the candidates of a query and collect the scores already known.
+
+        Parameters:
+        query (str): The query the candidates are reranked for.
+        version (hashable): Version of the ids (IndexGeneration.ids_version).
+        ids (list): Candidate document ids.
+        first_scores (np.ndarray): First-stage scores aligned with ids, or None to send
+        every candidate to the cross-encoder.
+
+        Returns:
+        tuple: (kept ids best first, dict of id -> score, ids still to score with the
+        cross-encoder). The dict holds first-stage scores after an early exit and
+        cached cross-encoder scores otherwise.
+        """
+        kept = list(ids)
+        decisive = False
+        if first_scores is not None and kept:
+            first_scores = np.asarray(first_scores, dtype=np.float64)
+            order = np.argsort(-first_scores, kind="stable")
+            sorted_scores = first_scores[order]
+            keep = max(self.min_candidates, int(np.sum(sorted_scores >= sorted_scores[0] - self.prune_margin)))
+            kept = [kept[i] for i in order[:keep].tolist()]
+            decisive = len(sorted_scores) == 1 or sorted_scores[0] - sorted_scores[1] >= self.exit_margin
+
+        with self._lock:
+            self._queries += 1
+            self._candidates += len(ids)
+            self._pruned += len(ids) - len(kept)
+            self._early_exits += int(decisive)
+        if decisive:
+            first = dict(zip(ids, first_scores.tolist()))
+            return kept, {doc_id: first[doc_id] for doc_id in kept}, []
+
+        normalized = normalize_query(query)
+        scores = {}
+        for doc_id in kept:
+            score = self.cache.get((version, normalized, doc_id))
+            if score is not None:
+                scores[doc_id] = score
+        return kept, scores, [doc_id for doc_id in kept if doc_id not in scores]
+
+    def complete(self, query, version, scores, missing, missing_scores):
+        """Add the cross-encoder scores of the missing ids to scores and cache them."""
+        normalized = normalize_query(query)
+        for doc_id, score in zip(missing, missing_scores):
+            scores[doc_id] = float(score)
+            self.cache.set((version, normalized, doc_id), float(score))
+        with self._lock:
+            self._scored += len(missing)
+        return scores
+
+    def stats(self):
+        with self._lock:
+            return {
+                "queries": self._queries,
+                "candidates": self._candidates,
+                "pruned": self._pruned,
+                "early_exits": self._early_exits,
+                "cross_encoder_pairs": self._scored,
+                "cache": self.cache.stats(),
+            }
@@ -0,0 +1,115 @@
+# app/resources.py
+
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class LazyResource:
+    """A value created by its loader on first use, exactly once even when first used by several threads."""
+
+    def __init__(self, name, loader, depends=()):
+        """
+        Parameters:
+        name (str): Name used in logs and timings.
+        loader (callable): Creates the value; called without arguments.
+        depends (tuple): Names of the resources the loader uses, loaded before it is timed.
+        """
+        self.name = name
+        self.loader = loader
+        self.depends = tuple(depends)
+        self.loaded = False
+        self.duration = None  # seconds spent in the loader
+        self.error = None
+        self._value = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self.loaded:
+            return self._value
+        with self._lock:
+            if not self.loaded:
+                started = time.perf_counter()
+                try:
+                    value = self.loader()
+                except Exception as e:
+                    # Not cached: the next access retries (e.g. once the network is back)
+                    self.error = str(e)
+                    raise
+                self.duration = time.perf_counter() - started
+                self.error = None
+                self._value = value
+                self.loaded = True
+                logger.info(f"Loaded {self.name} in {1000.0 * self.duration:.0f} ms.")
+        return self._value
+
+
+class Resources:
+    """
+    Registry of the expensive shared resources: database and LLM clients, NLP data and
+    models. Registering a resource does no work; it is created on first access
+    (resources.name or resources.get(name)), or ahead of the first request by load(),
+    which loads independent resources in parallel.
+    """
+
+    def __init__(self):
+        self._resources = {}
+
+    def register(self, name, loader, depends=()):
+        """Register a resource; see LazyResource."""
+        self._resources[name] = LazyResource(name, loader, depends)
+
+    def get(self, name):
+        resource = self._resources[name]
+        if not resource.loaded:
+            for dependency in resource.depends:
+                self.get(dependency)
+        return resource.get()
+
+    def __getattr__(self, name):
+        resources = self.__dict__.get("_resources", {})
+        if name not in resources:
+            raise AttributeError(f"No resource named '{name}'.")
+        return self.get(name)
+
+    def is_loaded(self, name):
+        return self._resources[name].loaded
+
+    def load(self, names=None, max_workers=None):
+        """
+        Load resources in parallel (model loading mostly runs outside the GIL). A
+        resource shared by several loaders is still created once.
+
+        Parameters:
+        names (list): Resources to load (all registered ones when None).
+        max_workers (int): Loader threads (one per resource when None).
+
+        Returns:
+        dict: The timings of every registered resource, see timings().
+        """
+        names = list(self._resources if names is None else names)
+        if names:
+            with ThreadPoolExecutor(max_workers=max_workers or len(names), thread_name_prefix="rag-load") as pool:
+                futures = [pool.submit(self.get, name) for name in names]
+            errors = []
+            for name, future in zip(names, futures):
+                if future.exception() is not None:
+                    logger.error(f"Failed to load {name}: {future.exception()}")
+                    errors.append(future.exception())
+            if errors:
+                raise errors[0]
+        return self.timings()
+
+    def timings(self):
+        """Per resource: whether it is loaded, its load time in ms and the last load error."""
+        return {
+            name: {
+                "loaded": resource.loaded,
+                "ms": None if resource.duration is None else 1000.0 * resource.duration,
+                "error": resource.error,
+            }
+            for name, resource in self._resources.items()
+        }
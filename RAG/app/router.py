@@ -0,0 +1,87 @@
+# app/router.py
+
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class CodeRouter:
+    """
+    Local legal-code router: one centroid embedding per code, the normalized mean of
+    its article embeddings. A query is scored against every centroid and the cosine
+    similarities are turned into a probability distribution with a temperature
+    softmax, so routing costs one small matrix-vector product.
+    """
+
+    def __init__(self, codes, centroids):
+        """
+        Parameters:
+        codes (list): Code names, aligned with the centroid rows.
+        centroids (np.ndarray): Normalized float32 centroids, shape (n_codes, dim).
+        """
+        self.codes = list(codes)
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+
+    @classmethod
+    def from_code_indices(cls, embeddings, code_indices):
+        """
+        Build the router from the document embeddings and the per-code document ids.
+
+        Parameters:
+        embeddings (np.ndarray): Normalized document embeddings.
+        code_indices (dict): code_name -> (sub-index, document ids), as built by build_code_indices.
+
+        Returns:
+        CodeRouter: The router.
+        """
+        codes = sorted(code_indices)
+        centroids = np.zeros((len(codes), embeddings.shape[1]), dtype=np.float32)
+        for row, code in enumerate(codes):
+            centroids[row] = np.asarray(embeddings[code_indices[code][1]], dtype=np.float32).mean(axis=0)
+        norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+        centroids /= np.where(norms > 0, norms, 1.0)
+        return cls(codes, centroids)
+
+    def probabilities(self, query_embeddings, temperature=0.05):
+        """
+        Probability of each code for each query, shape (n_queries, n_codes). Lower
+        temperatures sharpen the distribution.
+        """
+        logits = np.atleast_2d(query_embeddings).astype(np.float32) @ self.centroids.T / temperature
+        logits -= logits.max(axis=1, keepdims=True)
+        weights = np.exp(logits)
+        return weights / weights.sum(axis=1, keepdims=True)
+
+    def route_batch(self, query_embeddings, max_codes=3, cumulative=0.8, temperature=0.05):
+        """
+        Route a batch of queries.
+
+        Parameters:
+        query_embeddings (np.ndarray): Normalized query embeddings, shape (n_queries, dim).
+        max_codes (int): Maximum number of codes returned per query.
+        cumulative (float): Stop adding codes once their probabilities sum to this mass.
+        temperature (float): Softmax temperature.
+
+        Returns:
+        list: Per query, (list of (code, probability) best first, confidence), where the
+        confidence is the probability mass covered by the returned codes.
+        """
+        if not self.codes:
+            return [([], 0.0) for _ in range(len(np.atleast_2d(query_embeddings)))]
+        probabilities = self.probabilities(query_embeddings, temperature)
+        order = np.argsort(-probabilities, axis=1)[:, :max_codes]
+        results = []
+        for row, ranked in zip(probabilities, order):
+            routed, mass = [], 0.0
+            for position in ranked.tolist():
+                routed.append((self.codes[position], float(row[position])))
+                mass += float(row[position])
+                if mass >= cumulative:
+                    break
+            results.append((routed, mass))
+        return results
+
+    def route(self, query_embedding, max_codes=3, cumulative=0.8, temperature=0.05):
+        """Route one query; see route_batch."""
+        return self.route_batch(query_embedding.reshape(1, -1), max_codes, cumulative, temperature)[0]
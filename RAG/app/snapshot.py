@@ -0,0 +1,231 @@
+# app/snapshot.py
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import numpy as np
+import faiss
+from app.bm25 import SparseBM25
+from app.lexicon import SynonymLexicon
+from app.store import StringColumn
+
+logger = logging.getLogger(__name__)
+
+# -----------------------------------
+# Configuration
+# -----------------------------------
+
+SNAPSHOT_DIR = os.getenv(
+    'RAG_SNAPSHOT_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'snapshot')
+)
+
+# Text columns of the doc-metadata table, each stored as a UTF-8 arena plus offsets
+METADATA_COLUMNS = ["doc_id", "code_name", "article_name", "content_english", "content_arabic"]
+
+# Bump whenever the on-disk layout changes so stale snapshots are rebuilt
+SNAPSHOT_FORMAT = 5
+
+MANIFEST_FILE = "manifest.json"
+EMBEDDINGS_FILE = "embeddings.npy"
+INDEX_FILE = "index-{key}.faiss"  # one file per dense index configuration
+BM25_DIR = "bm25"
+LEXICON_DIR = "lexicon"
+PASSAGES_DIR = "passages"  # passage texts, parent ids, embeddings and dense index
+
+# Share the flat index codes with the page cache when this FAISS build supports it.
+# Other index types are read into memory.
+FAISS_MMAP_FLAGS = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY | getattr(faiss, 'IO_FLAG_MMAP_IFC', 0)
+
+# -----------------------------------
+# Helper Functions
+# -----------------------------------
+
+def collection_fingerprint(collection):
+    """
+    Compute a version stamp of the articles collection without transferring the
+    documents: the count plus a hash of every (_id, BSON size, content_hash, updated_at)
+    tuple, projected server-side. The BSON size alone misses same-length edits (e.g. a
+    changed amount); content_hash and updated_at, set by mangodb_fill.py on every
+    write, catch them.
+
+    Parameters:
+    collection (pymongo.collection.Collection): The articles collection.
+
+    Returns:
+    str: A hex digest that changes whenever an article is added, removed or edited.
+    """
+    digest = hashlib.sha1()
+    count = 0
+    pipeline = [
+        {"$project": {
+            "size": {"$bsonSize": "$$ROOT"},
+            "content_hash": 1,
+            "updated_at": 1,
+        }},
+        {"$sort": {"_id": 1}},
+    ]
+    for doc in collection.aggregate(pipeline, allowDiskUse=True):
+        updated_at = doc.get("updated_at")
+        updated_at = updated_at.isoformat() if updated_at is not None else ""
+        digest.update(f"{doc['_id']}:{doc['size']}:{doc.get('content_hash', '')}:{updated_at};".encode("utf-8"))
+        count += 1
+    return f"{count}-{digest.hexdigest()}"
+
+def _write_column(directory, name, values):
+    """Write a StringColumn (or a list of strings) as its UTF-8 arena plus int64 offsets."""
+    column = values if isinstance(values, StringColumn) else StringColumn.from_strings(values)
+    with open(os.path.join(directory, f"{name}.bin"), "wb") as f:
+        f.write(np.asarray(column.arena).tobytes())
+    np.save(os.path.join(directory, f"{name}_offsets.npy"), np.asarray(column.offsets))
+
+def _read_column(directory, name):
+    """Read a string column written by _write_column, memory-mapping the arena."""
+    offsets = np.load(os.path.join(directory, f"{name}_offsets.npy"))
+    if offsets[-1] == 0:
+        return StringColumn(np.zeros(0, dtype=np.uint8), offsets)
+    return StringColumn(np.memmap(os.path.join(directory, f"{name}.bin"), dtype=np.uint8, mode='r'), offsets)
+
+def read_metadata(directory):
+    """Read the metadata columns of a snapshot directory, as StringColumns."""
+    return {name: _read_column(directory, name) for name in METADATA_COLUMNS}
+
+def snapshot_path(fingerprint):
+    """Return the directory holding the snapshot for a given collection fingerprint."""
+    return os.path.join(SNAPSHOT_DIR, f"v{SNAPSHOT_FORMAT}-{fingerprint}")
+
+def save_snapshot(fingerprint, metadata, embeddings, index, bm25, lexicon=None, index_key="flat", passages=None):
+    """
+    Persist a retrieval snapshot. The snapshot is written to a temporary directory and
+    renamed into place, so concurrent workers never observe a partial snapshot.
+
+    Parameters:
+    fingerprint (str): The collection fingerprint the snapshot was built from.
+    metadata (DocumentStore): The document columns (or a dict of column name -> list of
+    strings), for every name in METADATA_COLUMNS.
+    embeddings (np.ndarray): The float32 embedding matrix.
+    index (faiss.Index): The dense index over embeddings.
+    bm25 (SparseBM25): The BM25 engine.
+    lexicon (SynonymLexicon): The synonym lexicon used for query expansion, if any.
+    index_key (str): Name of the dense index configuration (see app.dense_index.index_key).
+    passages (PassageIndex): The passage-level index, if the corpus is chunked.
+    """
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    target = snapshot_path(fingerprint)
+    if os.path.isdir(target):
+        return target
+
+    tmp_dir = os.path.join(SNAPSHOT_DIR, f".tmp-{os.getpid()}-{time.time_ns()}")
+    os.makedirs(tmp_dir)
+    try:
+        np.save(os.path.join(tmp_dir, EMBEDDINGS_FILE), np.ascontiguousarray(embeddings, dtype=np.float32))
+        faiss.write_index(index, os.path.join(tmp_dir, INDEX_FILE.format(key=index_key)))
+        bm25.save(os.path.join(tmp_dir, BM25_DIR))
+        if lexicon is not None:
+            lexicon.save(os.path.join(tmp_dir, LEXICON_DIR))
+        for name in METADATA_COLUMNS:
+            _write_column(tmp_dir, name, metadata[name])
+        if passages is not None:
+            passages_dir = os.path.join(tmp_dir, PASSAGES_DIR)
+            os.makedirs(passages_dir)
+            _write_column(passages_dir, "text", passages.texts)
+            np.save(os.path.join(passages_dir, "parent.npy"), passages.parent)
+            np.save(os.path.join(passages_dir, EMBEDDINGS_FILE), np.ascontiguousarray(passages.embeddings, dtype=np.float32))
+            faiss.write_index(passages.index, os.path.join(passages_dir, INDEX_FILE.format(key=index_key)))
+        manifest = {
+            "format": SNAPSHOT_FORMAT,
+            "fingerprint": fingerprint,
+            "count": int(embeddings.shape[0]),
+            "dimension": int(embeddings.shape[1]),
+            "created_at": time.time(),
+        }
+        with open(os.path.join(tmp_dir, MANIFEST_FILE), "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.rename(tmp_dir, target)
+        logger.info(f"Saved retrieval snapshot to {target}")
+    except OSError:
+        # Another worker published the same snapshot first
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        if not os.path.isdir(target):
+            raise
+    prune_snapshots(keep=os.path.basename(target))
+    return target
+
+def load_snapshot(fingerprint, index_key="flat"):
+    """
+    Load a retrieval snapshot with memory maps, so that all workers share the same
+    physical pages for the embedding matrix and the dense index.
+
+    Parameters:
+    fingerprint (str): The current collection fingerprint.
+    index_key (str): Name of the dense index configuration to load.
+
+    Returns:
+    dict: The snapshot (manifest, metadata, embeddings, index, bm25, lexicon, passages),
+    or None if no snapshot exists for this fingerprint. The index is None when the
+    snapshot has no index of this configuration yet, the lexicon and passages when none
+    were saved. Passages are returned as a dict (texts, parent, embeddings, index).
+    """
+    directory = snapshot_path(fingerprint)
+    manifest_path = os.path.join(directory, MANIFEST_FILE)
+    if not os.path.isfile(manifest_path):
+        return None
+
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+
+    embeddings = np.load(os.path.join(directory, EMBEDDINGS_FILE), mmap_mode='r')
+    index = _read_index(directory, index_key)
+    bm25 = SparseBM25.load(os.path.join(directory, BM25_DIR))
+    metadata = read_metadata(directory)
+    lexicon_dir = os.path.join(directory, LEXICON_DIR)
+    lexicon = SynonymLexicon.load(lexicon_dir) if os.path.isdir(lexicon_dir) else None
+    passages = None
+    passages_dir = os.path.join(directory, PASSAGES_DIR)
+    if os.path.isdir(passages_dir):
+        passages = {
+            "texts": _read_column(passages_dir, "text"),
+            "parent": np.load(os.path.join(passages_dir, "parent.npy")),
+            "embeddings": np.load(os.path.join(passages_dir, EMBEDDINGS_FILE), mmap_mode='r'),
+            "index": _read_index(passages_dir, index_key),
+        }
+
+    return {
+        "manifest": manifest,
+        "metadata": metadata,
+        "embeddings": embeddings,
+        "index": index,
+        "bm25": bm25,
+        "lexicon": lexicon,
+        "passages": passages,
+    }
+
+def _read_index(directory, index_key):
+    """Read the dense index of a configuration, or return None if it was never built."""
+    path = os.path.join(directory, INDEX_FILE.format(key=index_key))
+    if not os.path.isfile(path):
+        return None
+    return faiss.read_index(path, FAISS_MMAP_FLAGS if index_key == "flat" else 0)
+
+def save_index(fingerprint, index, index_key, passages=False):
+    """
+    Add a dense index of another configuration to an existing snapshot, so that it
+    is trained once and then loaded by every worker.
+    """
+    directory = snapshot_path(fingerprint)
+    if passages:
+        directory = os.path.join(directory, PASSAGES_DIR)
+    path = os.path.join(directory, INDEX_FILE.format(key=index_key))
+    tmp_path = f"{path}.tmp-{os.getpid()}-{time.time_ns()}"
+    faiss.write_index(index, tmp_path)
+    os.replace(tmp_path, path)
+    logger.info(f"Saved {index_key} dense index to {path}")
+
+def prune_snapshots(keep):
+    """Remove snapshots built from older versions of the collection or format."""
+    for name in os.listdir(SNAPSHOT_DIR):
+        if name != keep and not name.startswith(".tmp-"):
+            shutil.rmtree(os.path.join(SNAPSHOT_DIR, name), ignore_errors=True)
@@ -0,0 +1,105 @@
+# app/store.py
+
+import numpy as np
+
+
+class StringColumn:
+    """
+    Immutable column of strings stored as one contiguous UTF-8 arena plus int64 offsets:
+    string i is arena[offsets[i]:offsets[i + 1]]. Strings are only decoded when read,
+    and the arena can be a memory map of a snapshot file.
+    """
+
+    def __init__(self, arena, offsets):
+        """
+        Parameters:
+        arena (np.ndarray): uint8 array holding the concatenated UTF-8 bytes.
+        offsets (np.ndarray): int64 array of n + 1 offsets into the arena.
+        """
+        self.arena = arena
+        self.offsets = offsets
+
+    @classmethod
+    def from_strings(cls, values):
+        """Build a column from a list of strings."""
+        encoded = [value.encode("utf-8") for value in values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        return cls(np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        return self.arena[start:end].tobytes().decode("utf-8")
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def take_list(self, ids):
+        """Decode the strings at the given positions."""
+        return [self[i] for i in np.asarray(ids, dtype=np.int64).tolist()]
+
+    def take(self, ids):
+        """
+        Return a new column holding the strings at the given positions, copying the
+        bytes with one vectorized gather instead of decoding them.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        starts = np.asarray(self.offsets[ids], dtype=np.int64)
+        lengths = np.asarray(self.offsets[ids + 1], dtype=np.int64) - starts
+        offsets = np.zeros(len(ids) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        # Byte j of the output comes from starts[k] + (j - offsets[k]) for its string k
+        positions = np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1], dtype=np.int64)
+        return StringColumn(np.asarray(self.arena)[positions], offsets)
+
+    def extend(self, values):
+        """Return a new column with the given strings appended."""
+        appended = StringColumn.from_strings(values)
+        offsets = np.concatenate([np.asarray(self.offsets[:-1]), appended.offsets + self.offsets[-1]])
+        return StringColumn(np.concatenate([np.asarray(self.arena), appended.arena]), offsets)
+
+
+class DocumentStore:
+    """
+    Columnar document metadata (doc_id, code_name, article_name, content_english,
+    content_arabic), addressed by integer document ids. The retrieval pipeline passes
+    ids around and only decodes the texts it returns.
+    """
+
+    def __init__(self, columns):
+        """
+        Parameters:
+        columns (dict): Column name -> StringColumn or list of strings, all the same length.
+        """
+        self.columns = {
+            name: values if isinstance(values, StringColumn) else StringColumn.from_strings(values)
+            for name, values in columns.items()
+        }
+        lengths = {len(column) for column in self.columns.values()}
+        if len(lengths) > 1:
+            raise ValueError(f"Columns have different lengths: {lengths}")
+        self.size = lengths.pop() if lengths else 0
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def get(self, name, ids):
+        """Decode the values of a column for the given document ids."""
+        return self.columns[name].take_list(ids)
+
+    def edit(self, keep, rows):
+        """
+        Return the store of an edited corpus: the kept documents, in order, followed by
+        the new rows (dicts with one value per column).
+        """
+        return DocumentStore({
+            name: column.take(keep).extend([row[name] for row in rows])
+            for name, column in self.columns.items()
+        })
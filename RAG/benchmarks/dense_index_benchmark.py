@@ -0,0 +1,113 @@
+# benchmarks/dense_index_benchmark.py
+"""
+Compare dense index types against the exact flat index.
+
+For every index configuration the script reports build (training + add) time, the
+serialized index size, single-query latency percentiles and recall@k with respect to
+IndexFlatIP, for a sweep of nprobe (IVF) or efSearch (HNSW) values. Embeddings come
+from the retrieval snapshot, or are synthetic to simulate a larger corpus:
+
+    python benchmarks/dense_index_benchmark.py --snapshot snapshot/v4-<fingerprint>
+    python benchmarks/dense_index_benchmark.py --synthetic 300000 --dim 768
+"""
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import faiss
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.dense_index import build_dense_index, search_parameters, describe_index, INDEX_TYPES
+from app.snapshot import EMBEDDINGS_FILE
+
+
+def load_embeddings(args):
+    if args.snapshot:
+        return np.ascontiguousarray(np.load(os.path.join(args.snapshot, EMBEDDINGS_FILE)), dtype=np.float32)
+    # Clustered synthetic vectors behave closer to real embeddings than uniform noise
+    rng = np.random.default_rng(args.seed)
+    centers = rng.standard_normal((max(args.synthetic // 500, 16), args.dim)).astype(np.float32)
+    embeddings = centers[rng.integers(len(centers), size=args.synthetic)]
+    embeddings += 0.5 * rng.standard_normal(embeddings.shape).astype(np.float32)
+    faiss.normalize_L2(embeddings)
+    return embeddings
+
+
+def make_queries(embeddings, n_queries, seed):
+    """Perturbed copies of random corpus vectors, as a stand-in for real query embeddings."""
+    rng = np.random.default_rng(seed + 1)
+    queries = embeddings[rng.choice(len(embeddings), n_queries, replace=False)].copy()
+    queries += 0.05 * rng.standard_normal(queries.shape).astype(np.float32)
+    faiss.normalize_L2(queries)
+    return queries
+
+
+def recall_at_k(found, truth):
+    hits = sum(len(set(row[row >= 0].tolist()) & set(expected.tolist())) for row, expected in zip(found, truth))
+    return hits / truth.size
+
+
+def measure(index, queries, k, params):
+    latencies = []
+    results = np.empty((len(queries), k), dtype=np.int64)
+    for i, query in enumerate(queries):
+        start = time.perf_counter()
+        _, ids = index.search(query.reshape(1, -1), k, params=params)
+        latencies.append(time.perf_counter() - start)
+        results[i] = ids[0]
+    return results, np.percentile(latencies, [50, 95]) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--snapshot", help="Snapshot directory holding embeddings.npy")
+    source.add_argument("--synthetic", type=int, help="Number of synthetic vectors")
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--types", nargs="+", default=list(INDEX_TYPES), choices=list(INDEX_TYPES))
+    parser.add_argument("--k", type=int, default=50, help="Candidates per query (the API uses top_k * 10)")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[16, 64, 256])
+    parser.add_argument("--nlist", type=int, default=0)
+    parser.add_argument("--pq-m", type=int, default=64)
+    parser.add_argument("--hnsw-m", type=int, default=32)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    embeddings = load_embeddings(args)
+    queries = make_queries(embeddings, min(args.queries, len(embeddings)), args.seed)
+    print(f"{len(embeddings)} vectors of dimension {embeddings.shape[1]}, {len(queries)} queries, k={args.k}")
+
+    flat = build_dense_index(embeddings, "flat")
+    _, truth = flat.search(queries, args.k)
+
+    print(f"{'index':<22}{'setting':>14}{'build s':>10}{'size MB':>10}{'p50 ms':>9}{'p95 ms':>9}{'recall':>9}")
+    for index_type in args.types:
+        start = time.perf_counter()
+        index = build_dense_index(
+            embeddings, index_type, nlist=args.nlist, pq_m=args.pq_m, hnsw_m=args.hnsw_m, seed=args.seed,
+        )
+        build_time = time.perf_counter() - start
+        info = describe_index(index)
+
+        if info["nlist"] is not None:
+            settings = [("nprobe", n, search_parameters(index, nprobe=n)) for n in args.nprobe if n <= info["nlist"]]
+        elif isinstance(index, faiss.IndexHNSW):
+            settings = [("efSearch", ef, search_parameters(index, ef_search=ef)) for ef in args.ef_search]
+        else:
+            settings = [("-", "", None)]
+
+        for name, value, params in settings:
+            found, (p50, p95) = measure(index, queries, args.k, params)
+            setting = f"{name}={value}" if value != "" else name
+            print(
+                f"{index_type + ' (' + info['type'] + ')':<22}{setting:>14}{build_time:>10.2f}"
+                f"{info['bytes'] / 2 ** 20:>10.1f}{p50:>9.3f}{p95:>9.3f}{recall_at_k(found, truth):>9.3f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
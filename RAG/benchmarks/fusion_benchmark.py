@@ -0,0 +1,125 @@
+# benchmarks/fusion_benchmark.py
+"""
+Measure how the fusion method and the candidate pool size trade retrieval quality
+against latency.
+
+BM25 and dense candidates are fetched once per query (top_k * 10 from each side, as
+the API does); then, for every fusion method and pool size, the fused pool is
+diversified with MMR and reranked with the cross-encoder. The script reports hit rate
+and MRR of the relevant article in the final top_k, the overlap with the reference
+results (the largest pool with RRF) and the selection and rerank latencies.
+
+Queries come from a JSON Lines file of {"query": ..., "doc_ids": [...]} or, by default,
+are sampled from the corpus as a random window of an article's English text, the
+article being the relevant document. The retrieval snapshot must match the MongoDB
+collection; no LLM call is made:
+
+    python benchmarks/fusion_benchmark.py --pools 5 10 20 50 100
+    python benchmarks/fusion_benchmark.py --queries queries.jsonl --methods rrf
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app import rag
+from app.fusion import FUSION_METHODS
+
+
+def load_queries(args, gen):
+    """Return (query, ids of the relevant articles) pairs."""
+    if args.queries:
+        with open(args.queries, encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+        return [
+            (row["query"], {gen.doc_positions[doc_id] for doc_id in row["doc_ids"] if doc_id in gen.doc_positions})
+            for row in rows
+        ]
+    rng = np.random.default_rng(args.seed)
+    queries = []
+    for article_id in rng.choice(len(gen), min(args.n_queries, len(gen)), replace=False).tolist():
+        # Skip the header line (code and article name), which would make the query trivial
+        words = gen.store["content_english"][article_id].split("\n", 1)[-1].split()
+        if len(words) < args.query_words:
+            continue
+        start = int(rng.integers(len(words) - args.query_words + 1))
+        queries.append((" ".join(words[start:start + args.query_words]), {article_id}))
+    return queries
+
+
+def article_ids(ids, gen):
+    """Map retrieved ids (passages in passage mode) to their articles."""
+    if rag.passage_mode(gen):
+        return gen.passages.parent[np.asarray(ids, dtype=np.int64)].tolist()
+    return list(ids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", help="JSON Lines file of {query, doc_ids}")
+    parser.add_argument("--n-queries", type=int, default=200, help="Queries sampled from the corpus")
+    parser.add_argument("--query-words", type=int, default=12, help="Words per sampled query")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--methods", nargs="+", default=list(FUSION_METHODS), choices=list(FUSION_METHODS))
+    parser.add_argument("--bm25-weight", type=float, default=rag.FUSION_BM25_WEIGHT)
+    parser.add_argument("--pools", type=int, nargs="+", default=[5, 10, 20, 50, 100])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rag.startup_rag_system()
+    gen = rag.generation
+    queries = load_queries(args, gen)
+    depth = args.top_k * 10
+    print(f"{len(gen)} articles, {len(queries)} queries, top_k={args.top_k}, {depth} candidates per side")
+
+    # Candidates are fetched once; only fusion, MMR and reranking depend on the settings
+    prepared = [rag.prepare_query(query, gen) for query, _ in queries]
+    embeddings = rag.encode_queries([expanded_query for expanded_query, _ in prepared])
+    bm25_hits = [gen.bm25_search.top_k(tokenized_query, depth) for _, tokenized_query in prepared]
+    dense_hits = rag.dense_candidates_batch(embeddings, [depth] * len(queries), [None] * len(queries), gen)
+
+    def run(method, pool):
+        search_params = {"fusion": method, "bm25_weight": args.bm25_weight, "candidate_pool": pool}
+        results, select_times, rerank_times = [], [], []
+        for (query, _), (_, tokenized_query), embedding, bm25, dense in zip(
+            queries, prepared, embeddings, bm25_hits, dense_hits
+        ):
+            start = time.perf_counter()
+            ids = rag.select_candidates(
+                embedding, tokenized_query, args.top_k, [], None, gen, search_params, dense, bm25
+            )
+            select_times.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            if ids:
+                scores = rag.resources.cross_encoder.predict([(query, text) for text in rag.unit_texts(ids, gen)])
+                ids = [doc_id for doc_id, _ in rag.rank_documents(ids, scores)]
+            rerank_times.append(time.perf_counter() - start)
+            results.append(article_ids(ids, gen))
+        return results, np.percentile(select_times, [50, 95]) * 1000, np.percentile(rerank_times, [50, 95]) * 1000
+
+    reference, _, _ = run("rrf", max(args.pools))
+    print(f"{'fusion':<10}{'pool':>6}{'hit@k':>8}{'MRR':>8}{'overlap':>9}{'select p50':>12}{'p95':>8}{'rerank p50':>12}{'p95':>8}")
+    for method in args.methods:
+        for pool in args.pools:
+            results, select_ms, rerank_ms = run(method, pool)
+            ranks = [
+                next((rank for rank, article_id in enumerate(found, 1) if article_id in relevant), None)
+                for found, (_, relevant) in zip(results, queries)
+            ]
+            hit_rate = np.mean([rank is not None for rank in ranks])
+            mrr = np.mean([1.0 / rank if rank else 0.0 for rank in ranks])
+            overlap = np.mean([
+                len(set(found) & set(expected)) / max(len(expected), 1) for found, expected in zip(results, reference)
+            ])
+            print(
+                f"{method:<10}{pool:>6}{hit_rate:>8.3f}{mrr:>8.3f}{overlap:>9.3f}"
+                f"{select_ms[0]:>12.2f}{select_ms[1]:>8.2f}{rerank_ms[0]:>12.2f}{rerank_ms[1]:>8.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+# benchmarks/load_test.py
+"""
+Closed-loop load test for the /query endpoint.
+
+Each simulated user sends queries back to back; the script reports throughput and
+latency percentiles for every concurrency level. Start the API with the fake LLM
+backend to measure the pipeline offline, e.g.:
+
+    LLM_BACKEND=fake FAKE_LLM_LATENCY=0.5 python -m app.main
+    python benchmarks/load_test.py --concurrency 1 16 32 64
+"""
+
+import time
+import asyncio
+import argparse
+import statistics
+import httpx
+
+DEFAULT_QUERIES = [
+    "What is the procedure for divorce in Tunisia?",
+    "What are the VAT rates applicable to services?",
+    "How can an employer terminate a work contract?",
+    "What are the penalties for driving without a license?",
+    "Who can acquire Tunisian nationality?",
+]
+
+
+async def simulated_user(client, url, queries, deadline, latencies, errors):
+    i = 0
+    while time.perf_counter() < deadline:
+        payload = {"query": queries[i % len(queries)], "top_k": 5}
+        i += 1
+        start = time.perf_counter()
+        try:
+            response = await client.post(url, json=payload)
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+        except httpx.HTTPError:
+            errors.append(1)
+
+
+async def run_level(url, concurrency, duration, queries):
+    latencies, errors = [], []
+    deadline = time.perf_counter() + duration
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(timeout=300, limits=limits) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*[
+            simulated_user(client, url, queries, deadline, latencies, errors)
+            for _ in range(concurrency)
+        ])
+        elapsed = time.perf_counter() - start
+
+    if not latencies:
+        print(f"{concurrency:>6}  no successful requests ({len(errors)} errors)")
+        return
+    quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+    print(
+        f"{concurrency:>6}  {len(latencies) / elapsed:>8.2f} req/s"
+        f"  p50 {quantiles[49] * 1000:>8.1f} ms  p95 {quantiles[94] * 1000:>8.1f} ms"
+        f"  ok {len(latencies):>6}  errors {len(errors)}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000/query")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16, 32, 64])
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds per concurrency level")
+    args = parser.parse_args()
+
+    print(" users    throughput      latency")
+    for concurrency in args.concurrency:
+        asyncio.run(run_level(args.url, concurrency, args.duration, DEFAULT_QUERIES))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# benchmarks/onnx_benchmark.py
+"""
+Compare the encoder inference backends on CPU: eager PyTorch fp32 and ONNX Runtime
+fp32 and int8, for a sweep of intra-op thread counts.
+
+Per-query latency covers what the API does for one request: encoding one query and
+reranking top_k (query, document) pairs. Ingestion throughput is the number of
+documents embedded per second in batches, as mangodb_fill.py does. Documents come
+from a file with one document per line, or are built from sample legal sentences:
+
+    python benchmarks/onnx_benchmark.py --threads 1 4 8
+    python benchmarks/onnx_benchmark.py --documents articles.txt --n-documents 2000
+"""
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.inference import load_sentence_encoder, load_cross_encoder
+from onnx_parity import EMBEDDING_MODEL, CROSS_ENCODER_MODEL, SAMPLE_QUERIES, SAMPLE_DOCUMENTS
+
+
+def load_documents(args):
+    if args.documents:
+        with open(args.documents, encoding="utf-8") as f:
+            documents = [line.strip() for line in f if line.strip()]
+    else:
+        # Articles of about 100 to 150 words made of the sample sentences
+        rng = np.random.default_rng(args.seed)
+        sentences = [sentence for document in SAMPLE_DOCUMENTS for sentence in document.split("\n")[1].split(". ")]
+        documents = [
+            ". ".join(rng.choice(sentences, size=int(rng.integers(6, 10))).tolist())
+            for _ in range(args.n_documents)
+        ]
+    return documents[:args.n_documents]
+
+
+def percentiles(latencies):
+    return np.percentile(latencies, [50, 95]) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", help="File with one document per line")
+    parser.add_argument("--n-documents", type=int, default=512, help="Documents embedded for the throughput")
+    parser.add_argument("--batch-size", type=int, default=64, help="Embedding batch size of the ingestion")
+    parser.add_argument("--top-k", type=int, default=5, help="Pairs reranked per query")
+    parser.add_argument("--queries", type=int, default=50, help="Timed queries per configuration")
+    parser.add_argument("--threads", type=int, nargs="+", default=[0], help="Intra-op threads (0 = default)")
+    parser.add_argument("--cache-dir", default=os.getenv("ONNX_CACHE_DIR", "onnx_models"))
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    documents = load_documents(args)
+    queries = [SAMPLE_QUERIES[i % len(SAMPLE_QUERIES)] for i in range(args.queries)]
+    print(f"{len(documents)} documents, {len(queries)} queries, top_k={args.top_k}")
+
+    configurations = []
+    for threads in args.threads:
+        configurations.append(("torch fp32", threads, {"backend": "torch"}))
+        for quantize in (False, True):
+            name = "onnx int8" if quantize else "onnx fp32"
+            options = {"backend": "onnx", "cache_dir": args.cache_dir, "quantize": quantize, "threads": threads}
+            configurations.append((name, threads, options))
+
+    print(f"{'backend':<12}{'threads':>8}{'encode p50':>12}{'p95':>8}{'rerank p50':>12}{'p95':>8}{'docs/s':>10}")
+    for name, threads, options in configurations:
+        if options["backend"] == "torch" and threads > 0:
+            torch.set_num_threads(threads)
+        encoder = load_sentence_encoder(EMBEDDING_MODEL, **options)
+        cross_encoder = load_cross_encoder(CROSS_ENCODER_MODEL, **options)
+        # Warm up (first calls allocate buffers)
+        encoder.encode(queries[:2], normalize_embeddings=True)
+        cross_encoder.predict([(queries[0], document) for document in documents[:args.top_k]])
+
+        encode_latencies, rerank_latencies = [], []
+        for i, query in enumerate(queries):
+            start = time.perf_counter()
+            encoder.encode([query], batch_size=1, convert_to_numpy=True, normalize_embeddings=True)
+            encode_latencies.append(time.perf_counter() - start)
+            pairs = [(query, documents[(i + j) % len(documents)]) for j in range(args.top_k)]
+            start = time.perf_counter()
+            cross_encoder.predict(pairs, batch_size=args.top_k)
+            rerank_latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        encoder.encode(documents, batch_size=args.batch_size, convert_to_numpy=True, normalize_embeddings=True)
+        throughput = len(documents) / (time.perf_counter() - start)
+
+        encode_ms, rerank_ms = percentiles(encode_latencies), percentiles(rerank_latencies)
+        print(
+            f"{name:<12}{threads or 'auto':>8}{encode_ms[0]:>12.2f}{encode_ms[1]:>8.2f}"
+            f"{rerank_ms[0]:>12.2f}{rerank_ms[1]:>8.2f}{throughput:>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
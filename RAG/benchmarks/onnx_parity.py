@@ -0,0 +1,104 @@
+# benchmarks/onnx_parity.py
+"""
+Check that the ONNX Runtime backend reproduces the PyTorch encoders.
+
+Sample texts are embedded and sample (query, document) pairs reranked with the 'torch'
+backend and with ONNX Runtime, in fp32 and int8. The script exits with status 1 when an
+embedding's cosine similarity to the torch one falls below the tolerance, when a rerank
+score differs by more than the tolerance, or when the best document of a query changes:
+
+    python benchmarks/onnx_parity.py
+    python benchmarks/onnx_parity.py --texts articles.txt --min-cosine-int8 0.98
+"""
+
+import os
+import sys
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.inference import load_sentence_encoder, load_cross_encoder
+
+EMBEDDING_MODEL = "sentence-transformers/multi-qa-mpnet-base-dot-v1"
+CROSS_ENCODER_MODEL = "cross-encoder/ms-marco-MiniLM-L-12-v2"
+
+SAMPLE_QUERIES = [
+    "What is the procedure for divorce in Tunisia?",
+    "What are the VAT rates applicable to services?",
+    "How can an employer terminate a work contract?",
+    "What are the penalties for driving without a license?",
+]
+
+SAMPLE_DOCUMENTS = [
+    "Personal Status Code - Article 30\nDivorce may only take place before a court. The judge pronounces divorce "
+    "after an attempt at reconciliation between the spouses.",
+    "Value Added Tax Code - Article 7\nThe value added tax rate is set at 19%. Reduced rates of 7% and 13% apply "
+    "to the services listed in the annexed tables.",
+    "Labor Code - Article 14\nThe employment contract of indefinite duration may be terminated by either party "
+    "subject to notice. Dismissal must be based on a real and serious cause.",
+    "Highway Code - Article 82\nAnyone who drives a motor vehicle without holding the corresponding driving "
+    "license shall be punished by a fine and may be sentenced to imprisonment.",
+    "Nationality Code - Article 12\nTunisian nationality may be acquired by naturalization, by marriage or by "
+    "operation of law under the conditions set out in this code.",
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--texts", help="File with one text per line to embed (defaults to built-in samples)")
+    parser.add_argument("--cache-dir", default=os.getenv("ONNX_CACHE_DIR", "onnx_models"))
+    parser.add_argument("--min-cosine-fp32", type=float, default=0.9999)
+    parser.add_argument("--min-cosine-int8", type=float, default=0.99)
+    parser.add_argument("--score-tolerance-fp32", type=float, default=1e-3)
+    parser.add_argument("--score-tolerance-int8", type=float, default=0.5)
+    args = parser.parse_args()
+
+    texts = SAMPLE_QUERIES + SAMPLE_DOCUMENTS
+    if args.texts:
+        with open(args.texts, encoding="utf-8") as f:
+            texts = [line.strip() for line in f if line.strip()]
+    pairs = [(query, document) for query in SAMPLE_QUERIES for document in SAMPLE_DOCUMENTS]
+
+    def embed(model):
+        return model.encode(texts, batch_size=16, convert_to_numpy=True, normalize_embeddings=True)
+
+    def rerank(model):
+        return np.asarray(model.predict(pairs, batch_size=32), dtype=np.float32)
+
+    reference_embeddings = embed(load_sentence_encoder(EMBEDDING_MODEL, "torch"))
+    reference_scores = rerank(load_cross_encoder(CROSS_ENCODER_MODEL, "torch"))
+    reference_best = reference_scores.reshape(len(SAMPLE_QUERIES), -1).argmax(axis=1)
+
+    failures = []
+    for quantize, min_cosine, tolerance in (
+        (False, args.min_cosine_fp32, args.score_tolerance_fp32),
+        (True, args.min_cosine_int8, args.score_tolerance_int8),
+    ):
+        name = "int8" if quantize else "fp32"
+        options = {"backend": "onnx", "cache_dir": args.cache_dir, "quantize": quantize}
+        embeddings = embed(load_sentence_encoder(EMBEDDING_MODEL, **options))
+        scores = rerank(load_cross_encoder(CROSS_ENCODER_MODEL, **options))
+
+        cosines = np.sum(embeddings * reference_embeddings, axis=1)
+        differences = np.abs(scores - reference_scores)
+        best = scores.reshape(len(SAMPLE_QUERIES), -1).argmax(axis=1)
+        print(
+            f"onnx {name}: embedding cosine min {cosines.min():.5f} mean {cosines.mean():.5f}, "
+            f"rerank score max diff {differences.max():.4f}, best document agreement {np.mean(best == reference_best):.2f}"
+        )
+        if cosines.min() < min_cosine:
+            failures.append(f"{name} embedding cosine {cosines.min():.5f} < {min_cosine}")
+        if differences.max() > tolerance:
+            failures.append(f"{name} rerank score difference {differences.max():.4f} > {tolerance}")
+        if np.any(best != reference_best):
+            failures.append(f"{name} changes the best document of {int(np.sum(best != reference_best))} queries")
+
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    if failures:
+        sys.exit(1)
+    print("ONNX backend matches the torch outputs.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+# benchmarks/router_benchmark.py
+"""
+Evaluate the local centroid code router on held-out articles.
+
+Centroids are built from a training split of the snapshot's article embeddings, and
+every held-out article embedding is routed as if it were a query. The script reports
+top-1 accuracy, the share of articles whose code is among the routed codes, how many
+queries clear the confidence threshold (the others would be routed by Gemini), the
+accuracy on those, and the routing latency:
+
+    python benchmarks/router_benchmark.py --snapshot snapshot/v5-<fingerprint>
+"""
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.generation import build_code_indices
+from app.router import CodeRouter
+from app.snapshot import EMBEDDINGS_FILE, read_metadata
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--snapshot", required=True, help="Snapshot directory")
+    parser.add_argument("--holdout", type=float, default=0.2, help="Share of articles routed as queries")
+    parser.add_argument("--temperature", type=float, nargs="+", default=[0.02, 0.05, 0.1])
+    parser.add_argument("--max-codes", type=int, default=3)
+    parser.add_argument("--cumulative", type=float, default=0.8)
+    parser.add_argument("--min-confidence", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    embeddings = np.ascontiguousarray(np.load(os.path.join(args.snapshot, EMBEDDINGS_FILE)), dtype=np.float32)
+    codes = np.asarray(list(read_metadata(args.snapshot)["code_name"]), dtype=str)
+    rng = np.random.default_rng(args.seed)
+    held_out = rng.random(len(codes)) < args.holdout
+    train, test = np.flatnonzero(~held_out), np.flatnonzero(held_out)
+    print(f"{len(train)} training and {len(test)} held-out articles over {len(np.unique(codes))} codes")
+
+    router = CodeRouter.from_code_indices(
+        embeddings[train], build_code_indices(embeddings[train], codes[train].tolist(), with_sub_indices=False)
+    )
+    queries, expected = embeddings[test], codes[test]
+
+    print(f"{'temperature':>12}{'top-1':>8}{'in routed':>11}{'confident':>11}{'conf. acc':>11}{'codes':>7}")
+    for temperature in args.temperature:
+        routes = router.route_batch(queries, args.max_codes, args.cumulative, temperature)
+        top1 = np.mean([routed[0][0] == code for (routed, _), code in zip(routes, expected)])
+        covered = np.array([code in {name for name, _ in routed} for (routed, _), code in zip(routes, expected)])
+        confident = np.array([confidence >= args.min_confidence for _, confidence in routes])
+        confident_accuracy = covered[confident].mean() if confident.any() else float("nan")
+        mean_codes = np.mean([len(routed) for routed, _ in routes])
+        print(
+            f"{temperature:>12.3f}{top1:>8.3f}{covered.mean():>11.3f}{confident.mean():>11.3f}"
+            f"{confident_accuracy:>11.3f}{mean_codes:>7.2f}"
+        )
+
+    latencies = []
+    for query in queries[:1000]:
+        start = time.perf_counter()
+        router.route(query, args.max_codes, args.cumulative, args.temperature[0])
+        latencies.append(time.perf_counter() - start)
+    p50, p95 = np.percentile(latencies, [50, 95]) * 1e6
+    print(f"Routing latency per query: p50 {p50:.1f} us, p95 {p95:.1f} us")
+
+
+if __name__ == "__main__":
+    main()
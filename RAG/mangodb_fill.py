@@ -1,40 +1,16 @@
 import os
-import sys
-import subprocess
-import importlib
-
-def install_and_import(package, module_name=None):
-    """
-    Tries to import the module. If it fails, installs the package and imports again.
-    :param package: The package name to install via pip.
-    :param module_name: The module name to import (if different from the package name).
-    :return: The imported module.
-    """
-    try:
-        if module_name is None:
-            return importlib.import_module(package)
-        else:
-            return importlib.import_module(module_name)
-    except ImportError:
-        print(f"Package '{package}' not found. Installing...")
-        subprocess.check_call([sys.executable, "-m", "pip", "install", package])
-        if module_name is None:
-            return importlib.import_module(package)
-        else:
-            return importlib.import_module(module_name)
-
-# Install and import necessary libraries
-# Note: 'os' is built-in so we do not need to install it.
-pymongo = install_and_import("pymongo")
-from pymongo import MongoClient
-
-sentence_transformers = install_and_import("sentence-transformers", "sentence_transformers")
-from sentence_transformers import SentenceTransformer
-
-tqdm_module = install_and_import("tqdm")
+import time
+import hashlib
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from pymongo import MongoClient, UpdateOne, ASCENDING
 from tqdm.auto import tqdm
+from nltk.tokenize import PunktSentenceTokenizer
 
-torch = install_and_import("torch")
+from app.codec import encode_embedding
+from app.inference import load_sentence_encoder, select_device
+from app.resources import Resources
+from app.passages import chunk_text
 
 # Define the code name translations dictionary
 CODE_NAME_TRANSLATIONS = {
@@ -44,8 +20,9 @@ CODE_NAME_TRANSLATIONS = {
     "code-assurances": "Insurance Code - Code des Assurances - مجلة التأمين",
     "code-changes-commerce-exterieur": "Foreign Exchange and Foreign Trade Code - Code des Changes et du Commerce Extérieur - مجلة الصرف والتجارة الخارجية",
     "code-collectivites-locales": "Local Authorities Code - Code des Collectivités Locales - مجلة الجماعات المحلية",
+    "code-commerce": "Commercial Code - Code de Commerce - المجلة التجارية",
     "code-commerce-maritime": "Maritime Commerce Code - Code du Commerce Maritime - مجلة التجارة البحرية",
-    "code-compatibilite-publique": "Public Accounting Code - Code de la Comptabilité Publique - مجلة المحاسبة العمومية",
+    "code-comptabilite-publique": "Public Accounting Code - Code de la Comptabilité Publique - مجلة المحاسبة العمومية",
     "code-conduite-deontologie-agent-public": "Code of Conduct for Public Agents - Code de Conduite et de Déontologie de l'Agent Public - مجلة سلوك وأخلاقيات العون العمومي",
     "code-decorations": "Decorations Code - Code des Décorations - مجلة الأوسمة",
     "code-deontologie-medecin-veterinaire": "Veterinary Ethics Code - Code de Déontologie du Médecin Vétérinaire - مجلة أخلاقيات الطبيب البيطري",
@@ -90,113 +67,213 @@ CODE_NAME_TRANSLATIONS = {
     "tunisian_constitution_articles": "Tunisian Constitution Articles - Articles de la Constitution Tunisienne - فصول الدستور التونسي"
 }
 
-# Initialize MongoDB connection and check/create database "rag_system_project"
-client = MongoClient("mongodb://localhost:27017/")
-db_name = "rag_system_project"
-if db_name in client.list_database_names():
-    db = client[db_name]
-    print(f"Database '{db_name}' exists. Using it.")
-else:
-    db = client[db_name]
-    print(f"Database '{db_name}' not found. Creating it.")
-
-# Select (or create) the collection
-collection = db["articles"]
-
-# Initialize embedding model with GPU support (if available)
-device = 'cuda' if torch.cuda.is_available() else 'cpu'
-embedding_model = SentenceTransformer('sentence-transformers/multi-qa-mpnet-base-dot-v1', device=device)
-print(f"Using device: {device}")
-
-def process_and_embed_code_directory(code_directory, batch_size=16):
+MONGODB_URI = "mongodb://localhost:27017/"
+MONGODB_DB = "rag_system_project"
+EMBEDDING_MODEL = 'sentence-transformers/multi-qa-mpnet-base-dot-v1'
+
+# Inference backend, as in app/rag.py: 'torch' or 'onnx' (ONNX Runtime on CPU, int8
+# unless ONNX_QUANTIZE is false). Embeddings of both backends agree within the tolerance
+# checked by benchmarks/onnx_parity.py, so switching does not re-embed the corpus
+INFERENCE_BACKEND = os.getenv('INFERENCE_BACKEND', 'torch')
+
+def load_collection():
+    """Select (or create) the articles collection and its upsert index."""
+    client = MongoClient(MONGODB_URI)
+    if MONGODB_DB in client.list_database_names():
+        print(f"Database '{MONGODB_DB}' exists. Using it.")
+    else:
+        print(f"Database '{MONGODB_DB}' not found. Creating it.")
+    collection = client[MONGODB_DB]["articles"]
+    # One document per article; upserts are keyed on this index
+    collection.create_index([("code_name", ASCENDING), ("article_name", ASCENDING)], unique=True)
+    return collection
+
+def load_embedding_model():
+    """Load the embedding model, on the GPU when one is available."""
+    device = select_device(INFERENCE_BACKEND)
+    print(f"Using device: {device}, {INFERENCE_BACKEND} backend")
+    return load_sentence_encoder(
+        EMBEDDING_MODEL,
+        backend=INFERENCE_BACKEND,
+        device=device,
+        cache_dir=os.getenv('ONNX_CACHE_DIR', 'onnx_models'),
+        quantize=os.getenv('ONNX_QUANTIZE', 'true').lower() == 'true',
+        threads=int(os.getenv('ONNX_THREADS', '0')),
+    )
+
+# Connected and loaded on first use (both at once by __main__), not at import
+resources = Resources()
+resources.register("collection", load_collection)
+resources.register("embedding_model", load_embedding_model)
+
+# Ingestion settings
+READER_WORKERS = 16  # Threads reading article files
+EMBEDDING_BATCH_SIZE = 64  # Documents per forward pass
+WRITE_BATCH_SIZE = 512  # Articles embedded and written to MongoDB together
+EMBEDDING_STORAGE_DTYPE = os.getenv('EMBEDDING_STORAGE_DTYPE', 'float32')  # 'float32' or 'float16'
+
+# Passage chunking: sentence windows short enough for the embedding model (384 word pieces)
+CHUNK_MAX_WORDS = int(os.getenv('CHUNK_MAX_WORDS', '180'))
+CHUNK_OVERLAP_SENTENCES = int(os.getenv('CHUNK_OVERLAP_SENTENCES', '1'))
+sentence_tokenizer = PunktSentenceTokenizer()
+
+def content_hash(arabic_content, english_content):
+    """
+    Hash the stored content of an article together with the embedding model name and
+    the chunking settings, so that an article is re-embedded when any of them changes.
     """
-    Processes a given code directory, computes embeddings in batches, and inserts the data into MongoDB.
-    
+    digest = hashlib.sha256()
+    chunking = f"{CHUNK_MAX_WORDS}/{CHUNK_OVERLAP_SENTENCES}"
+    for part in (EMBEDDING_MODEL, chunking, arabic_content, english_content):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+def read_article(code_directory, file_name):
+    """
+    Reads an Arabic article and its English translation and prepares the document.
+
     Parameters:
         code_directory (str): The path to the code directory.
-        batch_size (int): The number of documents to process in each embedding batch.
+        file_name (str): The Arabic article file name.
+
+    Returns:
+        dict: The document without its embedding, or None if the translation is missing.
     """
     code_name = os.path.basename(code_directory)  # Code name is the folder name
     code_translation = CODE_NAME_TRANSLATIONS.get(code_name, code_name)  # Get translation if available
-    documents = []  # Temporary storage for documents to insert
-
-    # Process each file in the directory
-    for file_name in os.listdir(code_directory):
-        if not file_name.endswith(".txt"):
-            continue
-
-        # Determine the article name
-        article_number = file_name.split('.')[0]
-        article_name = f"Article {article_number}"  # Example: Article 1
-
-        # Read Arabic content
-        arabic_file_path = os.path.join(code_directory, file_name)
-        with open(arabic_file_path, "r", encoding="utf-8") as arabic_file:
-            arabic_content = arabic_file.read().strip()
-
-        # Find the translated English file
-        translated_folder_path = os.path.join(code_directory, "translated")
-        translated_file_name = file_name.replace(".txt", "_translated.txt")
-        translated_file_path = os.path.join(translated_folder_path, translated_file_name)
-
-        if not os.path.isfile(translated_file_path):
-            print(f"Translated file not found: {translated_file_path}")
-            continue
-
-        # Read English content
-        with open(translated_file_path, "r", encoding="utf-8") as translated_file:
-            english_content = translated_file.read().strip()
-
-        # Add code name and article name to the content
-        arabic_content = f"{code_translation.split(' - ')[-1]} - الفصل {article_number}\n{arabic_content}"
-        english_content = f"{code_translation.split(' - ')[0]} - {article_name}\n{english_content}"
-
-        # Prepare the document
-        document = {
-            "code_name": code_name,
-            "article_name": article_name,
-            "content_arabic": arabic_content,
-            "content_english": english_content,
-        }
-        documents.append(document)
-
-    # Batch process embeddings for English content
-    content_batch = [doc["content_english"] for doc in documents]
-    embeddings = embedding_model.encode(
-        content_batch,
-        batch_size=batch_size,
-        convert_to_numpy=True,
-        show_progress_bar=True,
-        normalize_embeddings=True  # Normalize for consistency with retrieval pipeline
-    )
 
-    # Add embeddings and insert documents into MongoDB
-    for doc, embedding in zip(documents, embeddings):
-        doc["embedding_english"] = embedding.tolist()
+    # Determine the article name
+    article_number = file_name.split('.')[0]
+    article_name = f"Article {article_number}"  # Example: Article 1
 
-        # Avoid duplicate inserts
-        if collection.find_one({"code_name": doc["code_name"], "article_name": doc["article_name"]}):
-            print(f"Document already exists: {doc['article_name']} in {doc['code_name']}")
-            continue
+    # Find the translated English file
+    translated_file_name = file_name.replace(".txt", "_translated.txt")
+    translated_file_path = os.path.join(code_directory, "translated", translated_file_name)
+    if not os.path.isfile(translated_file_path):
+        print(f"Translated file not found: {translated_file_path}")
+        return None
 
-        collection.insert_one(doc)
+    # Read Arabic and English content
+    with open(os.path.join(code_directory, file_name), "r", encoding="utf-8") as arabic_file:
+        arabic_content = arabic_file.read().strip()
+    with open(translated_file_path, "r", encoding="utf-8") as translated_file:
+        english_content = translated_file.read().strip()
 
-    print(f"The following code has been processed, embedded, and inserted: {code_name}")
+    # Add code name and article name to the content
+    arabic_content = f"{code_translation.split(' - ')[-1]} - الفصل {article_number}\n{arabic_content}"
+    header = f"{code_translation.split(' - ')[0]} - {article_name}"
+    chunks = chunk_text(english_content, sentence_tokenizer, CHUNK_MAX_WORDS, CHUNK_OVERLAP_SENTENCES)
+    english_content = f"{header}\n{english_content}"
 
-def process_all_code_directories(base_directory, batch_size=16):
+    return {
+        "code_name": code_name,
+        "article_name": article_name,
+        "content_arabic": arabic_content,
+        "content_english": english_content,
+        "content_hash": content_hash(arabic_content, english_content),
+        # Articles that fit in one window are retrieved whole
+        "passages": [f"{header}\n{chunk}" for chunk in chunks] if len(chunks) > 1 else [],
+    }
+
+def list_article_files(base_directory):
+    """Yields (code_directory, file_name) for every Arabic article under the base directory."""
+    for folder_name in sorted(os.listdir(base_directory)):
+        code_directory = os.path.join(base_directory, folder_name)
+        if os.path.isdir(code_directory):
+            for file_name in sorted(os.listdir(code_directory)):
+                if file_name.endswith(".txt"):
+                    yield code_directory, file_name
+
+def embed_and_write(documents, batch_size=EMBEDDING_BATCH_SIZE):
     """
-    Processes all code directories within the given base directory.
-    
+    Embeds a batch of new or changed documents, with their passages, and upserts them
+    in one bulk write. Passages are stored inside their article document.
+
+    Parameters:
+        documents (list): Documents prepared by read_article.
+        batch_size (int): The number of documents per embedding forward pass.
+    """
+    texts = []
+    for doc in documents:
+        texts.append(doc["content_english"])
+        texts.extend(doc["passages"])
+    embeddings = resources.embedding_model.encode(
+        texts,
+        batch_size=batch_size,
+        convert_to_numpy=True,
+        normalize_embeddings=True  # Normalize for consistency with retrieval pipeline
+    )
+    updated_at = datetime.now(timezone.utc)
+    operations = []
+    position = 0
+    for doc in documents:
+        passages = [
+            {
+                "content_english": text,
+                "embedding_english": encode_embedding(embedding, EMBEDDING_STORAGE_DTYPE),
+            }
+            for text, embedding in zip(doc["passages"], embeddings[position + 1:position + 1 + len(doc["passages"])])
+        ]
+        operations.append(UpdateOne(
+            {"code_name": doc["code_name"], "article_name": doc["article_name"]},
+            {"$set": {
+                **doc,
+                "embedding_english": encode_embedding(embeddings[position], EMBEDDING_STORAGE_DTYPE),
+                "passages": passages,
+                "updated_at": updated_at,
+            }},
+            upsert=True,
+        ))
+        position += 1 + len(doc["passages"])
+    resources.collection.bulk_write(operations, ordered=False)
+
+def process_all_code_directories(base_directory, batch_size=EMBEDDING_BATCH_SIZE):
+    """
+    Ingests every article under the base directory. Files are read by a thread pool,
+    articles whose content hash is unchanged are skipped, and new or changed articles
+    are embedded and upserted in batches of WRITE_BATCH_SIZE.
+
     Parameters:
         base_directory (str): The path to the base directory containing code directories.
-        batch_size (int): The number of documents to process in each embedding batch.
+        batch_size (int): The number of documents per embedding forward pass.
     """
-    for folder_name in os.listdir(base_directory):
-        code_directory = os.path.join(base_directory, folder_name)
-        if os.path.isdir(code_directory):
-            print(f"Processing code directory: {folder_name}")
-            process_and_embed_code_directory(code_directory, batch_size=batch_size)
+    start = time.perf_counter()
+    known_hashes = {
+        (doc["code_name"], doc["article_name"]): doc.get("content_hash")
+        for doc in resources.collection.find({}, {"code_name": 1, "article_name": 1, "content_hash": 1})
+    }
+    print(f"Found {len(known_hashes)} articles already in MongoDB.")
+
+    read, skipped, written = 0, 0, 0
+    pending = []
+    files = list(list_article_files(base_directory))
+    with ThreadPoolExecutor(max_workers=READER_WORKERS) as pool:
+        for doc in tqdm(pool.map(lambda args: read_article(*args), files), total=len(files), desc="Ingesting"):
+            if doc is None:
+                continue
+            read += 1
+            if known_hashes.get((doc["code_name"], doc["article_name"])) == doc["content_hash"]:
+                skipped += 1
+                continue
+            pending.append(doc)
+            if len(pending) >= WRITE_BATCH_SIZE:
+                embed_and_write(pending, batch_size=batch_size)
+                written += len(pending)
+                pending = []
+    if pending:
+        embed_and_write(pending, batch_size=batch_size)
+        written += len(pending)
+
+    elapsed = time.perf_counter() - start
+    print(
+        f"Read {read} articles in {elapsed:.1f}s ({read / elapsed if elapsed else 0.0:.1f} articles/sec): "
+        f"{written} new or changed articles embedded and upserted, {skipped} unchanged articles skipped."
+    )
 
-# Set the base directory relative to this script (Database folder is alongside this file)
-base_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Data base")
-process_all_code_directories(base_directory, batch_size=16)
+if __name__ == "__main__":
+    # Set the base directory relative to this script (Database folder is alongside this file)
+    base_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Data base")
+    timings = resources.load()
+    print("Loaded " + ", ".join(f"{name} in {timing['ms']:.0f} ms" for name, timing in timings.items()))
+    process_all_code_directories(base_directory)
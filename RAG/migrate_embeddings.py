@@ -0,0 +1,92 @@
+"""
+Convert the stored article embeddings to the compact binary encoding of app/codec.py.
+
+Legacy documents store `embedding_english`, and the `embedding_english` of each of
+their `passages`, as BSON arrays of doubles. This script rewrites them in place as
+BSON Binary (float32 or float16), in bulk batches. Article
+content and `updated_at` are left untouched, so nothing is re-embedded; the next API
+start rebuilds its snapshot because the collection fingerprint changes.
+
+    python migrate_embeddings.py --dtype float16
+"""
+
+import os
+import time
+import argparse
+from pymongo import MongoClient, UpdateOne
+from tqdm.auto import tqdm
+from app.codec import decode_embedding, encode_embedding, is_encoded, DTYPES
+
+MONGODB_URI = os.getenv('MONGODB_URI', 'mongodb://localhost:27017/')
+MONGODB_DB = os.getenv('MONGODB_DB', 'rag_system_project')
+MONGODB_COLLECTION = os.getenv('MONGODB_COLLECTION', 'articles')
+
+
+def encode_stored(embedding, dtype):
+    """Encode a stored embedding (array or binary) with the target dtype."""
+    return encode_embedding(decode_embedding(embedding), dtype)
+
+
+def migrate(collection, dtype="float32", batch_size=1000, reencode=False):
+    """
+    Rewrite stored article and passage embeddings with the binary encoding.
+
+    Parameters:
+        collection (pymongo.collection.Collection): The articles collection.
+        dtype (str): Target storage precision, 'float32' or 'float16'.
+        batch_size (int): Number of documents per bulk write.
+        reencode (bool): Also re-encode embeddings that are already binary (e.g. to change dtype).
+
+    Returns:
+        int: The number of documents rewritten (article and passage embeddings together).
+    """
+    if reencode:
+        query = {"$or": [{"embedding_english": {"$exists": True}}, {"passages.embedding_english": {"$exists": True}}]}
+    else:
+        # Binary values have no element 0; arrays of doubles do
+        query = {"$or": [{"embedding_english": {"$type": "array"}}, {"passages.embedding_english.0": {"$exists": True}}]}
+    total = collection.count_documents(query)
+    print(f"{total} documents with embeddings to migrate to {dtype}.")
+
+    start = time.perf_counter()
+    migrated = 0
+    operations = []
+    def pending(embedding):
+        if embedding is None:
+            return False
+        return reencode if is_encoded(embedding) else bool(len(embedding))
+
+    for doc in tqdm(collection.find(query, {"embedding_english": 1, "passages": 1}), total=total, desc="Migrating"):
+        update = {}
+        if pending(doc.get("embedding_english")):
+            update["embedding_english"] = encode_stored(doc["embedding_english"], dtype)
+        passages = doc.get("passages") or []
+        if any(pending(passage.get("embedding_english")) for passage in passages):
+            update["passages"] = [
+                {**passage, "embedding_english": encode_stored(passage["embedding_english"], dtype)}
+                if pending(passage.get("embedding_english")) else passage
+                for passage in passages
+            ]
+        if not update:
+            continue
+        operations.append(UpdateOne({"_id": doc["_id"]}, {"$set": update}))
+        if len(operations) >= batch_size:
+            migrated += collection.bulk_write(operations, ordered=False).modified_count
+            operations = []
+    if operations:
+        migrated += collection.bulk_write(operations, ordered=False).modified_count
+
+    elapsed = time.perf_counter() - start
+    print(f"Migrated the embeddings of {migrated} documents in {elapsed:.1f}s.")
+    return migrated
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dtype", choices=list(DTYPES), default="float32")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--reencode", action="store_true", help="Also re-encode embeddings that are already binary")
+    args = parser.parse_args()
+
+    collection = MongoClient(MONGODB_URI)[MONGODB_DB][MONGODB_COLLECTION]
+    migrate(collection, dtype=args.dtype, batch_size=args.batch_size, reencode=args.reencode)
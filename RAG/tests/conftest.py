@@ -0,0 +1,9 @@
+# tests/conftest.py
+
+import os
+import sys
+
+# Run the app against the in-process LLM backend; tests pass their own stub clients
+os.environ.setdefault("LLM_BACKEND", "fake")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
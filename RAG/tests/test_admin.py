@@ -0,0 +1,34 @@
+# tests/test_admin.py
+
+import pytest
+from fastapi.testclient import TestClient
+from app import main
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "s3cret")
+    monkeypatch.setattr(main, "refresh_index", lambda: {"mode": "incremental", "changed": False})
+    # Not used as a context manager: the startup event (models, MongoDB) does not run
+    return TestClient(main.app)
+
+
+def test_refresh_requires_the_token(client):
+    assert client.post("/admin/refresh").status_code == 401
+    assert client.post("/admin/refresh", headers={"Authorization": "Bearer wrong"}).status_code == 401
+    assert client.post("/admin/refresh", headers={"Authorization": "s3cret"}).status_code == 401
+
+
+def test_refresh_with_the_token(client):
+    response = client.post("/admin/refresh", headers={"Authorization": "Bearer s3cret"})
+    assert response.status_code == 200
+    assert response.json() == {"mode": "incremental", "changed": False}
+
+
+def test_refresh_is_disabled_without_a_configured_token(client, monkeypatch):
+    monkeypatch.setattr(main, "ADMIN_TOKEN", None)
+    assert client.post("/admin/refresh", headers={"Authorization": "Bearer s3cret"}).status_code == 403
+
+
+def test_refresh_has_no_get_route(client):
+    assert client.get("/admin/refresh", headers={"Authorization": "Bearer s3cret"}).status_code == 405
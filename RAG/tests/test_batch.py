@@ -0,0 +1,61 @@
+# tests/test_batch.py
+
+import asyncio
+from types import SimpleNamespace
+import numpy as np
+import pytest
+from app import rag
+from app.cache import AnswerCache
+from app.models import QueryRequest
+from app.pipeline import PipelineMetrics
+
+
+@pytest.fixture
+def batch_pipeline(monkeypatch):
+    """arag_batch with stub LLM calls and retrieval; returns the recorded pipeline metrics."""
+    async def preflight(query, conversation, client=None):
+        if query == "hello":
+            return {"is_legal": False, "casual_response": "Hello!"}
+        return {
+            "is_legal": True, "casual_response": "", "language": "ENGLISH", "english_query": query,
+            "enhanced_query": query, "relevant_codes": ["code-travail"] if "salary" in query else None,
+        }
+
+    async def document_routing(query):
+        return ["code-penal"]
+
+    async def generate_answer(query, *args, **kwargs):
+        return f"answer to {query}", []
+
+    metrics = PipelineMetrics()
+    monkeypatch.setattr(rag, "apreflight", preflight)
+    monkeypatch.setattr(rag, "adocument_routing", document_routing)
+    monkeypatch.setattr(rag, "agenerate_answer", generate_answer)
+    monkeypatch.setattr(rag, "ROUTER_MODE", "llm")
+    monkeypatch.setattr(rag, "encode_queries", lambda texts: np.zeros((len(texts), 4), dtype=np.float32))
+    monkeypatch.setattr(rag, "retrieve_documents_batch", lambda queries, *args: [[(0, 1.0)] for _ in queries])
+    monkeypatch.setattr(rag, "generation", SimpleNamespace(code_indices={"code-penal": None, "code-travail": None}))
+    monkeypatch.setattr(rag, "answer_cache", AnswerCache())
+    monkeypatch.setattr(rag, "pipeline_metrics", metrics)
+    return metrics
+
+
+def test_every_batch_request_records_its_stages(batch_pipeline):
+    requests = [QueryRequest(query=query) for query in ("What is the salary?", "hello", "What is theft?")]
+
+    async def main():
+        return [result async for result in rag.arag_batch(requests)]
+
+    results = {position: result for position, result, _ in asyncio.run(main())}
+    assert results == {0: ("answer to What is the salary?", []), 1: ("Hello!", []), 2: ("answer to What is theft?", [])}
+
+    summary = batch_pipeline.summary()
+    assert summary["requests"] == 3
+    stages = summary["stages"]
+    assert stages["preflight"]["runs"] == 3
+    assert {name: stages[name]["runs"] for name in ("cache_embedding", "retrieval", "answer")} == {
+        "cache_embedding": 2, "retrieval": 2, "answer": 2,
+    }
+    # Only the query the pre-flight call did not route is routed with Gemini
+    assert stages["routing"]["runs"] == 1
+    assert all(stages[name]["cancelled"] == 0 for name in stages)
@@ -0,0 +1,81 @@
+# tests/test_batching.py
+
+import time
+import asyncio
+import threading
+import pytest
+from app.batching import MicroBatcher
+
+
+def slow_double(items, calls=None, delay=0.05):
+    if calls is not None:
+        calls.append(list(items))
+    time.sleep(delay)
+    return [2 * item for item in items]
+
+
+def test_concurrent_submissions_share_a_batch():
+    calls = []
+    batcher = MicroBatcher("test", lambda items: slow_double(items, calls, 0), max_batch_size=8, max_wait_ms=50)
+    results = {}
+
+    def submit(i):
+        results[i] = batcher.submit([i])
+
+    threads = [threading.Thread(target=submit, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=5)
+    assert results == {i: [2 * i] for i in range(4)}
+    assert sum(len(items) for items in calls) == 4
+    assert len(calls) < 4
+
+
+def test_cancelled_caller_does_not_break_the_batch():
+    calls = []
+    batcher = MicroBatcher("test", lambda items: slow_double(items, calls), max_batch_size=8, max_wait_ms=20)
+
+    async def main():
+        # The first batch is running while these are queued together
+        busy = asyncio.ensure_future(batcher.asubmit([0]))
+        await asyncio.sleep(0.01)
+        cancelled = asyncio.ensure_future(batcher.asubmit([1]))
+        kept = asyncio.ensure_future(batcher.asubmit([2]))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        done = await asyncio.wait_for(asyncio.gather(busy, kept), timeout=5)
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+        return done
+
+    assert asyncio.run(main()) == [[0], [4]]
+    assert [1] not in calls
+    # The worker survives and serves later submissions
+    assert batcher.submit([3]) == [6]
+    assert batcher._worker.is_alive()
+
+
+def test_cancelled_while_running_is_ignored():
+    batcher = MicroBatcher("test", slow_double, max_batch_size=8, max_wait_ms=1)
+
+    async def main():
+        first = asyncio.ensure_future(batcher.asubmit([1]))
+        second = asyncio.ensure_future(batcher.asubmit([2]))
+        await asyncio.sleep(0.02)  # both are in the running batch
+        first.cancel()
+        return await asyncio.wait_for(second, timeout=5)
+
+    assert asyncio.run(main()) == [4]
+    assert batcher.submit([5]) == [10]
+    assert batcher._worker.is_alive()
+
+
+def test_batch_error_reaches_every_caller():
+    def fail(items):
+        raise RuntimeError("model failed")
+
+    batcher = MicroBatcher("test", fail, max_batch_size=8, max_wait_ms=1)
+    with pytest.raises(RuntimeError, match="model failed"):
+        batcher.submit([1])
+    assert batcher._worker.is_alive()
@@ -0,0 +1,62 @@
+# tests/test_bm25.py
+
+import numpy as np
+import pytest
+from app.bm25 import SparseBM25, verify_against_okapi
+
+rank_bm25 = pytest.importorskip("rank_bm25")
+
+CORPUS = [
+    "the employer pays the salary the salary is due monthly",
+    "the tenant pays the rent to the landlord",
+    "the court pronounces the divorce after reconciliation",
+    "the salary of the employee includes the bonus bonus bonus",
+    "the driver needs a license the license is renewed",
+]
+
+QUERIES = [
+    "salary",
+    "the",                       # in every document: negative IDF, floored to epsilon * average IDF
+    "the salary salary bonus",   # repeated query terms
+    "pays rent landlord",
+    "unknown words only",        # out of vocabulary
+    "divorce unknown the",       # mixed
+    "",
+]
+
+
+@pytest.fixture
+def engines():
+    corpus = [text.split() for text in CORPUS]
+    return SparseBM25.from_corpus(corpus), rank_bm25.BM25Okapi(corpus)
+
+
+def test_scores_match_okapi(engines):
+    engine, okapi = engines
+    assert engine.idf[engine.term_ids["the"]] == pytest.approx(okapi.idf["the"])
+    for query in QUERIES:
+        tokens = query.split()
+        np.testing.assert_allclose(engine.get_scores(tokens), okapi.get_scores(tokens), rtol=1e-9, atol=1e-9)
+    assert verify_against_okapi(engine, okapi, [query.split() for query in QUERIES]) <= 1e-9
+
+
+def test_negative_idf_is_floored(engines):
+    engine, okapi = engines
+    # Terms found in more than half of the documents get epsilon * average IDF, as in BM25Okapi
+    assert engine.idf[engine.term_ids["the"]] > 0
+    assert okapi.idf["the"] == pytest.approx(okapi.epsilon * okapi.average_idf)
+
+
+def test_round_trip_through_okapi(engines):
+    engine, _ = engines
+    okapi = engine.to_okapi()
+    tokens = "the salary bonus".split()
+    np.testing.assert_allclose(engine.get_scores(tokens), okapi.get_scores(tokens), rtol=1e-9, atol=1e-9)
+
+
+def test_updated_engine_matches_okapi_on_the_edited_corpus(engines):
+    engine, _ = engines
+    added = ["the landlord raises the rent", "the the the"]
+    updated = engine.update(np.asarray([0, 2, 4]), [text.split() for text in added])
+    okapi = rank_bm25.BM25Okapi([CORPUS[i].split() for i in (0, 2, 4)] + [text.split() for text in added])
+    assert verify_against_okapi(updated, okapi, [query.split() for query in QUERIES]) <= 1e-9
@@ -0,0 +1,26 @@
+# tests/test_cache.py
+
+import numpy as np
+from app.cache import AnswerCache
+
+
+def test_search_overrides_are_part_of_the_key():
+    cache = AnswerCache()
+    cache.set_version("v1")
+    cache.set("What is the VAT rate?", "ENGLISH", 5, "default", search_params={"fusion": None, "nprobe": None})
+    cache.set("What is the VAT rate?", "ENGLISH", 5, "weighted", search_params={"fusion": "weighted", "nprobe": None})
+
+    assert cache.get("what is the  VAT rate?", "english", 5) == "default"
+    assert cache.get("What is the VAT rate?", "ENGLISH", 5, search_params={"fusion": None}) == "default"
+    assert cache.get("What is the VAT rate?", "ENGLISH", 5, search_params={"fusion": "weighted"}) == "weighted"
+    assert cache.get("What is the VAT rate?", "ENGLISH", 5, search_params={"fusion": "rrf"}) is None
+
+
+def test_semantic_hit_requires_the_same_search_settings():
+    cache = AnswerCache(similarity_threshold=0.9)
+    cache.set_version("v1")
+    embedding = np.ones(8, dtype=np.float32) / np.sqrt(8)
+    cache.set("What is the VAT rate?", "ENGLISH", 5, "pool 20", embedding=embedding, search_params={"candidate_pool": 20})
+
+    assert cache.get("VAT rate?", "ENGLISH", 5, embedding=embedding, search_params={"candidate_pool": 20}) == "pool 20"
+    assert cache.get("VAT rate?", "ENGLISH", 5, embedding=embedding) is None
@@ -0,0 +1,41 @@
+# tests/test_lexicon.py
+
+import os
+import sys
+import subprocess
+import numpy as np
+from app.lexicon import SynonymLexicon
+
+
+def lexicon():
+    """Every query term has equal-weight synonyms, so only the tie-break orders them."""
+    terms = ["employer", "boss", "chief", "head", "salary", "pay", "wage"]
+    rows = {"employer": ["head", "chief", "boss"], "salary": ["wage", "pay"]}
+    indptr, synonyms = [0], []
+    for term in terms:
+        synonyms.extend(terms.index(synonym) for synonym in rows.get(term, []))
+        indptr.append(len(synonyms))
+    return SynonymLexicon(
+        terms, np.asarray(indptr), np.asarray(synonyms, dtype=np.int32), np.ones(len(synonyms), dtype=np.float32)
+    )
+
+
+def test_equal_weights_are_ordered_by_synonym():
+    assert lexicon().expand(["salary", "employer", "salary"], max_terms=3) == ["boss", "chief", "head"]
+    assert lexicon().expand(["Employer", "boss"], max_terms=10) == ["chief", "head"]
+
+
+def test_expansion_is_the_same_in_every_process():
+    script = (
+        "from tests.test_lexicon import lexicon; "
+        "print(lexicon().expand(['wage', 'salary', 'employer', 'chief'], max_terms=3))"
+    )
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    outputs = {
+        subprocess.run(
+            [sys.executable, "-c", script], cwd=root, capture_output=True, text=True, check=True,
+            env={**os.environ, "PYTHONHASHSEED": str(seed)},
+        ).stdout
+        for seed in range(5)
+    }
+    assert outputs == {"['boss', 'head', 'pay']\n"}
@@ -0,0 +1,58 @@
+# tests/test_memo.py
+
+import time
+import threading
+from app.memo import Memoizer
+
+
+def test_memoized_none_is_a_hit():
+    memo = Memoizer()
+    calls = []
+
+    @memo.memoize("none", ttl=60)
+    def nothing(x):
+        calls.append(x)
+        return None
+
+    assert nothing(1) is None
+    assert nothing(1) is None
+    assert calls == [1]
+    assert memo.stats()["none"]["hits"] == 1
+
+
+def test_expired_entry_is_recomputed():
+    memo = Memoizer()
+    calls = []
+
+    @memo.memoize("short", ttl=0.01)
+    def double(x):
+        calls.append(x)
+        return 2 * x
+
+    assert double(2) == 4
+    time.sleep(0.02)
+    assert double(2) == 4
+    assert calls == [2, 2]
+    assert memo.stats()["short"]["hits"] == 0
+
+
+def test_counters_under_concurrent_calls():
+    memo = Memoizer()
+
+    @memo.memoize("square", ttl=60)
+    def square(x):
+        return x * x
+
+    square(3)
+
+    def hammer():
+        for _ in range(1000):
+            square(3)
+
+    threads = [threading.Thread(target=hammer) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats = memo.stats()["square"]
+    assert (stats["hits"], stats["misses"]) == (8000, 1)
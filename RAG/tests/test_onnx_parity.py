@@ -0,0 +1,49 @@
+# tests/test_onnx_parity.py
+"""
+The int8 ONNX Runtime encoders must reproduce the PyTorch ones (see also
+benchmarks/onnx_parity.py, which reports the fp32 export too). Skipped unless the
+optional ONNX dependencies (requirements-onnx.txt) and sentence-transformers are installed.
+"""
+
+import numpy as np
+import pytest
+
+pytest.importorskip("onnxruntime")
+pytest.importorskip("onnx")
+pytest.importorskip("sentence_transformers")
+
+from app.inference import load_cross_encoder, load_sentence_encoder
+from benchmarks.onnx_parity import CROSS_ENCODER_MODEL, EMBEDDING_MODEL, SAMPLE_DOCUMENTS, SAMPLE_QUERIES
+
+MIN_COSINE_INT8 = 0.99
+SCORE_TOLERANCE_INT8 = 0.5
+
+PAIRS = [(query, document) for query in SAMPLE_QUERIES for document in SAMPLE_DOCUMENTS]
+
+
+@pytest.fixture(scope="module")
+def onnx_options(tmp_path_factory):
+    return {"backend": "onnx", "cache_dir": str(tmp_path_factory.mktemp("onnx_models")), "quantize": True}
+
+
+def embed(model):
+    return model.encode(SAMPLE_QUERIES + SAMPLE_DOCUMENTS, batch_size=16, convert_to_numpy=True, normalize_embeddings=True)
+
+
+def rerank(model):
+    scores = np.asarray(model.predict(PAIRS, batch_size=32), dtype=np.float32)
+    return scores.reshape(len(SAMPLE_QUERIES), len(SAMPLE_DOCUMENTS))
+
+
+def test_int8_embeddings_match_torch(onnx_options):
+    reference = embed(load_sentence_encoder(EMBEDDING_MODEL, "torch"))
+    embeddings = embed(load_sentence_encoder(EMBEDDING_MODEL, **onnx_options))
+    assert embeddings.shape == reference.shape
+    assert np.sum(embeddings * reference, axis=1).min() >= MIN_COSINE_INT8
+
+
+def test_int8_rerank_scores_match_torch(onnx_options):
+    reference = rerank(load_cross_encoder(CROSS_ENCODER_MODEL, "torch"))
+    scores = rerank(load_cross_encoder(CROSS_ENCODER_MODEL, **onnx_options))
+    np.testing.assert_allclose(scores, reference, atol=SCORE_TOLERANCE_INT8)
+    np.testing.assert_array_equal(scores.argmax(axis=1), reference.argmax(axis=1))
@@ -0,0 +1,67 @@
+# tests/test_passages.py
+
+import numpy as np
+import faiss
+from app.dense_index import build_dense_index
+from app.passages import PassageIndex
+
+
+def random_corpus(n_articles=30, dimension=16, seed=0):
+    rng = np.random.default_rng(seed)
+    codes = np.asarray([f"code-{i % 3}" for i in range(n_articles)], dtype=str)
+    article_passages = []
+    for article_id in range(n_articles):
+        vectors = rng.normal(size=(1 + article_id % 3, dimension)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        article_passages.append([(f"{article_id}-{row}", vector) for row, vector in enumerate(vectors)])
+    return article_passages, codes, rng
+
+
+def brute_force_search(passages, query, k, codes):
+    """Best passage score of each article of the routed codes, computed directly."""
+    allowed = np.flatnonzero(np.isin(passages.passage_codes, codes))
+    scores = passages.embeddings[allowed] @ query
+    best = {}
+    for passage_id, score in zip(allowed.tolist(), scores.tolist()):
+        article_id = int(passages.parent[passage_id])
+        best[article_id] = max(best.get(article_id, -np.inf), score)
+    ranked = sorted(best.items(), key=lambda item: -item[1])[:k]
+    return np.asarray([score for _, score in ranked]), np.asarray([article_id for article_id, _ in ranked])
+
+
+def test_routed_search_uses_code_sub_indices():
+    article_passages, codes, rng = random_corpus()
+    passages = PassageIndex.from_articles(article_passages, codes, build_dense_index)
+    assert passages.exact
+    assert all(isinstance(sub_index, faiss.IndexFlatIP) for sub_index, _ in passages.code_indices.values())
+
+    query = rng.normal(size=16).astype(np.float32)
+    query /= np.linalg.norm(query)
+    scores, article_ids, passage_ids = passages.search(query, 5, ["code-1", "code-2"])
+    assert set(codes[article_ids]) <= {"code-1", "code-2"}
+    assert (passages.parent[passage_ids] == article_ids).all()
+
+    expected = brute_force_search(passages, query, 5, ["code-1", "code-2"])
+    np.testing.assert_allclose(scores, expected[0], rtol=1e-5)
+    np.testing.assert_array_equal(article_ids, expected[1])
+
+
+def test_update_keeps_sub_indices_aligned():
+    article_passages, codes, rng = random_corpus()
+    passages = PassageIndex.from_articles(article_passages, codes, build_dense_index)
+    untouched = passages.code_indices["code-2"][0]
+
+    # Drop an article of code-0 and append one to code-1
+    keep = np.asarray([i for i in range(len(codes)) if i != 3])
+    new_vector = rng.normal(size=16).astype(np.float32)
+    new_vector /= np.linalg.norm(new_vector)
+    new_codes = np.concatenate([codes[keep], ["code-1"]])
+    updated = passages.update(keep, [[("new", new_vector)]], new_codes)
+
+    assert updated.code_indices["code-2"][0] is untouched
+    for code, (sub_index, ids) in updated.code_indices.items():
+        assert sub_index.ntotal == len(ids)
+        assert (new_codes[updated.parent[ids]] == code).all()
+    _, article_ids, passage_ids = updated.search(new_vector, 1, ["code-1"])
+    assert article_ids.tolist() == [len(keep)]
+    assert updated.texts[int(passage_ids[0])] == "new"
@@ -0,0 +1,134 @@
+# tests/test_pipeline.py
+
+import asyncio
+import threading
+import pytest
+from app import rag
+from app.pipeline import StageGraph
+
+
+@pytest.fixture
+def step_calls(monkeypatch):
+    """Make the pre-flight call fail so the query is understood with the per-step calls."""
+    async def no_preflight(query, conversation, client=None):
+        return None
+
+    async def detect(query):
+        return "ENGLISH", "What is the VAT rate?"
+
+    async def enhance(query, conversation):
+        return query
+
+    monkeypatch.setattr(rag, "apreflight", no_preflight)
+    monkeypatch.setattr(rag, "adetect_language_and_translate", detect)
+    monkeypatch.setattr(rag, "amake_query_better", enhance)
+
+
+def understand(monkeypatch, query, early, speculate):
+    async def early_response(query, conversation):
+        return early
+
+    monkeypatch.setattr(rag, "aearly_response", early_response)
+    return run_understanding(query, speculate)
+
+
+def run_understanding(query, speculate):
+    """Understand a query; returns (understood, stage report, stage graph)."""
+    async def main():
+        graph = StageGraph()
+        try:
+            understood = await rag.aunderstand_query(query, "", graph, speculate=speculate)
+            # Let a speculation that is still needed finish, as retrieval would
+            if "speculative_retrieval" in graph and not graph.tasks["speculative_retrieval"].cancelled():
+                await asyncio.wait({graph.tasks["speculative_retrieval"]})
+            return understood, graph.report(), graph
+        finally:
+            graph.close()
+
+    return asyncio.run(main())
+
+
+def recording_speculation(delay=0.05):
+    """A speculate callback recording the queries it started and finished."""
+    started, finished = [], []
+
+    async def speculate(english_query):
+        started.append(english_query)
+        await asyncio.sleep(delay)
+        finished.append(english_query)
+        return {"query": english_query}
+
+    return started, finished, speculate
+
+
+def preflight_answer(verdict, delay=0.05):
+    async def preflight(query, conversation, client=None):
+        await asyncio.sleep(delay)
+        return verdict
+
+    return preflight
+
+
+LEGAL = {
+    "is_legal": True, "casual_response": "", "language": "ENGLISH",
+    "english_query": "What is the VAT rate?", "enhanced_query": "What is the VAT rate?", "relevant_codes": None,
+}
+
+
+def test_retrieval_overlaps_classification(monkeypatch):
+    monkeypatch.setattr(rag, "apreflight", preflight_answer(LEGAL))
+    started, finished, speculate = recording_speculation()
+    understood, report, _ = run_understanding("What is the VAT rate?", speculate)
+
+    stages = report["stages"]
+    preflight_end = stages["preflight"]["start_ms"] + stages["preflight"]["duration_ms"]
+    assert stages["speculative_retrieval"]["start_ms"] < preflight_end
+    assert understood["speculated_query"] == "What is the VAT rate?"
+    assert finished == ["What is the VAT rate?"]
+
+
+def test_speculation_is_discarded_for_casual_queries(monkeypatch):
+    casual = {"is_legal": False, "casual_response": "Hello!"}
+    monkeypatch.setattr(rag, "apreflight", preflight_answer(casual))
+    started, finished, speculate = recording_speculation(delay=1)
+    understood, report, _ = run_understanding("hello", speculate)
+
+    assert understood["casual_response"] == "Hello!"
+    assert started == ["hello"]
+    assert finished == []
+    assert report["stages"]["speculative_retrieval"]["status"] == "cancelled"
+
+
+def test_arabic_queries_speculate_on_the_translation(step_calls, monkeypatch):
+    started, finished, speculate = recording_speculation(delay=0)
+    understood, _, graph = understand(monkeypatch, "ما هي نسبة الأداء على القيمة المضافة؟", ("TRUE", ""), speculate)
+    assert understood["english_query"] == "What is the VAT rate?"
+    assert understood["speculated_query"] == "What is the VAT rate?"
+    assert started == ["What is the VAT rate?"]
+
+
+def test_casual_verdict_of_the_fallback_discards_speculation(step_calls, monkeypatch):
+    started, finished, speculate = recording_speculation(delay=1)
+    understood, report, _ = understand(monkeypatch, "hello", ("FALSE", "Hello!"), speculate)
+    assert understood == {"casual_response": "Hello!"}
+    assert finished == []
+    assert report["stages"]["speculative_retrieval"]["status"] == "cancelled"
+
+
+def test_cancelled_cpu_stage_holds_its_slot_until_it_returns(monkeypatch):
+    monkeypatch.setattr(rag, "CPU_QUEUE_SIZE", 1)
+    monkeypatch.setattr(rag, "_cpu_slots", None)
+    release = threading.Event()
+
+    async def main():
+        running = asyncio.ensure_future(rag.run_cpu(release.wait, 5))
+        await asyncio.sleep(0.05)
+        running.cancel()
+        waiting = asyncio.ensure_future(rag.run_cpu(lambda: "done"))
+        await asyncio.sleep(0.05)
+        # The cancelled call still runs in the executor, so the only slot is taken
+        assert not waiting.done()
+        release.set()
+        return await asyncio.wait_for(waiting, timeout=5)
+
+    assert asyncio.run(main()) == "done"
@@ -0,0 +1,105 @@
+# tests/test_preflight.py
+
+import os
+import json
+import asyncio
+from types import SimpleNamespace
+import pytest
+from app import rag
+from app.legal_codes import LEGAL_CODES
+from app.llm import FakeBackend, LLMClient
+
+
+def stub_client(response_text):
+    """An LLM client whose backend answers every prompt with response_text."""
+    return LLMClient(FakeBackend(latency=0, responder=lambda prompt: response_text), max_retries=0)
+
+
+LEGAL = {
+    "is_legal": True,
+    "casual_response": "",
+    "language": "ENGLISH",
+    "english_query": "What is the VAT rate?",
+    "enhanced_query": "What is the value added tax rate applicable in Tunisia?",
+    "relevant_codes": ["code-taxe-sur-valeur-ajoutee"],
+}
+
+CASUAL = {
+    "is_legal": False,
+    "casual_response": "Hello! I am HouyemAI, how can I help you?",
+    "language": "ENGLISH",
+    "english_query": "hello",
+    "enhanced_query": "",
+}
+
+
+@pytest.fixture
+def llm_routing(monkeypatch):
+    """Route with the pre-flight call (relevant_codes is only parsed when ROUTER_MODE is not 'local')."""
+    monkeypatch.setattr(rag, "ROUTER_MODE", "llm")
+
+
+def test_legal_query(llm_routing):
+    result = rag.preflight("What is the VAT rate?", "", client=stub_client(json.dumps(LEGAL)))
+    assert result == LEGAL
+
+
+def test_casual_query():
+    result = rag.preflight("hello", "", client=stub_client(json.dumps(CASUAL)))
+    assert result == {"is_legal": False, "casual_response": CASUAL["casual_response"]}
+
+
+def test_arabic_query_falls_back_to_english_query(llm_routing):
+    response = {**LEGAL, "language": "arabic", "enhanced_query": ""}
+    result = rag.preflight("ما هي نسبة الأداء على القيمة المضافة؟", "", client=stub_client(json.dumps(response)))
+    assert result["language"] == "ARABIC"
+    assert result["enhanced_query"] == LEGAL["english_query"]
+
+
+def test_local_routing_leaves_codes_to_the_router(monkeypatch):
+    monkeypatch.setattr(rag, "ROUTER_MODE", "local")
+    result = rag.preflight("What is the VAT rate?", "", client=stub_client(json.dumps(LEGAL)))
+    assert result["relevant_codes"] is None
+
+
+def test_fenced_json(llm_routing):
+    response = "```json\n" + json.dumps(LEGAL) + "\n```"
+    assert rag.preflight("What is the VAT rate?", "", client=stub_client(response)) == LEGAL
+
+
+def test_codes_outside_the_corpus_are_dropped(llm_routing):
+    response = {**LEGAL, "relevant_codes": ["code-imaginaire", "code-commerce", "code-comptabilite-publique", "VAT"]}
+    result = rag.preflight("What is the VAT rate?", "", client=stub_client(json.dumps(response)))
+    gen = SimpleNamespace(code_indices={"code-commerce": None, "code-comptabilite-publique": None})
+    assert rag.known_codes(result["relevant_codes"], gen) == ["code-commerce", "code-comptabilite-publique"]
+
+
+def test_prompt_lists_the_corpus_codes():
+    codes = set(os.listdir(os.path.join(os.path.dirname(os.path.dirname(__file__)), "Data Base")))
+    assert codes <= set(LEGAL_CODES)
+
+
+@pytest.mark.parametrize("response", [
+    "not json at all",
+    '{"is_legal": true, "language": "ENGLISH"',  # truncated
+    json.dumps(["is_legal", True]),  # not an object
+    json.dumps({**LEGAL, "is_legal": "yes"}),  # is_legal is not a boolean
+    json.dumps({key: value for key, value in LEGAL.items() if key != "language"}),
+    json.dumps({**CASUAL, "casual_response": ""}),  # casual without a reply
+])
+def test_bad_responses_fall_back(llm_routing, response):
+    assert rag.preflight("What is the VAT rate?", "", client=stub_client(response)) is None
+
+
+def test_async_variant(llm_routing):
+    assert asyncio.run(rag.apreflight("What is the VAT rate?", "", client=stub_client(json.dumps(LEGAL)))) == LEGAL
+    assert asyncio.run(rag.apreflight("What is the VAT rate?", "", client=stub_client("{"))) is None
+
+
+def test_casual_verdict_is_understood(monkeypatch):
+    async def preflight(query, conversation, client=None):
+        return rag._parse_preflight(json.dumps(CASUAL), query)
+
+    monkeypatch.setattr(rag, "apreflight", preflight)
+    understood = asyncio.run(rag.aunderstand_query("hello", ""))
+    assert understood == {"casual_response": CASUAL["casual_response"]}
@@ -0,0 +1,94 @@
+# tests/test_refresh.py
+
+import hashlib
+import datetime
+import mongomock
+import numpy as np
+import pytest
+from app import rag
+from app.bm25 import SparseBM25
+from app.dense_index import build_dense_index
+from app.generation import IndexGeneration
+from app.passages import PassageIndex
+from app.resources import LazyResource
+
+STAMP = datetime.datetime(2030, 1, 1, 12, 0, 0)
+
+
+def article(number, updated_at=STAMP):
+    text = f"code-travail Article {number}\nemployer salary contract {number}"
+    embedding = np.zeros(4, dtype=np.float32)
+    embedding[number % 4] = 1.0
+    return {
+        "code_name": "code-travail", "article_name": str(number), "content_english": text,
+        "content_arabic": "", "embedding_english": embedding.tolist(),
+        "content_hash": hashlib.sha1(text.encode("utf-8")).hexdigest(), "updated_at": updated_at,
+    }
+
+
+def fingerprint(collection):
+    """collection_fingerprint without $bsonSize, which mongomock lacks."""
+    docs = sorted(collection.find({}, {"content_hash": 1, "updated_at": 1}), key=lambda doc: doc["_id"])
+    return hashlib.sha1(";".join(f"{d['_id']}:{d['content_hash']}:{d['updated_at']}" for d in docs).encode()).hexdigest()
+
+
+class WriteAfterChangeRead:
+    """A collection proxy that inserts a document right after the refresh reads the changes."""
+
+    def __init__(self, collection, document):
+        self.collection = collection
+        self.document = document
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+    def find(self, filter=None, *args, **kwargs):
+        docs = list(self.collection.find(filter, *args, **kwargs))
+        if self.document is not None and "$or" in (filter or {}):
+            self.collection.insert_one(self.document)
+            self.document = None
+        return docs
+
+
+@pytest.fixture
+def corpus(monkeypatch):
+    collection = mongomock.MongoClient().db.articles
+    collection.insert_many([article(number) for number in range(3)])
+    rows = [rag.article_row(doc) for doc in collection.find()]
+    metadata = {column: [row[column] for row in rows] for column in rag.METADATA_COLUMNS}
+    embeddings = np.asarray([row["embedding"] for row in rows], dtype=np.float32)
+    generation = IndexGeneration(
+        fingerprint(collection), metadata, embeddings, build_dense_index(embeddings),
+        SparseBM25.from_corpus([row["content_english"].lower().split() for row in rows]),
+        updated_at=STAMP, watermark_ids=frozenset(row["doc_id"] for row in rows),
+        passages=PassageIndex.from_articles([row["passages"] for row in rows], metadata["code_name"], build_dense_index),
+    )
+
+    saved = []
+    monkeypatch.setattr(rag, "generation", generation)
+    monkeypatch.setattr(rag, "collection_fingerprint", fingerprint)
+    monkeypatch.setattr(rag, "save_snapshot", lambda version, *args: saved.append(version))
+    monkeypatch.setitem(rag.resources._resources, "word_tokenize", LazyResource("word_tokenize", lambda: str.split))
+    monkeypatch.setattr(rag.answer_cache, "version", None)
+
+    def use(proxy):
+        monkeypatch.setitem(rag.resources._resources, "collection", LazyResource("collection", lambda: proxy))
+
+    return collection, saved, use
+
+
+def test_write_during_refresh_is_not_claimed_by_the_snapshot(corpus):
+    collection, saved, use = corpus
+    collection.insert_one(article(3, STAMP + datetime.timedelta(seconds=1)))
+    late = article(4, STAMP + datetime.timedelta(seconds=2))
+    use(WriteAfterChangeRead(collection, late))
+
+    rag.refresh_index()
+    # The late write is not in this generation, so the saved fingerprint must not describe it
+    assert "4" not in rag.generation.store["article_name"]
+    assert saved[-1] == rag.generation.version != fingerprint(collection)
+
+    # The next refresh picks it up and its snapshot matches the collection
+    rag.refresh_index()
+    assert sorted(rag.generation.store["article_name"]) == ["0", "1", "2", "3", "4"]
+    assert saved[-1] == rag.generation.version == fingerprint(collection)
@@ -0,0 +1,41 @@
+# tests/test_rerank.py
+
+import numpy as np
+import faiss
+from app.generation import IndexGeneration
+from app.rerank import RerankCascade
+
+
+def test_scores_are_cached_per_ids_version():
+    cascade = RerankCascade()
+    first = ("fingerprint", 1)
+    kept, scores, missing = cascade.plan("VAT rate", first, [4, 7])
+    assert missing == [4, 7]
+    cascade.complete("VAT rate", first, scores, missing, [0.9, 0.1])
+
+    assert cascade.plan("vat  rate", first, [4, 7])[1] == {4: 0.9, 7: 0.1}
+    # A refresh renumbers the documents, even when the fingerprint is unchanged
+    assert cascade.plan("VAT rate", ("fingerprint", 2), [4, 7])[2] == [4, 7]
+
+
+def test_refreshes_change_the_ids_version():
+    class Bm25:
+        def update(self, keep, tokens):
+            return self
+
+    metadata = {
+        "doc_id": ["a", "b"], "code_name": ["code-penal", "code-travail"], "article_name": ["1", "2"],
+        "content_english": ["theft", "leave"], "content_arabic": ["", ""],
+    }
+    embeddings = np.eye(2, dtype=np.float32)
+    index = faiss.IndexFlatIP(2)
+    index.add(embeddings)
+    gen = IndexGeneration("fingerprint", metadata, embeddings, index, Bm25())
+    row = {
+        "doc_id": "a", "code_name": "code-penal", "article_name": "1", "content_english": "theft",
+        "content_arabic": "", "embedding": np.asarray([1, 0], dtype=np.float32), "passages": [],
+    }
+    # Re-upserting an article moves it to the end, under the same fingerprint
+    next_gen = gen.apply_changes(["a"], [row], str.split, "fingerprint", None)
+    assert next_gen.doc_positions["a"] != gen.doc_positions["a"]
+    assert next_gen.ids_version != gen.ids_version